@@ -8,7 +8,7 @@ from Chatsupport.code.main import process_and_store_files
 root = os.getcwd()
 
 ALLOWED_FILE_TYPES = [
-    "pdf", "txt", "docx", "html", "htm", "rtf", "jpg", "png", "jpeg", "tiff", "csv", "xls", "xlsx", "xlsb"
+    "pdf", "txt", "docx", "html", "htm", "rtf", "jpg", "png", "jpeg", "tiff", "tif", "csv", "xls", "xlsx", "xlsb"
 ]
 
 MAX_USER_FILES = 3
@@ -54,7 +54,7 @@ def main():
                 with open(file_path, "wb") as f:
                     f.write(uploaded_file.read())
                 static_paths.append(file_path)
-            process_and_store_files(static_paths, STATIC_DATASET_PATH, overwrite=True)
+            process_and_store_files(static_paths, STATIC_DATASET_PATH, overwrite=True, ann=True, incremental=True)
             st.success("Static content processed successfully.")
 
     # User-specific file upload (up to 3 files)
@@ -90,7 +90,7 @@ def main():
                 user_paths.append(file_path)
 
             # Process the uploaded files
-            process_and_store_files(user_paths, user_dataset_path, overwrite=True)
+            process_and_store_files(user_paths, user_dataset_path, overwrite=True, incremental=True)
 
             st.success("User documents processed successfully. You can now ask questions.")
 
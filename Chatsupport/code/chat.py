@@ -4,8 +4,9 @@ import sys
 import json
 import uuid
 from dotenv import load_dotenv
+from External.chunking import chunk_spans
 from Chatsupport.code.vector import DeepLakeManager, add_custom_nodes, query_custom_embedding
-from aih_rag.embeddings.azure_openai import AzureOpenAIEmbedding
+from External.embedding_service import create_embedding_model
 # from structured_output import chat_response
 from openai import AzureOpenAI
 from Chatsupport.code.extract_text import FileTextExtractor
@@ -19,13 +20,7 @@ azure_api_key = os.getenv("API_Key")
 azure_endpoint = os.getenv("End_point")
 azure_api_version = os.getenv("API_version")
 
-azure_embedding = AzureOpenAIEmbedding(
-    model="text-embedding-3-small",
-    azure_endpoint=azure_endpoint,
-    api_key=azure_api_key,
-    api_version="2024-02-01",
-    azure_deployment="text-embedding-3-small"
-)
+azure_embedding = create_embedding_model()
 
 client = AzureOpenAI(
     azure_endpoint=azure_endpoint,
@@ -102,13 +97,7 @@ def create_dataset_path(base_dir, subfolder, user_id=None):
 
 def chunk_text(text, chunk_size=1000, overlap=100):
     """Split text into overlapping chunks."""
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += chunk_size - overlap
-    return chunks
+    return [text[start:end] for start, end in chunk_spans(len(text), chunk_size, overlap)]
 
 
 def initialize_store(dataset_path, overwrite=False):
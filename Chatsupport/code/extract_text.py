@@ -1,12 +1,22 @@
 import os
+import hashlib
+import json
 import docx2txt
 from bs4 import BeautifulSoup
 from striprtf.striprtf import rtf_to_text
 import pdfplumber
-from PIL import Image
-import pytesseract
+from collections import deque
+from PIL import Image, ImageSequence
 import pandas as pd
 from pyxlsb import open_workbook
+from openpyxl import load_workbook
+from contextlib import contextmanager
+from itertools import chain
+from collections import Counter
+import External
+from External.chunking import get_token_counter
+from External.ocr_pool import OCR_LANGUAGE, get_ocr_pool
+from External.image_preprocess import OCR_PREPROCESSOR
 
 
 class FileProcessingError(Exception):
@@ -17,15 +27,245 @@ class UnsupportedFileTypeError(ValueError):
     pass
 
 
+# Bump whenever a processor changes its output, so stale cache entries are ignored.
+EXTRACTOR_VERSION = "5"
+# At the repository root, whichever app (and copy of this module) is running.
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(External.__file__)))
+EXTRACTION_CACHE_DIR = os.getenv(
+    "EXTRACTION_CACHE_DIR", os.path.join(_REPO_ROOT, "extraction_cache")
+)
+EXTRACTION_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# PDF pages with fewer extracted characters than this have no usable text layer.
+MIN_TEXT_LAYER_CHARS = 20
+# Share of the page that must be covered by images before it is rendered for OCR.
+MIN_OCR_IMAGE_COVERAGE = 0.1
+OCR_RENDER_RESOLUTION = 300
+# Decoded TIFF frames waiting for OCR, per OCR worker. Bounds memory on long faxes.
+TIFF_FRAMES_IN_FLIGHT_PER_WORKER = 2
+# Spreadsheet rows rendered per text block when streaming.
+SPREADSHEET_ROWS_PER_BLOCK = 500
+# Characters per block when streaming a cached extraction back.
+CACHE_READ_BLOCK_CHARS = 1 << 20
+# Upper bound on the characters of a rendered row block, so one block fits one chunk.
+SPREADSHEET_BLOCK_CHARS = 2000
+# Row layout for tabular files: "tsv" (tab separated) or "markdown".
+TABULAR_FORMAT = os.getenv("TABULAR_FORMAT", "tsv")
+# Compare one in this many rendered row blocks with `DataFrame.to_string` for
+# TABULAR_STATS (0: never). Measuring renders the block twice, so it is off by default.
+TABULAR_STATS_SAMPLE = int(os.getenv("TABULAR_STATS_SAMPLE", 0))
+# Characters and tokens of sampled blocks, compact rendering versus `DataFrame.to_string`.
+TABULAR_STATS = Counter()
+
+
+def _format_cell(value, markdown=False) -> str:
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = " ".join(str(value).split())  # No tabs or newlines inside a cell.
+    return text.replace("|", "\\|") if markdown else text
+
+
+def _measure_table(header, rows, text) -> None:
+    """Record a rendered block against the `DataFrame.to_string` layout it replaces."""
+    counter = get_token_counter()
+    padded = pd.DataFrame(rows, columns=header).to_string(index=False)
+    TABULAR_STATS.update({
+        "sampled_blocks": 1,
+        "compact_chars": len(text),
+        "padded_chars": len(padded),
+        "compact_tokens": counter.count(text),
+        "padded_tokens": counter.count(padded),
+    })
+
+
+def render_table(header, rows, table_format=None) -> str:
+    """
+    Render rows compactly as tab separated or markdown lines (default:
+    TABULAR_FORMAT), header first. One in `TABULAR_STATS_SAMPLE` blocks is
+    also measured into TABULAR_STATS.
+    """
+    markdown = (table_format or TABULAR_FORMAT) == "markdown"
+    cells = [[_format_cell(value, markdown) for value in header]]
+    cells.extend([_format_cell(value, markdown) for value in row] for row in rows)
+    if markdown:
+        lines = ["| " + " | ".join(row) + " |" for row in cells]
+        lines.insert(1, "|" + "---|" * len(cells[0]))
+    else:
+        lines = ["\t".join(row) for row in cells]
+    text = "\n".join(lines)
+
+    TABULAR_STATS["blocks"] += 1
+    if TABULAR_STATS_SAMPLE and (TABULAR_STATS["blocks"] - 1) % TABULAR_STATS_SAMPLE == 0:
+        _measure_table(header, rows, text)
+    return text
+
+
+def extraction_settings_key() -> str:
+    """Hash of the settings that change the extracted text (table layout, OCR), for cache keys."""
+    settings = {
+        "tabular_format": TABULAR_FORMAT,
+        "spreadsheet_rows_per_block": SPREADSHEET_ROWS_PER_BLOCK,
+        "spreadsheet_block_chars": SPREADSHEET_BLOCK_CHARS,
+        "min_text_layer_chars": MIN_TEXT_LAYER_CHARS,
+        "min_ocr_image_coverage": MIN_OCR_IMAGE_COVERAGE,
+        "ocr_render_resolution": OCR_RENDER_RESOLUTION,
+        "ocr_language": OCR_LANGUAGE,
+        "ocr_preprocessor": OCR_PREPROCESSOR.settings_key,
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def tabular_savings() -> dict:
+    """Character and token reduction of the sampled compact tables so far."""
+    return {
+        "chars_saved": TABULAR_STATS["padded_chars"] - TABULAR_STATS["compact_chars"],
+        "tokens_saved": TABULAR_STATS["padded_tokens"] - TABULAR_STATS["compact_tokens"],
+        "char_reduction": 1 - TABULAR_STATS["compact_chars"] / TABULAR_STATS["padded_chars"]
+        if TABULAR_STATS["padded_chars"] else 0.0,
+        "token_reduction": 1 - TABULAR_STATS["compact_tokens"] / TABULAR_STATS["padded_tokens"]
+        if TABULAR_STATS["padded_tokens"] else 0.0,
+    }
+
+
+class ExtractionCache:
+    """
+    On-disk cache of extracted text, keyed by the SHA-256 of the file bytes,
+    the file extension, the extractor version and `extraction_settings_key()`.
+    Least recently used entries are evicted once the cache grows beyond `max_bytes`.
+    """
+
+    def __init__(self, cache_dir: str = EXTRACTION_CACHE_DIR, max_bytes: int = EXTRACTION_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def file_key(path: str, version: str = EXTRACTOR_VERSION) -> str:
+        """Hash the file contents in blocks and build the cache key."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        extension = os.path.splitext(path)[1].lower().lstrip(".")
+        return f"{digest.hexdigest()}-{extension}-v{version}-{extraction_settings_key()}"
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def get(self, key: str):
+        """Return the cached text for `key`, or None on a miss."""
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                text = file.read()
+            os.utime(path)  # Mark the entry as recently used.
+        except OSError:
+            return None
+        return text
+
+    def open_entry(self, key: str):
+        """Open the cached text for `key` for reading, or return None on a miss."""
+        path = self._entry_path(key)
+        try:
+            file = open(path, "r", encoding="utf-8")
+            os.utime(path)  # Mark the entry as recently used.
+        except OSError:
+            return None
+        return file
+
+    @contextmanager
+    def open_for_write(self, key: str):
+        """
+        Write an entry incrementally. The entry only becomes visible once the
+        `with` block completes; on error the partial file is discarded.
+        """
+        path = self._entry_path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as file:
+                yield file
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.evict()
+
+    def set(self, key: str, text: str) -> None:
+        """Store `text` under `key` and evict old entries if needed."""
+        path = self._entry_path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as file:
+                file.write(text)
+            os.replace(temp_path, path)
+            self.evict()
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if entry.name.endswith(".txt"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
 class FileTextExtractor:
+    def __init__(self, cache: ExtractionCache = None, use_cache: bool = True):
+        self.cache = (cache or ExtractionCache()) if use_cache else None
+
+    def classify_pdf_page(self, page) -> dict:
+        """
+        Classify a pdfplumber page by its text layer and image coverage.
+        Returns the extracted text, whether it is usable, the share of the page
+        covered by images and whether the page should be sent to OCR.
+        """
+        text = page.extract_text() or ""
+        page_area = float(page.width * page.height) or 1.0
+        image_area = sum(
+            max(0, image["x1"] - image["x0"]) * max(0, image["bottom"] - image["top"])
+            for image in page.images
+        )
+        has_text = len(text.strip()) >= MIN_TEXT_LAYER_CHARS
+        image_coverage = min(1.0, image_area / page_area)
+        return {
+            "text": text,
+            "has_text": has_text,
+            "image_coverage": image_coverage,
+            "needs_ocr": not has_text and image_coverage >= MIN_OCR_IMAGE_COVERAGE,
+        }
+
+    def ocr_pdf_page(self, page) -> str:
+        """Render a pdfplumber page and extract its text using OCR."""
+        image = page.to_image(resolution=OCR_RENDER_RESOLUTION).original
+        return get_ocr_pool().image_to_string(image)
+
     def process_pdf_file(self, filepath: str) -> str:
-        """Process a PDF file and extract text."""
+        """Process a PDF file and extract text. Only image-only pages are sent to OCR."""
         try:
             text = ""
             with pdfplumber.open(filepath) as pdf:
                 for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
+                    page_info = self.classify_pdf_page(page)
+                    if page_info["needs_ocr"]:
+                        page_text = self.ocr_pdf_page(page)
+                    else:
+                        page_text = page_info["text"]
+                    if page_text.strip():
                         text += page_text.strip() + "\n\n"
             return text
         except Exception as e:
@@ -67,43 +307,178 @@ class FileTextExtractor:
     def process_image_file(self, filepath: str) -> str:
         """Process an image file and extract text using OCR."""
         try:
-            with Image.open(filepath) as img:
-                return pytesseract.image_to_string(img)
+            # Pre-processed inside the OCR worker, not in the calling process.
+            return get_ocr_pool().image_to_string(filepath, preprocessor=OCR_PREPROCESSOR)
         except Exception as e:
             raise FileProcessingError(f"Error processing image file: {e}")
 
-    def process_csv_file(self, filepath: str) -> str:
-        """Process a CSV file and return its content as plain text."""
+    def process_tiff_file(self, filepath: str) -> str:
+        """
+        Process a (multi-page) TIFF file and extract the text of every frame using OCR.
+        Frames are decoded one at a time and OCR'd in parallel; pages are kept in
+        order and separated by form feeds.
+        """
         try:
-            df = pd.read_csv(filepath)
-            return df.to_string(index=False)
+            pool = get_ocr_pool()
+            # An inline pool (`use_inline_ocr`) has no workers but still OCRs a frame at a time.
+            max_in_flight = TIFF_FRAMES_IN_FLIGHT_PER_WORKER * max(1, pool.max_workers)
+            pending = deque()
+            pages = []
+            with Image.open(filepath) as tiff:
+                for frame in ImageSequence.Iterator(tiff):
+                    if len(pending) >= max_in_flight:
+                        pages.append(pending.popleft().result())
+                    pending.append(
+                        pool.submit_image_to_string(frame.copy(), preprocessor=OCR_PREPROCESSOR)
+                    )
+            pages.extend(future.result() for future in pending)
+            return "\f".join(page.strip() for page in pages)
+        except Exception as e:
+            raise FileProcessingError(f"Error processing TIFF file: {e}")
+
+    def ocr_image_blocks(self, image) -> list:
+        """
+        Run OCR on an image (path or PIL image) and group the recognised words into blocks.
+        Each block carries its text, mean word confidence (0-100) and bounding box.
+        """
+        return self.group_ocr_blocks(get_ocr_pool().image_to_data(image))
+
+    def ocr_image_blocks_batch(self, images) -> list:
+        """`ocr_image_blocks` for a batch of images, processed in parallel by the OCR pool."""
+        return [self.group_ocr_blocks(data) for data in get_ocr_pool().image_to_data_batch(images)]
+
+    def ocr_prepared_blocks_batch(self, image_paths, preprocessor=OCR_PREPROCESSOR) -> list:
+        """
+        Pre-process and OCR image files in parallel on the OCR pool.
+
+        Returns:
+            list: (path of the pre-processed copy, blocks) per image; block
+            boxes refer to the pre-processed copy.
+        """
+        return [
+            (prepared_path, self.group_ocr_blocks(data))
+            for prepared_path, data in get_ocr_pool().preprocess_to_data_batch(image_paths, preprocessor)
+        ]
+
+    @staticmethod
+    def group_ocr_blocks(data: dict) -> list:
+        """Group a Tesseract word table (`image_to_data` layout) into text blocks."""
+        blocks = {}
+        for index, word in enumerate(data["text"]):
+            confidence = float(data["conf"][index])
+            if confidence < 0 or not word.strip():
+                continue
+            left, top = data["left"][index], data["top"][index]
+            right, bottom = left + data["width"][index], top + data["height"][index]
+            block = blocks.setdefault(
+                (data["page_num"][index], data["block_num"][index]),
+                {"lines": {}, "confidences": [], "box": [left, top, right, bottom]},
+            )
+            line_key = (data["par_num"][index], data["line_num"][index])
+            block["lines"].setdefault(line_key, []).append(word)
+            block["confidences"].append(confidence)
+            box = block["box"]
+            block["box"] = [min(box[0], left), min(box[1], top), max(box[2], right), max(box[3], bottom)]
+
+        return [
+            {
+                "text": "\n".join(" ".join(words) for words in block["lines"].values()),
+                "confidence": sum(block["confidences"]) / len(block["confidences"]),
+                "box": tuple(block["box"]),
+            }
+            for block in blocks.values()
+        ]
+
+    def _render_rows(self, header, rows, sheet_name=None) -> str:
+        """Render a block of spreadsheet rows, with the header, as compact text."""
+        text = render_table(header, rows)
+        return f"Sheet: {sheet_name}\n{text}" if sheet_name is not None else text
+
+    def _iter_row_blocks(self, rows, sheet_name=None):
+        """
+        Group an iterator of rows (first row is the header) into rendered text blocks.
+        A block is closed at `SPREADSHEET_ROWS_PER_BLOCK` rows or roughly
+        `SPREADSHEET_BLOCK_CHARS` characters; every block repeats the header.
+        """
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is None:
+            return
+        block = []
+        block_chars = len(self._render_rows(header, [], sheet_name))
+        for row in rows:
+            row_chars = sum(len(_format_cell(value)) + 1 for value in row)
+            if block and (
+                len(block) >= SPREADSHEET_ROWS_PER_BLOCK
+                or block_chars + row_chars > SPREADSHEET_BLOCK_CHARS
+            ):
+                yield self._render_rows(header, block, sheet_name)
+                block = []
+                block_chars = len(self._render_rows(header, [], sheet_name))
+            block.append(row)
+            block_chars += row_chars
+        if block:
+            yield self._render_rows(header, block, sheet_name)
+
+    def iter_csv_blocks(self, filepath: str):
+        """Yield a CSV file as text blocks of rows, read in chunks."""
+        try:
+            frames = pd.read_csv(filepath, chunksize=SPREADSHEET_ROWS_PER_BLOCK)
+            first = next(frames, None)
+            if first is None:
+                return
+            rows = chain(
+                [tuple(first.columns)],
+                first.itertuples(index=False, name=None),
+                (row for frame in frames for row in frame.itertuples(index=False, name=None)),
+            )
+            yield from self._iter_row_blocks(rows)
         except Exception as e:
             raise FileProcessingError(f"Error processing CSV file: {e}")
 
-    def process_excel_file(self, filepath: str) -> str:
-        """Process an Excel file and return its content as plain text."""
+    def iter_excel_blocks(self, filepath: str):
+        """Yield every sheet of an Excel file as text blocks of rows."""
         try:
-            df = pd.read_excel(filepath)
-            return df.to_string(index=False)
+            if filepath.lower().endswith(".xls"):
+                # Legacy .xls has no streaming reader; load one sheet at a time.
+                with pd.ExcelFile(filepath) as workbook:
+                    for sheet_name in workbook.sheet_names:
+                        frame = workbook.parse(sheet_name)
+                        rows = chain([tuple(frame.columns)], frame.itertuples(index=False, name=None))
+                        yield from self._iter_row_blocks(rows, sheet_name)
+                return
+            workbook = load_workbook(filepath, read_only=True, data_only=True)
+            try:
+                for sheet in workbook.worksheets:
+                    yield from self._iter_row_blocks(sheet.iter_rows(values_only=True), sheet.title)
+            finally:
+                workbook.close()
         except Exception as e:
             raise FileProcessingError(f"Error processing Excel file: {e}")
 
-    def process_xlsb_file(self, filepath: str) -> str:
-        """Process an XLSB file, convert it to DataFrame, and return content as plain text."""
+    def iter_xlsb_blocks(self, filepath: str):
+        """Yield every sheet of an XLSB file as text blocks of rows."""
         try:
-            data = []
             with open_workbook(filepath) as wb:
                 for sheet_name in wb.sheets:
                     with wb.get_sheet(sheet_name) as sheet:
-                        for row in sheet.rows():
-                            data.append([item.v for item in row])
-
-            # Convert data to DataFrame
-            df = pd.DataFrame(data[1:], columns=data[0])  # Assumes the first row is the header
-            return df.to_string(index=False)
+                        rows = ([item.v for item in row] for row in sheet.rows())
+                        yield from self._iter_row_blocks(rows, sheet_name)
         except Exception as e:
             raise FileProcessingError(f"Error processing XLSB file: {e}")
 
+    def process_csv_file(self, filepath: str) -> str:
+        """Process a CSV file and return its content as plain text."""
+        return "\n\n".join(self.iter_csv_blocks(filepath))
+
+    def process_excel_file(self, filepath: str) -> str:
+        """Process an Excel file and return the content of all sheets as plain text."""
+        return "\n\n".join(self.iter_excel_blocks(filepath))
+
+    def process_xlsb_file(self, filepath: str) -> str:
+        """Process an XLSB file and return the content of all sheets as plain text."""
+        return "\n\n".join(self.iter_xlsb_blocks(filepath))
+
     FILE_PROCESSORS = {
         ".pdf": process_pdf_file,
         ".txt": process_text_file,
@@ -114,13 +489,70 @@ class FileTextExtractor:
         ".jpg": process_image_file,
         ".png": process_image_file,
         ".jpeg": process_image_file,
-        ".tiff": process_image_file,
+        ".tiff": process_tiff_file,
+        ".tif": process_tiff_file,
         ".csv": process_csv_file,
         ".xls": process_excel_file,
         ".xlsx": process_excel_file,
         ".xlsb": process_xlsb_file,
     }
 
+    # Processors that can emit a file as a sequence of text blocks.
+    STREAMING_PROCESSORS = {
+        ".csv": iter_csv_blocks,
+        ".xls": iter_excel_blocks,
+        ".xlsx": iter_excel_blocks,
+        ".xlsb": iter_xlsb_blocks,
+    }
+
+    def is_tabular(self, path: str) -> bool:
+        return os.path.splitext(path)[1].lower() in self.STREAMING_PROCESSORS
+
+    def iter_table_chunks(self, path: str):
+        """
+        Yield each rendered row block of a spreadsheet as its own chunk, so every
+        chunk starts with the sheet name and column header.
+        """
+        buffer = ""
+        for piece in self.iter_text_blocks_from_file(path):
+            buffer += piece
+            *complete, buffer = buffer.split("\n\n")
+            yield from (chunk for chunk in complete if chunk)
+        if buffer:
+            yield buffer
+
+    def iter_text_blocks_from_file(self, path: str):
+        """
+        Yield the text of a file in blocks; concatenating the blocks gives the
+        result of `extract_text_from_file`. Spreadsheets are streamed row block by
+        row block, so peak memory does not grow with the workbook size. Other file
+        types are yielded in one block.
+        """
+        _, file_extension = os.path.splitext(path)
+        file_extension = file_extension.lower()
+        if file_extension not in self.STREAMING_PROCESSORS:
+            yield self.extract_text_from_file(path)
+            return
+
+        blocks = (
+            ("\n\n" if index else "") + block
+            for index, block in enumerate(self.STREAMING_PROCESSORS[file_extension](self, path))
+        )
+        if self.cache is None:
+            yield from blocks
+            return
+
+        key = self.cache.file_key(path)
+        cached = self.cache.open_entry(key)
+        if cached is not None:
+            with cached:
+                yield from iter(lambda: cached.read(CACHE_READ_BLOCK_CHARS), "")
+            return
+        with self.cache.open_for_write(key) as cache_file:
+            for block in blocks:
+                cache_file.write(block)
+                yield block
+
     def extract_text_from_file(self, path: str) -> str:
         """Extract text from a file."""
         _, file_extension = os.path.splitext(path)
@@ -130,7 +562,38 @@ class FileTextExtractor:
             raise UnsupportedFileTypeError(f"Unsupported file type: {file_extension}")
 
         processor = self.FILE_PROCESSORS[file_extension]
-        return processor(self, path)
+        if self.cache is None:
+            return processor(self, path)
+
+        key = self.cache.file_key(path)
+        text = self.cache.get(key)
+        if text is None:
+            text = processor(self, path)
+            self.cache.set(key, text)
+        return text
+
+
+def extract_file_blocks(path: str):
+    """
+    Extract one file for an ingestion worker process.
+
+    A spreadsheet's row blocks are not sent back: they are written to the
+    extraction cache a block at a time, and the caller reads them back with
+    `iter_table_chunks` in bounded batches.
+
+    Returns:
+        tuple: (path, True, None, stats) for spreadsheets; (path, False, list
+        of text blocks, stats) for other files. `stats` is this file's share
+        of TABULAR_STATS, for the parent process to add to its own.
+    """
+    extractor = FileTextExtractor()
+    before = Counter(TABULAR_STATS)
+    if extractor.is_tabular(path):
+        for _ in extractor.iter_text_blocks_from_file(path):
+            pass
+        return path, True, None, dict(TABULAR_STATS - before)
+    blocks = list(extractor.iter_text_blocks_from_file(path))
+    return path, False, blocks, dict(TABULAR_STATS - before)
 
 
 # Example Usage
@@ -1,14 +1,25 @@
 import argparse
+import asyncio
 import os
 import sys
 import json
 import uuid
+from itertools import islice
 from dotenv import load_dotenv
-from External.vector import DeepLakeManager, add_custom_nodes, query_custom_embedding
-from aih_rag.embeddings.azure_openai import AzureOpenAIEmbedding
+from External.chunking import TokenChunker, chunk_spans, get_token_counter
+from External.context import ContextPacker
+from External.embedding_cache import model_identity
+from External.embedding_service import EmbeddingService, create_embedding_model
+from External.keyword_index import is_keyword_query
+from External.manifest import IngestManifest
+from External.ocr_pool import use_inline_ocr
+from External.pipeline import Stage, StagedPipeline
+from External.retriever import RETRIEVAL_MODE, RETRIEVAL_MODES, RETRIEVAL_TOP_K, FederatedRetriever, reciprocal_rank_fusion
+from External.selector import RetrievalSelector
+from External.vector import DeepLakeManager, add_custom_nodes
 from structured_output import chat_response
 from openai import AzureOpenAI
-from Chatsupport.code.extract_text import FileTextExtractor
+from Chatsupport.code.extract_text import TABULAR_STATS, FileTextExtractor, extract_file_blocks, tabular_savings
 from memory import RedisCache
 from loguru import logger
 # Load environment variables
@@ -19,13 +30,12 @@ azure_api_key = os.getenv("API_Key")
 azure_endpoint = os.getenv("End_point")
 azure_api_version = os.getenv("API_version")
 
-azure_embedding = AzureOpenAIEmbedding(
-    model="text-embedding-3-small",
-    azure_endpoint=azure_endpoint,
-    api_key=azure_api_key,
-    api_version="2024-02-01",
-    azure_deployment="text-embedding-3-small"
-)
+azure_embedding = create_embedding_model()
+embedding_service = EmbeddingService(azure_embedding)
+retriever = FederatedRetriever()
+context_packer = ContextPacker()
+# Never sends more than the former fixed top-k; sends fewer when scores fall off.
+selector = RetrievalSelector(max_k=RETRIEVAL_TOP_K, baseline_k=RETRIEVAL_TOP_K, embed=embedding_service.embed)
 
 client = AzureOpenAI(
     azure_endpoint=azure_endpoint,
@@ -35,6 +45,17 @@ client = AzureOpenAI(
 
 # JSON file to maintain user dataset mappings
 USER_DATASET_FILE = "user_dataset.json"
+# Token budget of the chunks embedded for retrieval (about 2,000 characters of prose).
+CHUNK_TOKENS = 500
+CHUNK_OVERLAP_TOKENS = 25
+# Ingestion stage workers: extraction processes, concurrent embedding tasks,
+# and chunk batches per store write.
+INGEST_EXTRACT_WORKERS = int(os.getenv("INGEST_EXTRACT_WORKERS", min(4, os.cpu_count() or 1)))
+INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", 4))
+INGEST_WRITE_BATCH = int(os.getenv("INGEST_WRITE_BATCH", 8))
+# Chunks per batch after the chunk stage; a large file is embedded and written
+# in batches of this size instead of whole.
+INGEST_CHUNK_BATCH = int(os.getenv("INGEST_CHUNK_BATCH", 256))
 redis_cache = RedisCache()
 
 def load_user_dataset_mapping():
@@ -102,97 +123,323 @@ def create_dataset_path(base_dir, subfolder, user_id=None):
 
 def chunk_text(text, chunk_size=1000, overlap=100):
     """Split text into overlapping chunks."""
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += chunk_size - overlap
-    return chunks
+    return [text[start:end] for start, end in chunk_spans(len(text), chunk_size, overlap)]
 
 
-def initialize_store(dataset_path, overwrite=False):
+def initialize_store(dataset_path, overwrite=False, ann=False):
     """
     Initialize DeepLakeManager.
 
     Args:
         dataset_path (str): Path to the Deep Lake dataset.
         overwrite (bool): Whether to overwrite the dataset if it already exists.
+        ann (bool): Build an approximate nearest-neighbour index once the dataset is large.
 
     Returns:
         DeepLakeManager: Initialized DeepLakeManager instance.
     """
     try:
-        return DeepLakeManager(dataset_path=dataset_path, overwrite=overwrite)
+        return DeepLakeManager(dataset_path=dataset_path, overwrite=overwrite, ann=ann)
     except Exception as e:
         logger.debug(f"Error initializing dataset at {dataset_path}: {e}")
         raise
 
 
-def process_and_store_files(file_paths, dataset_path, overwrite=False):
+def iter_file_chunks(file_path, tabular, blocks, token_chunker):
+    """
+    Chunk the output of `extract_file_blocks`, yielding (chunk text, token count).
+    A spreadsheet's chunks are read back from the extraction cache one at a time.
+    """
+    if tabular:
+        # Row blocks are sized to a chunk and carry their own header.
+        for chunk in FileTextExtractor().iter_table_chunks(file_path):
+            yield chunk, token_chunker.counter.count(chunk)
+    else:
+        yield from token_chunker.iter_blocks(blocks)
+
+
+def _batches(iterable, size):
+    """Yield (list of up to `size` items, whether it is the last); an empty iterable gives one empty batch."""
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while True:
+        following = list(islice(iterator, size)) if len(batch) == size else []
+        yield batch, not following
+        if not following:
+            return
+        batch = following
+
+
+def process_and_store_files(file_paths, dataset_path, overwrite=False, ann=False, incremental=False):
     """
     Process multiple files and store their chunks and embeddings in a DeepLake dataset.
 
+    Files go through overlapping stages joined by bounded queues (see
+    `External.pipeline`): extraction in worker processes, chunking on a
+    thread, embedding as async batch requests, and batched store writes. A
+    slow stage holds back the ones before it, so memory stays flat, and an
+    upload takes about as long as its slowest stage. Past the chunk stage a
+    file moves in batches of `INGEST_CHUNK_BATCH` chunks; spreadsheet chunks
+    are read from the extraction cache as they are needed. A file that fails
+    part way has the batches it already stored removed again.
+
     Args:
         file_paths (list): List of file paths to process.
         dataset_path (str): Path to the DeepLake dataset.
         overwrite (bool): Whether to overwrite the dataset if it already exists.
+        ann (bool): Index the dataset for approximate search once it is large
+            (for the shared static content; per-user datasets stay exact).
+        incremental (bool): Update the dataset in place from its ingest manifest
+            instead of re-embedding everything (see `sync_files`).
+
+    Returns:
+        list: Per-stage report (items, errors, busy and wall time, items per second).
     """
+    if incremental:
+        return sync_files(file_paths, dataset_path, remove_missing=overwrite, ann=ann)
+    return _run_ingest(file_paths, dataset_path, manifest=None, overwrite=overwrite, ann=ann)
+
+
+def ingest_config():
+    """What the stored chunks depend on; a manifest saved under another config triggers a rebuild."""
+    model, dimensions = model_identity(azure_embedding)
+    return {
+        "chunk_tokens": CHUNK_TOKENS,
+        "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+        "token_counter": type(get_token_counter()).__name__,
+        "embedding_model": model,
+        "embedding_dimensions": dimensions,
+    }
+
+
+def sync_files(file_paths, dataset_path, remove_missing=True, ann=False):
+    """
+    Bring a dataset in line with `file_paths`, doing only the work that changed.
+
+    Unchanged files (same SHA-256 as in the manifest) are not read at all. A
+    changed file is re-chunked, but only chunks the dataset does not already
+    hold for it are embedded and added, and its chunks that are gone are
+    deleted. With `remove_missing`, the nodes of files no longer listed are
+    deleted too, so the dataset holds exactly these files, as with
+    `overwrite=True`.
 
-    extract_text = FileTextExtractor()
-    chunks = []
-    embeddings = []
-
-    for file_path in file_paths:
-        try:
-            logger.debug(f"Processing file: {file_path}")
-            text = extract_text.extract_text_from_file(file_path)
-            file_chunks = chunk_text(text=text, chunk_size=2000, overlap=100)
-            chunks.extend(file_chunks)
-
-            # Generate embeddings for each chunk
-            for chunk in file_chunks:
-                chunk_embedding = azure_embedding.get_text_embedding(text=chunk)
-                embeddings.append(chunk_embedding)
-        except Exception as e:
-            logger.debug(f"Error processing file {file_path}: {e}")
-
-    if chunks and embeddings:
-        # Initialize the dataset
-        manager = initialize_store(dataset_path, overwrite=overwrite)
-        add_custom_nodes(manager, chunks, embeddings)
+    A dataset without a manifest is rebuilt once when `remove_missing` is set,
+    since its contents are unknown. A dataset whose manifest was saved under
+    another `ingest_config()` (chunk sizes, embedding model or dimensions) is
+    always rebuilt from `file_paths`: its vectors cannot be mixed with new ones.
+
+    Returns:
+        list: Per-stage report, as for `process_and_store_files`.
+    """
+    manifest = IngestManifest(dataset_path, config=ingest_config())
+    overwrite = (remove_missing and not manifest.exists()) or manifest.config_changed
+    if manifest.config_changed:
+        logger.debug(f"Ingest config of {dataset_path} changed; rebuilding it from {len(file_paths)} files")
+    if remove_missing or overwrite:
+        manager = initialize_store(dataset_path, overwrite=overwrite, ann=ann)
+        manager.delete_nodes(manifest.remove_missing(file_paths))
+        manifest.save()
     else:
-        logger.debug(f"No valid content found in the provided files. Skipping dataset creation.")
+        manager = None
+    pending = manifest.pending(file_paths)
+    report = _run_ingest(pending, dataset_path, manifest=manifest, ann=ann, manager=manager)
+    logger.debug(f"Incremental ingest into {dataset_path}: {dict(manifest.stats)}")
+    return report
 
 
-def fetch_relevant_chunks(query, dataset_paths):
+def _run_ingest(files, dataset_path, manifest=None, overwrite=False, ann=False, manager=None):
     """
-    Fetch relevant chunks from multiple DeepLake datasets based on a query.
+    Run the ingestion stages over `files`: paths, or (path, file hash) pairs
+    when a manifest is given. Unless a `manager` is passed, the store is
+    opened on the first write, so nothing is created when no file yields content.
+    """
+    token_chunker = TokenChunker(max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS)
+    store = {} if manager is None else {"manager": manager}
+
+    digests = dict(item if isinstance(item, tuple) else (item, None) for item in files)
+
+    def chunk(item):
+        file_path, tabular, blocks, stats = item
+        # Tabular rendering stats counted in the extraction worker process.
+        TABULAR_STATS.update(stats)
+        diff = None if manifest is None else manifest.chunk_diff(file_path)
+        chunk_count = token_count = 0
+        chunks = iter_file_chunks(file_path, tabular, blocks, token_chunker)
+        for number, (batch, last) in enumerate(_batches(chunks, INGEST_CHUNK_BATCH), 1):
+            texts = [text for text, _ in batch]
+            tokens = [count for _, count in batch]
+            chunk_count, token_count = chunk_count + len(batch), token_count + sum(tokens)
+            if diff is None:
+                new_indices, node_ids = range(len(texts)), [str(uuid.uuid4()) for _ in texts]
+            else:
+                new_indices, node_ids = diff.add(texts)
+            if last:
+                logger.debug(f"{chunk_count} chunks, {token_count} tokens from {file_path}")
+            yield {
+                "path": file_path,
+                "texts": [texts[index] for index in new_indices],
+                "tokens": [tokens[index] for index in new_indices],
+                "node_ids": node_ids,
+                # Only the last batch of a file knows the batch count and what to record.
+                "batches": number if last else None,
+                "entries": diff.entries if last and diff is not None else None,
+                "stale": diff.finish() if last and diff is not None else [],
+            }
+
+    async def embed(item):
+        # Batched, concurrent requests; vectors keep the chunk order.
+        item["embeddings"] = await embedding_service.aembed(item["texts"], item["tokens"])
+        return item
+
+    # Files with some but not yet all batches written: the batches and node ids
+    # written so far and, once the last batch is in, the batch count, manifest
+    # entries and stale node ids.
+    partial = {}
+
+    def write(items):
+        texts = [text for item in items for text in item["texts"]]
+        if "manager" not in store:
+            if manifest is None and not texts:
+                return None
+            store["manager"] = initialize_store(dataset_path, overwrite=overwrite, ann=ann)
+        manager = store["manager"]
+        if texts:
+            add_custom_nodes(
+                manager,
+                texts,
+                [embedding for item in items for embedding in item["embeddings"]],
+                node_ids=[node_id for item in items for node_id in item["node_ids"]],
+            )
+        complete = []
+        for item in items:
+            progress = partial.setdefault(item["path"], {"written": 0, "node_ids": []})
+            progress["written"] += 1
+            progress["node_ids"].extend(item["node_ids"])
+            if item["batches"] is not None:
+                progress.update(batches=item["batches"], entries=item["entries"], stale=item["stale"])
+            if progress["written"] == progress.get("batches"):
+                complete.append((item["path"], partial.pop(item["path"])))
+        # A changed file's old chunks go once all of its new ones are stored.
+        manager.delete_nodes([node_id for _, progress in complete for node_id in progress["stale"]])
+        if manifest is not None and complete:
+            for file_path, progress in complete:
+                manifest.record(file_path, digests[file_path], progress["entries"])
+            manifest.save()
+        return len(texts)
+
+    def on_error(stage, item, error):
+        logger.debug(f"Error in ingest stage {stage} for {_item_paths(item)}: {error}")
+
+    pipeline = StagedPipeline(
+        [
+            # Extraction workers OCR in-process; they are already one per core.
+            Stage(
+                "extract", extract_file_blocks, workers=INGEST_EXTRACT_WORKERS, mode="process", initializer=use_inline_ocr
+            ),
+            Stage("chunk", chunk, workers=1, mode="thread"),
+            Stage("embed", embed, workers=INGEST_EMBED_WORKERS, mode="async"),
+            Stage("write", write, workers=1, mode="thread", batch_size=INGEST_WRITE_BATCH),
+        ],
+        on_error=on_error,
+    )
+    written = asyncio.run(pipeline.run(list(digests)))
+    orphans = [node_id for progress in partial.values() for node_id in progress["node_ids"]]
+    if orphans:
+        # Files that failed after some of their batches were stored.
+        logger.debug(f"Removing {len(orphans)} nodes of files that failed part way: {list(partial)}")
+        store["manager"].delete_nodes(orphans)
+    if not sum(written):
+        logger.debug(f"No valid content found in the provided files. Skipping dataset creation.")
+    logger.debug(f"Embedding cache hit rate so far: {embedding_service.cache.hit_rate():.0%}")
+    if TABULAR_STATS["sampled_blocks"]:
+        logger.debug(f"Compact table rendering so far: {tabular_savings()}")
+    report = pipeline.report()
+    for stage in report:
+        logger.debug(f"Ingest stage {stage}")
+    return report
+
+
+def _item_paths(item):
+    """File paths of an ingest stage's input, for error messages."""
+    if isinstance(item, list):
+        return [path for entry in item for path in _item_paths(entry)]
+    if isinstance(item, dict):
+        return [item["path"]]
+    return [item[0] if isinstance(item, tuple) else item]
+
+
+def _log_retrieval_reports(kind, reports):
+    for report in reports:
+        if report["error"]:
+            logger.debug(f"Error querying {kind} at {report['dataset_path']}: {report['error']}")
+        else:
+            logger.debug(
+                f"{report['dataset_path']} ({kind}): {report['hits']} hits, {report['kept']} kept "
+                f"in {report['latency_ms']:.1f} ms"
+            )
+
+
+def fetch_relevant_hits(query, dataset_paths, top_k=RETRIEVAL_TOP_K, mode=RETRIEVAL_MODE):
+    """
+    Fetch the best chunks for a query across datasets, with their scores.
+
+    All datasets are queried concurrently for `selector.candidates` hits,
+    merged by similarity (above `RETRIEVAL_MIN_SCORE`), then cut where the
+    scores fall off and reordered by maximal marginal relevance, so a query
+    with one clear answer gets one or two chunks and no near-copies.
+
+    The datasets' BM25 keyword indexes are searched too. In "hybrid" mode
+    their best hits are fused with the vector hits by reciprocal rank, so
+    exact terms (invoice numbers, clause titles) are not lost to dense
+    search. In "keyword" mode, and in "auto" mode for lookup-like queries
+    with keyword hits, only the keyword hits are returned and the query is
+    never embedded. "auto" does not search the keyword indexes at all for
+    other queries.
 
     Args:
         query (str): Query string.
         dataset_paths (list): List of DeepLake dataset paths.
+        top_k (int): Most chunks to return across all datasets.
+        mode (str): "vector", "keyword", "hybrid" or "auto".
 
     Returns:
-        list: Relevant chunks retrieved from datasets.
+        list: `ScoredChunk`s (text, score, dataset_path, node_id, embedding);
+        scores are cosine similarities, BM25 scores (keyword only) or fused
+        reciprocal-rank scores (hybrid).
     """
-    relevant_chunks = []
-    query_embedding = azure_embedding.get_text_embedding(text=query)
-
-    for dataset_path in dataset_paths:
-        if not os.path.exists(dataset_path):
-            logger.debug(f"Dataset path {dataset_path} does not exist. Skipping.")
-            continue
-        try:
-            manager = initialize_store(dataset_path)
-            chunks = query_custom_embedding(manager, query_embedding=query_embedding)
-            logger.debug(f"Found {len(chunks)} relevant chunks in dataset: {dataset_path}")
-            if chunks:
-                relevant_chunks.extend(chunks)
-        except Exception as e:
-            logger.debug(f"Error querying dataset at {dataset_path}: {e}")
-
-    return relevant_chunks
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+
+    keyword_hits = []
+    if mode in ("keyword", "hybrid") or (mode == "auto" and is_keyword_query(query)):
+        keyword_hits, reports = retriever.retrieve_keywords(query, dataset_paths)
+        _log_retrieval_reports("keywords", reports)
+        if mode == "keyword" or (mode == "auto" and keyword_hits):
+            logger.debug(f"Keyword-only retrieval: {len(keyword_hits)} hits")
+            return keyword_hits[:top_k]
+
+    query_embedding = embedding_service.embed_query(query)
+    hits, reports = retriever.retrieve(query_embedding, dataset_paths, top_k=max(top_k, selector.candidates))
+    _log_retrieval_reports("vectors", reports)
+    if hits:
+        selected, selection = selector.select(
+            [hit.text for hit in hits], [hit.score for hit in hits], [hit.embedding for hit in hits]
+        )
+        logger.debug(f"Retrieval selection: {selection}")
+        hits = [hits[index] for index in selected]
+    if keyword_hits:
+        hits = reciprocal_rank_fusion([hits, keyword_hits])
+    return hits[:top_k]
+
+
+def fetch_relevant_chunks(query, dataset_paths, top_k=RETRIEVAL_TOP_K, mode=RETRIEVAL_MODE):
+    """
+    Fetch relevant chunks from multiple DeepLake datasets based on a query.
+
+    Returns:
+        list: Relevant chunk texts, best first (see `fetch_relevant_hits`).
+    """
+    return [hit.text for hit in fetch_relevant_hits(query, dataset_paths, top_k=top_k, mode=mode)]
 
 def generate_chatbot_response(user_id, input_path, query, file_paths=[], base_dir="chatsupport\temp"):
     cached_response = redis_cache.check_cached_response(query)
@@ -212,18 +459,23 @@ def generate_chatbot_response(user_id, input_path, query, file_paths=[], base_di
     try:
         if file_paths:
             logger.debug("Processing static content files...")
-            process_and_store_files(file_paths, content_dataset_path, overwrite=False)
+            process_and_store_files(file_paths, content_dataset_path, overwrite=False, ann=True, incremental=True)
 
         if input_path:
             logger.debug(f"Processing user file for user ID {user_id}...")
-            process_and_store_files([input_path], user_dataset_path, overwrite=True)
+            process_and_store_files([input_path], user_dataset_path, overwrite=True, incremental=True)
             update_user_dataset_path(user_id, user_dataset_path)
 
 
 
         dataset_paths = [content_dataset_path, user_dataset_path]
-        relevant_chunks = fetch_relevant_chunks(query, dataset_paths)
-        reference_text = "\n".join(relevant_chunks) if relevant_chunks else "No relevant data found."
+        hits = fetch_relevant_hits(query, dataset_paths)
+        # Merge overlapping hits, drop near-duplicates and fit the prompt's token budget.
+        reference_text, packing = context_packer.pack(
+            [hit.text for hit in hits], [hit.score for hit in hits], [hit.dataset_path for hit in hits]
+        )
+        logger.debug(f"Reference text packing: {packing}")
+        reference_text = reference_text or "No relevant data found."
 
         system_content = """
         You are a professional chatbot that is helpful and friendly.
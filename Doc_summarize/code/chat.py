@@ -6,16 +6,22 @@ import time
 import pandas as pd
 from dotenv import load_dotenv
 from rich import print
-from aih_rag.embeddings.azure_openai import AzureOpenAIEmbedding
 from openai import AzureOpenAI
 import json
 import os
 from aih_automaton import Task, Agent, LinearSyncPipeline
+# Importing `source` first puts the repository root (and `External`) on sys.path.
 from source.AzureOpenai import AzureOpenAIModel
 from aih_automaton.tasks.task_literals import OutputType
-from aih_rag.vector_stores.deeplake import DeepLakeVectorStore
+from External.embedding_service import create_embedding_model
+from External.store_registry import get_store_registry
+from External.context import ContextPacker
+from External.keyword_index import is_keyword_query
+from External.retriever import RETRIEVAL_MODE, RETRIEVAL_MODES, FederatedRetriever, ScoredChunk, reciprocal_rank_fusion
+from External.selector import RetrievalSelector
 from source.utils import read_json, write_json
 from source.vector_store.embedding import query_text_embedding
+from source.vector_store.utils import embedding_service
 from aih_rag.schema import TextNode
 from aih_rag.vector_stores import VectorStoreQuery
 
@@ -30,15 +36,13 @@ print(root)
 azure_api_key = os.getenv("API_Key")
 azure_endpoint = os.getenv("End_point")
 azure_api_version = os.getenv("API_version")
-# Initialize AzureOpenAIEmbedding for embedding generation
+# Initialize the embedding model (size set by EMBEDDING_DIMENSIONS)
 
-azure_embedding = AzureOpenAIEmbedding(
-    model="text-embedding-3-small",
-    azure_endpoint=azure_endpoint,
-    api_key=azure_api_key,
-    api_version="2024-02-01",
-    azure_deployment="text-embedding-3-small",
-)
+azure_embedding = create_embedding_model()
+context_packer = ContextPacker(separator="\n\n")
+selector = RetrievalSelector(max_k=TOP_K, baseline_k=TOP_K, embed=embedding_service.embed)
+# Searches the stores' BM25 keyword indexes (no query embedding needed).
+keyword_retriever = FederatedRetriever()
 
 
 def chatbot(
@@ -156,6 +160,7 @@ async def main():
     parser.add_argument("--uuid", type=str, required=True)
     parser.add_argument("--query", type=str, required=True)
     parser.add_argument("--chat_with", type=str, required=True)  # summary/document
+    parser.add_argument("--retrieval_mode", type=str, default=RETRIEVAL_MODE, choices=RETRIEVAL_MODES)
 
     args = parser.parse_args()
     uuid = args.uuid
@@ -173,15 +178,9 @@ async def main():
         # "summarized": "Deeplake_summarized",
         "unsummarized": "Deeplake_unsummarized",
     }
-    chat_sources_clients = [
-        DeepLakeVectorStore(
-            dataset_path=os.path.join(deeplake_dir, store_name),
-            # read_only=True,
-            overwrite=False,
-            # verbose=False,
-        )
-        for store_name in VECTOR_STORE_NAMEs.values()
-    ]
+    store_paths = [os.path.join(deeplake_dir, store_name) for store_name in VECTOR_STORE_NAMEs.values()]
+    # Stores stay open in the process-wide registry between calls.
+    chat_sources_clients = [get_store_registry().get(store_path) for store_path in store_paths]
     print(chat_sources_clients)
     # exit()
     # summaries_dir = os.path.join(user_dir, "summaries")
@@ -198,15 +197,40 @@ async def main():
         else:
             messages = None
         messages_path = doc_chat_history
-        query = VectorStoreQuery(
-            query_embedding=await query_text_embedding(
-                query=user_query, model=azure_embedding
-            ),
-            similarity_top_k=TOP_K,
+        keyword_hits = []
+        lookup = args.retrieval_mode == "auto" and is_keyword_query(user_query)
+        if args.retrieval_mode in ("keyword", "hybrid") or lookup:
+            keyword_hits, _ = keyword_retriever.retrieve_keywords(user_query, store_paths)
+        if args.retrieval_mode == "keyword" or (lookup and keyword_hits):
+            # Exact lookup: answer from the keyword index without embedding the query.
+            hits = keyword_hits[:TOP_K]
+        else:
+            query = VectorStoreQuery(
+                query_embedding=await query_text_embedding(
+                    query=user_query, model=azure_embedding
+                ),
+                similarity_top_k=selector.candidates,
+            )
+            hits = []
+            for store_path, store in zip(store_paths, chat_sources_clients):
+                result = store.query(query)
+                hits.extend(
+                    ScoredChunk(node.text, score, store_path, node.node_id, node.embedding)
+                    for node, score in zip(result.nodes, result.similarities or [0.0] * len(result.nodes))
+                )
+            if hits:
+                # Keep the hits before the scores fall off, in MMR order.
+                selected, _ = selector.select(
+                    [hit.text for hit in hits], [hit.score for hit in hits], [hit.embedding for hit in hits]
+                )
+                hits = [hits[index] for index in selected]
+            if keyword_hits:
+                # Add exact-term matches dense search missed.
+                hits = reciprocal_rank_fusion([hits, keyword_hits])[:TOP_K]
+        # Merge overlapping chunks, drop near-duplicates and fit the token budget.
+        reference_text, _ = context_packer.pack(
+            [hit.text for hit in hits], [hit.score for hit in hits], [hit.dataset_path for hit in hits]
         )
-        query_results = [store.query(query).nodes for store in chat_sources_clients]
-        nodes = [node.text for nodes in query_results for node in nodes]
-        reference_text = "\n\n".join(nodes)
     elif chat_with == "summary":
         if os.path.exists(summary_chat_history):
             messages = read_json(summary_chat_history)
@@ -5,11 +5,13 @@ from dotenv import load_dotenv
 
 load_dotenv()
 from chat import chatbot
-from aih_rag.vector_stores import DeepLakeVectorStore
+from External.store_registry import get_store_registry
+from External.context import ContextPacker
+from External.selector import RetrievalSelector
 from source.utils import read_json, write_json
 from aih_rag.vector_stores.types import VectorStoreQuery, VectorStoreQueryMode
-from source.vector_store.utils import query_text_embedding
-from aih_rag.embeddings import AzureOpenAIEmbedding
+from source.vector_store.utils import embedding_service, query_text_embedding
+from External.embedding_service import create_embedding_model
 from aih_automaton import Task, Agent, LinearSyncPipeline
 from source.AzureOpenai import AzureOpenAIModel
 from aih_automaton.tasks.task_literals import OutputType
@@ -17,15 +19,10 @@ from aih_automaton.tasks.task_literals import OutputType
 azure_api_key = os.getenv("API_Key")
 azure_endpoint = os.getenv("End_point")
 azure_api_version = os.getenv("API_version")
-# Initialize AzureOpenAIEmbedding for embedding generation
+# Initialize the embedding model (size set by EMBEDDING_DIMENSIONS)
 
-azure_embedding = AzureOpenAIEmbedding(
-    model="text-embedding-3-small",
-    azure_endpoint=azure_endpoint,
-    api_key=azure_api_key,
-    api_version="2024-02-01",
-    azure_deployment="text-embedding-3-small",
-)
+azure_embedding = create_embedding_model()
+context_packer = ContextPacker(separator="\n")
 
 from summarize_app import main as summmarizer_main
 
@@ -57,6 +54,7 @@ def chat_bot(messages):
 load_dotenv()
 
 TOP_K = 5
+selector = RetrievalSelector(max_k=TOP_K, baseline_k=TOP_K, embed=embedding_service.embed)
 
 # Initialize session state
 if "messages" not in st.session_state:
@@ -171,9 +169,10 @@ async def main():
                 #     )
 
         elif chat_with == "document":
-            st.session_state["vector_store"] = DeepLakeVectorStore(
-                dataset_path=os.path.join(deeplake_dir, "Deeplake_unsummarized"),
-                overwrite=False,
+            # Opened once per process and shared by reruns and sessions; reopened only
+            # when the dataset changes (see External.store_registry).
+            st.session_state["vector_store"] = get_store_registry().get(
+                os.path.join(deeplake_dir, "Deeplake_unsummarized"),
                 verbose=True,
             )
             print("Vector store initialized.")
@@ -202,11 +201,21 @@ async def main():
                     query_embedding=await query_text_embedding(
                         query=user_query, model=azure_embedding
                     ),
-                    similarity_top_k=TOP_K,
+                    similarity_top_k=selector.candidates,
                     mode=VectorStoreQueryMode.DEFAULT,
                 )
                 query_results = st.session_state.vector_store.query(vs_query)
-                retrived_text = "\n".join([node.text for node in query_results.nodes])
+                nodes = query_results.nodes
+                similarities = query_results.similarities or [0.0] * len(nodes)
+                if nodes:
+                    # Keep the hits before the scores fall off, in MMR order.
+                    selected, _ = selector.select(
+                        [node.text for node in nodes], similarities, [node.embedding for node in nodes]
+                    )
+                    nodes = [nodes[index] for index in selected]
+                    similarities = [similarities[index] for index in selected]
+                # Merge overlapping chunks, drop near-duplicates and fit the token budget.
+                retrived_text, _ = context_packer.pack([node.text for node in nodes], similarities)
 
                 # print("retrived_text",retrived_text)
 
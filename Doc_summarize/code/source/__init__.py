@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Shared modules (`External.*`) live at the repository root.
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+if _REPO_ROOT not in sys.path:
+    sys.path.append(_REPO_ROOT)
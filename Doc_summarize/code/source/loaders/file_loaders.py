@@ -1,6 +1,7 @@
 import pymupdf4llm
 from docx import Document
-from .utils import retry_async, retry_sync, chunk_text
+from .utils import retry_async, retry_sync, stream_chunks
+from External.chunking import ChunkTable, StreamingChunker
 import asyncio
 import os
 
@@ -23,33 +24,166 @@ def read_docx(docx_path):
     return '\n'.join(text)
 from PyPDF4 import PdfFileReader
 import pymupdf
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from itertools import islice
 
-async def read_pdf(pdf_path):
+# Large PDFs are split into page ranges of this size and parsed in parallel.
+PAGES_PER_SHARD = 50
+# Smaller ranges when streaming, so the first chunks are available early.
+STREAM_PAGES_PER_SHARD = 10
+MAX_EXTRACTION_WORKERS = os.cpu_count() or 1
 
-    pdf = pymupdf.open(pdf_path)
-    text = ' '.join ([page.get_text() for page in pdf])
+# Pages with fewer characters than this have no usable text layer.
+MIN_TEXT_LAYER_CHARS = 20
+# Share of the page covered by images before an empty page is OCR'd.
+MIN_OCR_IMAGE_COVERAGE = 0.1
+OCR_DPI = 300
+# Set after the first OCR failure in this process, so it is reported once.
+_ocr_failure_reported = False
+
+_extraction_executor = None
+
+
+def get_extraction_executor() -> ProcessPoolExecutor:
+    """
+    Return the process pool used for CPU-bound document parsing.
+    The pool is created on first use and shared by every loader in the process.
+    """
+    global _extraction_executor
+    if _extraction_executor is None:
+        _extraction_executor = ProcessPoolExecutor(max_workers=MAX_EXTRACTION_WORKERS)
+    return _extraction_executor
+
+
+def _pdf_page_count(pdf_path):
+    with pymupdf.open(pdf_path) as pdf:
+        return pdf.page_count
+
+
+def _page_needs_ocr(page, text):
+    """A page goes to OCR only when it has no usable text layer but is covered by images."""
+    if len(text.strip()) >= MIN_TEXT_LAYER_CHARS:
+        return False
+    page_area = abs(page.rect) or 1.0
+    image_area = sum(
+        abs(pymupdf.Rect(image["bbox"]) & page.rect) for image in page.get_image_info()
+    )
+    return image_area / page_area >= MIN_OCR_IMAGE_COVERAGE
+
+
+def _read_pdf_page(page):
+    global _ocr_failure_reported
+    text = page.get_text()
+    if _page_needs_ocr(page, text):
+        try:
+            textpage = page.get_textpage_ocr(dpi=OCR_DPI, full=True)
+        except Exception as e:
+            # Usually Tesseract is missing; keep the (empty) text layer instead of failing the document.
+            if not _ocr_failure_reported:
+                _ocr_failure_reported = True
+                print(f"OCR of PDF pages failed, using their text layer instead: {e}")
+            return text
+        text = page.get_text(textpage=textpage)
     return text
+
+
+def _read_pdf_page_range(pdf_path, start, stop):
+    """Extract the text of pages [start, stop). Runs inside a worker process."""
+    with pymupdf.open(pdf_path) as pdf:
+        return [_read_pdf_page(pdf[page_number]) for page_number in range(start, stop)]
+
+
+async def iter_pdf_pages(pdf_path, pages_per_shard=STREAM_PAGES_PER_SHARD, max_pending_shards=None):
+    """
+    Yield the text of each PDF page, in order, as soon as its shard is parsed.
+    At most `max_pending_shards` page ranges are in flight at once, which bounds
+    the memory held for a single document.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_extraction_executor()
+    page_count = await loop.run_in_executor(executor, _pdf_page_count, pdf_path)
+    shard_starts = iter(range(0, page_count, pages_per_shard))
+
+    def submit(start):
+        stop = min(start + pages_per_shard, page_count)
+        return loop.run_in_executor(executor, _read_pdf_page_range, pdf_path, start, stop)
+
+    pending = deque(
+        submit(start)
+        for start in islice(shard_starts, max_pending_shards or MAX_EXTRACTION_WORKERS)
+    )
+    try:
+        while pending:
+            pages = await pending.popleft()
+            next_start = next(shard_starts, None)
+            if next_start is not None:
+                pending.append(submit(next_start))
+            for page in pages:
+                yield page
+    finally:
+        # A consumer that stops early, fails or is cancelled leaves shards
+        # queued; drop them so they do not hold pool workers.
+        for future in pending:
+            future.cancel()
+
+
+async def read_pdf(pdf_path, pages_per_shard=PAGES_PER_SHARD):
+    """
+    Read a PDF without blocking the event loop.
+    Page ranges are parsed in the extraction process pool and reassembled in order.
+    """
+    pages = [page async for page in iter_pdf_pages(pdf_path, pages_per_shard=pages_per_shard)]
+    return ' '.join(pages)
         
 # @retry_async(fallback='')
 async def file_loader(file_path):
+    """
+    Load a file as a `ChunkTable`: the document text plus the offsets and page
+    of every chunk. Chunks are only materialised as strings when read.
+    """
     extension = os.path.splitext(file_path)[1].lower()  
 
     if extension == ".pdf":
         # pdf_text = await read_pdf_in_markdown(file_path)
-        pdf_text = await read_pdf(file_path)
-        
-        chunks = await chunk_text(pdf_text,chunk_size=CHUNK_SIZE,overlap=OVERLAP)
+        pages = [page async for page in iter_pdf_pages(file_path)]
+        chunks = ChunkTable.from_pages(pages).chunk(chunk_size=CHUNK_SIZE, overlap=OVERLAP)
     elif extension in [".docx", ".doc"]:
-        chunks =  await chunk_text(read_docx(file_path))
+        docx_text = await asyncio.to_thread(read_docx, file_path)
+        chunks = ChunkTable.from_pages([docx_text]).chunk()
         print("Unsupported file format.")
     else:
         return []
     return chunks
 
-async def load_files_async(list_of_files) -> list[str]:
+async def file_loader_stream(file_path, chunker=None):
+    """
+    Yield the chunks of a file as they become available.
+    PDFs are read page by page, so the first chunks can be consumed while the
+    rest of the document is still being parsed. When a `StreamingChunker` is
+    given, `chunker.load_table()` reads the whole document back as a
+    `ChunkTable` once the stream is exhausted.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if chunker is None:
+        chunker = StreamingChunker(chunk_size=CHUNK_SIZE, overlap=OVERLAP)
+
+    if extension == ".pdf":
+        pages = iter_pdf_pages(file_path)
+        async for chunk in stream_chunks(pages, chunker=chunker):
+            yield chunk
+    elif extension in [".docx", ".doc"]:
+        docx_text = await asyncio.to_thread(read_docx, file_path)
+        for chunk in chunker.feed(docx_text) + chunker.finish():
+            yield chunk
+    else:
+        chunker.finish()
+
+
+async def load_files_async(list_of_files) -> list[ChunkTable]:
     """ 
     Load files from a list of file paths asynchronously.
-    returns list of contents
+    returns list of chunk tables
     """
     tasks = [file_loader(file_path) for file_path in list_of_files]
     return  await asyncio.gather(*tasks)
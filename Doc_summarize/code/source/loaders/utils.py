@@ -3,15 +3,28 @@ from logging import Logger
 from functools import wraps
 import asyncio
 import random
+from External.chunking import StreamingChunker, chunk_spans
 async def chunk_text(text, chunk_size=1000, overlap=100):
     """Split text into overlapping chunks."""
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += chunk_size - overlap
-    return chunks
+    return [text[start:end] for start, end in chunk_spans(len(text), chunk_size, overlap)]
+
+
+async def stream_chunks(pages, chunk_size=1000, overlap=100, separator=' ', chunker=None):
+    """
+    Split an async stream of page texts into overlapping chunks.
+    Produces the same chunks as `chunk_text(separator.join(pages))`, but only
+    keeps the unfinished tail of the text in memory. Pass a `StreamingChunker`
+    to read the document back as a `ChunkTable` afterwards (`load_table`).
+    """
+    if chunker is None:
+        chunker = StreamingChunker(chunk_size, overlap, separator)
+    async for page in pages:
+        for chunk in chunker.feed(page):
+            yield chunk
+    for chunk in chunker.finish():
+        yield chunk
+
+
 def retry_async(
     exceptions: tuple = (Exception,),
     retries=3,
@@ -4,6 +4,7 @@ import asyncio
 import random
 import time
 import json
+from External.chunking import chunk_spans
 
 def retry_async(
     exceptions: tuple = (Exception,),
@@ -112,10 +113,4 @@ def write_json(data, file_path):
 
 async def chunk_text(text, chunk_size=1000, overlap=100):
     """Split text into overlapping chunks."""
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += chunk_size - overlap
-    return chunks
+    return [text[start:end] for start, end in chunk_spans(len(text), chunk_size, overlap)]
@@ -1,6 +1,7 @@
 from aih_rag.llms.ai21 import AI21
 from aih_rag.embeddings.azure_openai import AzureOpenAIEmbedding
 from typing import Optional, Any
+from External.embedding_cache import get_embedding_cache, model_identity
 
 
 async def query_text_embedding(query: Optional[str] = None, text: Optional[str] = None, model: AzureOpenAIEmbedding = None) -> Any:
@@ -13,6 +14,7 @@ async def query_text_embedding(query: Optional[str] = None, text: Optional[str]
         model (Any): The model used to generate embeddings, defaults to jina_processor if not specified.
 
     Note: Either query or text must be provided. If provided both, embedding for query will be returned.
+    Embeddings are looked up in the shared on-disk embedding cache first.
     
     Returns:
         Any: The embedding generated from the input query or text.
@@ -20,12 +22,23 @@ async def query_text_embedding(query: Optional[str] = None, text: Optional[str]
     Raises:
         ValueError: If neither query nor text is provided.
     """
+    cache = get_embedding_cache()
+    model_name, dimensions = model_identity(model)
     if query is not None:
-        return model.get_query_embedding(query=query)
+        # Query embeddings are kept apart: some models embed queries differently.
+        key = (f"{model_name}/query", dimensions, query)
+        embed = lambda: model.get_query_embedding(query=query)
     elif text is not None:
         # print('TEXT',text)
-        return model.get_text_embedding(text=text)
+        key = (model_name, dimensions, text)
+        embed = lambda: model.get_text_embedding(text=text)
     else:
         raise ValueError("Please provide either a 'query' or 'text' parameter.")
 
+    embedding = cache.get(*key)
+    if embedding is None:
+        embedding = embed()
+        cache.set(*key, embedding)
+    return embedding
+
 
@@ -4,20 +4,44 @@ import tqdm
 from aih_rag.schema import Document, TextNode
 import asyncio
 from .embedding import query_text_embedding
-from aih_rag.embeddings import AzureOpenAIEmbedding
+from External.chunking import TokenChunker, chunk_spans
+from External.embedding_cache import model_identity
+from External.embedding_service import EmbeddingService, create_embedding_model
+from External.keyword_index import KeywordIndex
+from External.manifest import IngestManifest
+from External.vector import create_vector_store, delete_nodes
 
 import os
 from dotenv import load_dotenv; load_dotenv()
 azure_api_key = os.getenv("API_Key")
 azure_endpoint = os.getenv("End_point")
 azure_api_version = os.getenv("API_version")
-azure_embedding = AzureOpenAIEmbedding(
-    model="text-embedding-3-small",
-    azure_endpoint=azure_endpoint,
-    api_key=azure_api_key,
-    api_version="2024-02-01",
-    azure_deployment="text-embedding-3-small",
+azure_embedding = create_embedding_model()
+embedding_service = EmbeddingService(azure_embedding)
+# Embedding sub-chunks are packed to a token budget (about 1,000 characters of prose).
+EMBEDDING_CHUNK_TOKENS = 256
+EMBEDDING_CHUNK_OVERLAP_TOKENS = 16
+embedding_chunker = TokenChunker(
+    max_tokens=EMBEDDING_CHUNK_TOKENS, overlap_tokens=EMBEDDING_CHUNK_OVERLAP_TOKENS
 )
+
+
+def ingest_config():
+    """What the stored sub-chunks depend on; a manifest saved under another config triggers a rebuild."""
+    from ..loaders.file_loaders import CHUNK_SIZE, OVERLAP
+
+    model, dimensions = model_identity(azure_embedding)
+    return {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": OVERLAP,
+        "embedding_chunk_tokens": EMBEDDING_CHUNK_TOKENS,
+        "embedding_chunk_overlap_tokens": EMBEDDING_CHUNK_OVERLAP_TOKENS,
+        "token_counter": type(embedding_chunker.counter).__name__,
+        "embedding_model": model,
+        "embedding_dimensions": dimensions,
+    }
+
+
 async def create_node(chunk):
     embedding = await query_text_embedding(text=chunk, model=azure_embedding)
     # text=chunks[index], model=azure_embedding
@@ -29,22 +53,89 @@ async def create_node(chunk):
     return node
 
 
-async def async_create_nodes(chunks) -> list[TextNode]:
-    tasks = [create_node(chunk) for chunk in chunks]
-    nodes = await asyncio.gather(*tasks)
-    return nodes
+async def async_create_nodes(chunks, token_counts=None, node_ids=None) -> list[TextNode]:
+    """
+    Embed chunks in concurrent batch requests and wrap them as nodes.
+    Pass the chunks' token counts (e.g. `ChunkTable.token_counts`) to skip re-counting,
+    and `node_ids` to choose the node ids (new UUIDs otherwise).
+    """
+    chunks = list(chunks)
+    embeddings = await embedding_service.aembed(chunks, token_counts)
+    if node_ids is None:
+        return [
+            TextNode(text=chunk, embedding=embedding)
+            for chunk, embedding in zip(chunks, embeddings)
+        ]
+    return [
+        TextNode(id_=node_id, text=chunk, embedding=embedding)
+        for node_id, chunk, embedding in zip(node_ids, chunks, embeddings)
+    ]
+
+
+async def async_upsert_tables(dataset_path, file_paths, tables):
+    """
+    Store the embedding sub-chunks of each document's `ChunkTable`, re-embedding
+    only what changed since the last run.
+
+    The store at `dataset_path` ends up holding exactly `file_paths`: the
+    nodes of documents no longer listed are deleted, unchanged documents
+    (same file hash in the ingest manifest) are skipped, and for a changed
+    document only the sub-chunks the store does not already hold are embedded.
+    A store without a manifest, or whose manifest was saved under another
+    `ingest_config()`, is rebuilt. The store's BM25
+    `KeywordIndex` gets the same additions and deletions.
+
+    Args:
+        dataset_path (str): Vector store path.
+        file_paths (list): Document paths, in the order of `tables`.
+        tables (list): One `ChunkTable` per document, or a callable returning
+            it (e.g. `StreamingChunker.load_table`), called only for documents
+            that need re-embedding.
+
+    Returns:
+        Counter: files and chunks skipped, embedded and deleted.
+    """
+    manifest = IngestManifest(dataset_path, config=ingest_config())
+    keywords = KeywordIndex(dataset_path)
+    store = create_vector_store(dataset_path=dataset_path, overwrite=not manifest.exists())
+    if not manifest.exists():
+        keywords.clear()
+    removed = manifest.remove_missing(file_paths)
+    delete_nodes(store, removed)
+    keywords.remove(removed)
+    manifest.save()
+    keywords.save()
+
+    pending = dict(manifest.pending(file_paths))
+    for file_path, table in zip(file_paths, tables):
+        digest = pending.pop(file_path, None)
+        if digest is None:
+            continue
+        if callable(table):
+            table = table()
+        sub_chunks = table.rechunk_tokens(embedding_chunker)
+        chunks = list(sub_chunks)
+        entries, new_indices, node_ids, stale = manifest.diff_chunks(file_path, chunks)
+        delete_nodes(store, stale)
+        keywords.remove(stale)
+        if new_indices:
+            token_counts = sub_chunks.token_counts
+            nodes = await async_create_nodes(
+                [chunks[index] for index in new_indices],
+                None if token_counts is None else [token_counts[index] for index in new_indices],
+                node_ids=node_ids,
+            )
+            await store.async_add(nodes)
+            keywords.add(node_ids, [node.text for node in nodes])
+        manifest.record(file_path, digest, entries)
+        manifest.save()
+        keywords.save()
+    return manifest.stats
 def chunk_text(text, chunk_size=1000, overlap=100):
     """
     Splits text into chunks with a specific overlap.
     """
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        start += chunk_size - overlap  # Move to the next chunk with overlap
-    return chunks
+    return [text[start:end] for start, end in chunk_spans(len(text), chunk_size, overlap)]
 
 def chunk_text_with_overlap(text, max_tokens=100, overlap=20):
     """
@@ -12,14 +12,16 @@ import asyncio
 from source.vector_store.embedding import query_text_embedding
 from source.utils import read_json, write_json
 from source.utils import chunk_text
-from aih_rag.vector_stores.deeplake import DeepLakeVectorStore
+from External.vector import create_vector_store
 from aih_rag.schema import TextNode
 
-from source.loaders.file_loaders import file_loader, load_files_async
+from source.loaders.file_loaders import file_loader, file_loader_stream, load_files_async
+from source.loaders.file_loaders import CHUNK_SIZE, OVERLAP
+from External.chunking import StreamingChunker
 
 # from openai import AzureOpenAI
 from source.AzureOpenai import AzureOpenAIModel
-from aih_rag.embeddings.azure_openai import AzureOpenAIEmbedding
+from External.embedding_service import create_embedding_model
 
 # Load environment variables
 load_dotenv()
@@ -62,13 +64,7 @@ azure_api_key = os.getenv("API_Key")
 azure_endpoint = os.getenv("End_point")
 azure_api_version = os.getenv("API_version")
 
-azure_embedding = AzureOpenAIEmbedding(
-    model="text-embedding-3-small",
-    azure_endpoint=azure_endpoint,
-    api_key=azure_api_key,
-    api_version="2024-02-01",
-    azure_deployment="text-embedding-3-small",
-)
+azure_embedding = create_embedding_model()
 
 client = AzureOpenAIModel(
     azure_endpoint=azure_endpoint,
@@ -79,7 +75,7 @@ client = AzureOpenAIModel(
         "model": "gpt-35-turbo",
     },
 )
-from source.vector_store.utils import async_create_nodes, create_node
+from source.vector_store.utils import async_create_nodes, async_upsert_tables, create_node, embedding_chunker
 
 # Retry logic decorator
 from source.utils import retry_async, retry_sync
@@ -216,6 +212,25 @@ async def async_summarize_document(chunks, no_pipeline=True):
     return summaries_of_chunks
 
 
+async def async_summarize_stream(chunk_stream, no_pipeline=True):
+    """Summarize chunks as they arrive from a streaming loader.
+    The map phase starts with the first chunk instead of after the whole document is read.
+    Chunk strings are dropped once summarized; keep the loader's `StreamingChunker`
+    to read the chunks back as a `ChunkTable` (`load_table`).
+    returns list of dict of title and summary
+    """
+    summarize_chunk = (
+        generate_chunk_summary_and_title_no_pipeline
+        if no_pipeline
+        else generate_chunk_summary_and_title
+    )
+    tasks = []
+    async for chunk in chunk_stream:
+        tasks.append(asyncio.create_task(summarize_chunk(chunk)))
+    summaries_of_chunks = await asyncio.gather(*tasks)
+    return summaries_of_chunks
+
+
 from aih_rag.schema import TextNode
 
 
@@ -254,9 +269,17 @@ async def main(**kwargs):
     write_json(
         {"process": "Loading your document"}, os.path.join(process_dir, "process.json")
     )
-    chunks = await asyncio.gather(*(file_loader(file_path) for file_path in pdf_paths))
-    modules_for_summary = [f"{item}" for sublist in chunks for item in sublist]
-    print("module", modules_for_summary[0])
+    chunkers = [StreamingChunker(chunk_size=CHUNK_SIZE, overlap=OVERLAP) for _ in pdf_paths]
+    streamed = await asyncio.gather(
+        *(
+            async_summarize_stream(file_loader_stream(file_path, chunker=chunker))
+            for file_path, chunker in zip(pdf_paths, chunkers)
+        )
+    )
+    # Documents are read back from the chunkers' spools one at a time, and
+    # only when they need re-embedding.
+    modules_for_summary = [chunker.load_table for chunker in chunkers]
+    summary_title_dict_list = [item for summaries in streamed for item in summaries]
     write_json(
         {"process": "Pdf loaded, summarizing your document"},
         os.path.join(process_dir, "process.json"),
@@ -265,10 +288,9 @@ async def main(**kwargs):
     # print("No. of chunks", len(modules_for_summary) )
 
     print(
-        "Time to load chunks",
+        "Time to load and summarize chunks",
         time.time() - start_time,
     )
-    summary_title_dict_list = await async_summarize_document(chunks=modules_for_summary)
 
     write_json(
         {
@@ -306,20 +328,12 @@ async def main(**kwargs):
     # nodes_summarized = await async_create_nodes([str(data) for data in summary_title_dict_list])
     # await store_summarized.async_add(nodes_summarized)
 
-    store_unsummarized = DeepLakeVectorStore(
-        dataset_path=dataset_path_unsummarized, overwrite=True
-    )
-    print("total_chunks", len(modules_for_summary))
-    overall_chunks = []
-    print("chunksss", modules_for_summary[0])
-    for chunk in modules_for_summary:
-        sub_chunks = await chunk_text(chunk, chunk_size=1000, overlap=50)
-        overall_chunks.extend(sub_chunks)
-
-    print("total_sub_chunks", len(overall_chunks))
-    nodes_unsummarized = await async_create_nodes(overall_chunks)
-
-    await store_unsummarized.async_add(nodes_unsummarized)
+    print("total_chunks", sum(len(chunker) for chunker in chunkers))
+    # Only documents added or changed since the last run are re-embedded.
+    ingest_stats = await async_upsert_tables(dataset_path_unsummarized, pdf_paths, modules_for_summary)
+    for chunker in chunkers:
+        chunker.close()
+    print("ingest", dict(ingest_stats))
     print("Overall Time to generate summary", time.time() - start_time)
     return
 
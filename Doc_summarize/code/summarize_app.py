@@ -53,19 +53,22 @@ async def main():
                     f.write(uploaded_file.read())
                 document_paths.append(file_path)
             starttime = time.time()
-            from source.loaders.file_loaders import file_loader
+            from source.loaders.file_loaders import file_loader_stream, CHUNK_SIZE, OVERLAP
+            from summarize import async_summarize_stream
+            from External.chunking import StreamingChunker
 
-            chunks = await asyncio.gather(
-                *(file_loader(file_path) for file_path in document_paths)
-            )
-            modules_for_summary = [f"{item}" for sublist in chunks for item in sublist]
             st.toast("Documents are being processed, Getting summary...")
-
-            from summarize import async_summarize_document
-
-            summary_title_dict_list = await async_summarize_document(
-                chunks=modules_for_summary
+            chunkers = [StreamingChunker(chunk_size=CHUNK_SIZE, overlap=OVERLAP) for _ in document_paths]
+            streamed = await asyncio.gather(
+                *(
+                    async_summarize_stream(file_loader_stream(file_path, chunker=chunker))
+                    for file_path, chunker in zip(document_paths, chunkers)
+                )
             )
+            modules_for_summary = [chunker.load_table for chunker in chunkers]
+            summary_title_dict_list = [
+                item for summaries in streamed for item in summaries
+            ]
             st.toast("All most Done...")
 
             from source.utils import read_json, write_json
@@ -109,22 +112,15 @@ async def main():
             st.session_state['summary'] = summary
             st.write(st.session_state['summary'])
             
-            from aih_rag.vector_stores.deeplake import DeepLakeVectorStore
-            from source.vector_store.utils import async_create_nodes
+            from source.vector_store.utils import async_upsert_tables
 
             from RLHF_summarizer import retry_summary_update
-            from source.utils  import chunk_text
-            store_unsummarized = DeepLakeVectorStore(
-                dataset_path=os.path.join(deeplake_dir, "Deeplake_unsummarized"), overwrite=True
+            # Only documents added or changed since the last run are re-embedded.
+            await async_upsert_tables(
+                os.path.join(deeplake_dir, "Deeplake_unsummarized"), document_paths, modules_for_summary
             )
-            
-            overall_chunks = []
-            for chunk in modules_for_summary:
-                sub_chunks = await chunk_text(chunk, chunk_size=1000, overlap=50)
-                overall_chunks.extend(sub_chunks)
-
-            nodes = await async_create_nodes(overall_chunks)
-            await store_unsummarized.async_add(nodes)
+            for chunker in chunkers:
+                chunker.close()
             st.success("Documents processed and summarized successfully!")
 if __name__ == "__main__":
     import asyncio
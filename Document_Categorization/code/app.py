@@ -6,7 +6,7 @@ from main import indentify_context_fetcher, count_elements_in_json, save_to_json
 
 # Define constants
 ALLOWED_FILE_TYPES = [
-    "pdf", "txt", "docx", "html", "htm", "rtf", "jpg", "png", "jpeg", "tiff", "csv", "xls", "xlsx", "xlsb"
+    "pdf", "txt", "docx", "html", "htm", "rtf", "jpg", "png", "jpeg", "tiff", "tif", "csv", "xls", "xlsx", "xlsb"
 ]
 MAX_FILES = 10  # Maximum number of files that can be uploaded
 FEEDBACK_FILE_PATH = r"C:\Users\Rushikesh\Desktop\Hridayam\feedback.json"  # Static feedback file path
@@ -1,6 +1,6 @@
 import os
 from External.extract_text import FileTextExtractor
-from External.image_support import extract_image_text
+from External.image_support import extract_image_text, extract_image_text_tiered
 from concurrent.futures import ThreadPoolExecutor
 
 # Initialize the text extractor
@@ -8,7 +8,7 @@ extract_text = FileTextExtractor()
 
 # Define allowed file types
 ALLOWED_FILE_TYPES = [
-    "pdf", "txt", "docx", "html", "htm", "rtf", "jpg", "png", "jpeg", "tiff", "csv", "xls", "xlsx", "xlsb"
+    "pdf", "txt", "docx", "html", "htm", "rtf", "jpg", "png", "jpeg", "tiff", "tif", "csv", "xls", "xlsx", "xlsb"
 ]
 
 # Function to extract text from a single file
@@ -22,7 +22,7 @@ def fetch_invoice_text(file_path):
     Returns:
         str: Extracted text or an error message.
     """
-    if file_path.endswith(('.pdf', '.docx', '.txt', '.html', '.htm', '.rtf', '.tiff', '.csv', '.xls', '.xlsx', '.xlsb')):
+    if file_path.endswith(('.pdf', '.docx', '.txt', '.html', '.htm', '.rtf', '.tiff', '.tif', '.csv', '.xls', '.xlsx', '.xlsb')):
         return extract_text.extract_text_from_file(file_path)
     elif file_path.endswith(('.jpg', '.jpeg', '.png')):
         return extract_image_text(file_path)
@@ -38,13 +38,17 @@ def process_single_file(file_path):
         file_path (str): Path to the file.
 
     Returns:
-        dict: Dictionary containing file path and extracted text.
+        dict: Dictionary containing file path, extracted text and the tier that produced it.
     """
-    text = fetch_invoice_text(file_path)
+    if file_path.endswith(('.jpg', '.jpeg', '.png')):
+        result = extract_image_text_tiered(file_path)
+        text, tier = result['text'], result['tier']
+    else:
+        text, tier = fetch_invoice_text(file_path), 'parser'
     if text:
-        return {'file': file_path, 'text': text}
+        return {'file': file_path, 'text': text, 'tier': tier}
     else:
-        return {'file': file_path, 'text': 'Error: Unsupported file format or empty content.'}
+        return {'file': file_path, 'text': 'Error: Unsupported file format or empty content.', 'tier': tier}
 
 # Process multiple files in parallel
 def process_multiple_files(file_paths):
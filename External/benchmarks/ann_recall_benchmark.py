@@ -0,0 +1,90 @@
+"""
+Recall@k and latency of the IVF-flat index against exact search.
+
+    python -m External.benchmarks.ann_recall_benchmark --vectors 100000 --dimensions 384
+    python -m External.benchmarks.ann_recall_benchmark --dataset assets/static/dataset
+
+Without `--dataset` the vectors are synthetic: unit vectors scattered around
+random topic directions, which is closer to real embeddings than uniform noise.
+Queries are perturbed copies of stored vectors.
+"""
+import argparse
+import os
+import statistics
+import time
+
+import numpy as np
+
+from External.ann import IVFFlatIndex
+from External.numpy_store import EMBEDDINGS_FILE
+
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def synthetic_vectors(count, dimensions, topics, rng):
+    centers = normalize(rng.normal(size=(topics, dimensions)))
+    labels = rng.integers(0, topics, count)
+    noise = rng.normal(scale=1.0 / np.sqrt(dimensions), size=(count, dimensions))
+    return normalize(centers[labels] + 1.0 * noise).astype(np.float32)
+
+
+def exact_top_k(matrix, query, top_k):
+    scores = matrix @ query
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    return best[np.argsort(-scores[best])]
+
+
+def timed(function, queries):
+    results, timings = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(function(query))
+        timings.append(time.perf_counter() - started)
+    return results, statistics.median(timings) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", help="NumPy vector store directory to benchmark instead of synthetic data.")
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--topics", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--n-lists", type=int, help="Default: sqrt(vectors).")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.dataset:
+        matrix = np.load(os.path.join(args.dataset, EMBEDDINGS_FILE), mmap_mode="r")
+    else:
+        matrix = synthetic_vectors(args.vectors, args.dimensions, args.topics, rng)
+    picked = matrix[rng.integers(0, len(matrix), args.queries)]
+    queries = normalize(picked + rng.normal(scale=0.5 / np.sqrt(matrix.shape[1]), size=picked.shape)).astype(np.float32)
+
+    started = time.perf_counter()
+    index = IVFFlatIndex.train(matrix, n_lists=args.n_lists)
+    print(
+        f"{len(matrix)} vectors x {matrix.shape[1]}, {len(index.centroids)} lists, "
+        f"trained in {time.perf_counter() - started:.1f} s"
+    )
+
+    truth, exact_ms = timed(lambda query: exact_top_k(matrix, query, args.top_k), queries)
+    print(f"{'exact':>10}  recall@{args.top_k} 1.000  p50 {exact_ms:7.3f} ms")
+    for nprobe in args.nprobe:
+        found, ann_ms = timed(lambda query: index.search(matrix, query, args.top_k, nprobe)[0], queries)
+        recall = statistics.mean(
+            len(set(expected.tolist()) & set(got.tolist())) / args.top_k
+            for expected, got in zip(truth, found)
+        )
+        print(
+            f"nprobe {nprobe:>3}  recall@{args.top_k} {recall:.3f}  p50 {ann_ms:7.3f} ms  "
+            f"speed-up {exact_ms / ann_ms:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Microbenchmark: character windows (`chunk_text`) vs token-budgeted chunking (`TokenChunker`).
+
+    python -m External.benchmarks.chunking_benchmark --file document.txt
+    python -m External.benchmarks.chunking_benchmark --vocab cl100k_base.tiktoken
+
+Reports throughput, chunk count, the token spread of the chunks and how many
+chunks start or end inside a word or sentence.
+"""
+import argparse
+import random
+import re
+import statistics
+import time
+
+from External.chunking import (
+    BPETokenCounter,
+    HeuristicTokenCounter,
+    TokenChunker,
+    chunk_spans,
+)
+
+WORDS = (
+    "the invoice total amount due payment terms customer account balance report "
+    "quarter revenue growth contract renewal service agreement delivery schedule"
+).split()
+SENTENCE_END = re.compile(r"[.!?][\"')\]]*$")
+
+
+def synthetic_text(size, seed=0):
+    """Prose-like text: sentences of 5-30 words in paragraphs of 2-8 sentences."""
+    rng = random.Random(seed)
+    paragraphs, length = [], 0
+    while length < size:
+        sentences = []
+        for _ in range(rng.randint(2, 8)):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(5, 30))]
+            sentences.append(" ".join(words).capitalize() + ".")
+        paragraphs.append(" ".join(sentences))
+        length += len(paragraphs[-1]) + 2
+    return "\n\n".join(paragraphs)
+
+
+def boundary_stats(text, spans):
+    mid_word = mid_sentence = 0
+    for start, end in spans:
+        if (start > 0 and not text[start - 1].isspace() and not text[start].isspace()) or (
+            end < len(text) and not text[end - 1].isspace() and not text[end].isspace()
+        ):
+            mid_word += 1
+        if end < len(text) and not SENTENCE_END.search(text[start:end].rstrip()):
+            mid_sentence += 1
+    return mid_word, mid_sentence
+
+
+def run(name, text, counter, chunk, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        spans = chunk()
+        timings.append(time.perf_counter() - started)
+    tokens = [counter.count(text[start:end]) for start, end in spans]
+    mid_word, mid_sentence = boundary_stats(text, spans)
+    best = min(timings)
+    print(
+        f"{name:<28} {len(text) / best / 1e6:8.2f} MB/s {len(spans):7d} chunks "
+        f"tokens mean {statistics.mean(tokens):7.1f} max {max(tokens):5d} "
+        f"stdev {statistics.pstdev(tokens):6.1f}  "
+        f"mid-word {mid_word / len(spans):6.1%}  mid-sentence {mid_sentence / len(spans):6.1%}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="Text file to chunk (default: synthetic prose).")
+    parser.add_argument("--size", type=int, default=2_000_000, help="Characters of synthetic text.")
+    parser.add_argument("--vocab", help="tiktoken-format BPE vocabulary for exact counts.")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--overlap", type=int, default=50)
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--overlap-tokens", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as handle:
+            text = handle.read()
+    else:
+        text = synthetic_text(args.size)
+
+    counters = [("heuristic", HeuristicTokenCounter())]
+    if args.vocab:
+        counters.append(("bpe", BPETokenCounter.from_file(args.vocab)))
+    # Chunk statistics are measured with the most exact counter available.
+    reference = counters[-1][1]
+
+    print(f"{len(text):,} characters")
+    def character_windows():
+        spans = list(chunk_spans(len(text), args.chunk_size, args.overlap))
+        [text[start:end] for start, end in spans]  # `chunk_text` returns the strings.
+        return spans
+
+    run(f"chunk_text {args.chunk_size}/{args.overlap}", text, reference, character_windows, args.repeat)
+    for name, counter in counters:
+        chunker = TokenChunker(args.max_tokens, args.overlap_tokens, counter)
+
+        def token_chunks():
+            table = chunker.chunk(text)
+            list(table)
+            return list(zip(table.starts, table.ends))
+
+        run(f"TokenChunker {args.max_tokens}/{args.overlap_tokens} {name}", text, reference, token_chunks, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Retrieval quality, size and search time of shortened embeddings on our own stores.
+
+    python -m External.benchmarks.embedding_dimensions_benchmark --dataset assets/static/dataset
+    python -m External.benchmarks.embedding_dimensions_benchmark --dataset temp/users/*/dataset_* \\
+        --queries questions.txt --dimensions 256 512 1024
+
+The datasets (NumPy or DeepLake stores written at full width) are pooled, and
+every width is compared with full-width exact search: recall@k is the overlap
+of the top-k rows, top-1 the share of queries whose best row is unchanged.
+Vectors are shortened the way `External.quantize_store --dimensions` does it.
+
+Queries are the lines of `--queries`, embedded once at full width (this calls
+the embeddings API), or otherwise sampled stored vectors, with each query's
+own row left out of the results.
+"""
+import argparse
+import glob
+import os
+import statistics
+import time
+
+import numpy as np
+
+from External.numpy_store import EMBEDDINGS_FILE, NumpyVectorStore, fit_dimensions, normalize
+
+
+def load_vectors(dataset_path):
+    if os.path.exists(os.path.join(dataset_path, EMBEDDINGS_FILE)):
+        return NumpyVectorStore(dataset_path).vectors()
+    from External.quantize_store import read_deeplake_store
+
+    return read_deeplake_store(dataset_path)[1]
+
+
+def embed_queries(path):
+    from External.embedding_service import EmbeddingService, create_embedding_model
+
+    with open(path, "r", encoding="utf-8") as file:
+        questions = [line.strip() for line in file if line.strip()]
+    # Full width: the shorter widths are cut from these vectors.
+    service = EmbeddingService(create_embedding_model(dimensions=None), use_cache=True)
+    return np.asarray([service.embed_query(question) for question in questions], dtype=np.float32)
+
+
+def top_rows(matrix, query, top_k, skip=None):
+    scores = matrix @ query
+    if skip is not None:
+        scores[skip] = -np.inf
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+def evaluate(matrix, queries, skips, top_k):
+    """(result rows per query, median search time in ms)."""
+    results, timings = [], []
+    for query, skip in zip(queries, skips):
+        started = time.perf_counter()
+        results.append(top_rows(matrix, query, top_k, skip))
+        timings.append(time.perf_counter() - started)
+    return results, statistics.median(timings) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", nargs="+", required=True, help="Store directories (glob patterns allowed).")
+    parser.add_argument("--queries", help="Text file with one question per line.")
+    parser.add_argument("--sample", type=int, default=200, help="Stored vectors used as queries without --queries.")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[256, 384, 512, 768, 1024])
+    args = parser.parse_args()
+
+    paths = [path for pattern in args.dataset for path in (sorted(glob.glob(pattern)) or [pattern])]
+    matrix = normalize(np.concatenate([load_vectors(path) for path in paths]))
+    full = matrix.shape[1]
+    top_k = min(args.top_k, len(matrix) - 1)
+
+    if args.queries:
+        queries = normalize(embed_queries(args.queries))
+        skips = [None] * len(queries)
+    else:
+        rng = np.random.default_rng(0)
+        skips = rng.choice(len(matrix), min(args.sample, len(matrix)), replace=False)
+        queries = matrix[skips]
+
+    truth, full_ms = evaluate(matrix, queries, skips, top_k)
+    print(f"{len(matrix)} vectors from {len(paths)} stores, {len(queries)} queries, top {top_k}")
+    print(f"{'dims':>6}  {'MB':>8}  recall@{top_k}  top-1  p50 ms")
+    print(f"{full:>6}  {matrix.nbytes / 1e6:8.2f}  {1.0:9.3f}  {1.0:5.3f}  {full_ms:6.3f}")
+    for dimensions in sorted(d for d in args.dimensions if d < full):
+        shortened = np.ascontiguousarray(fit_dimensions(matrix, dimensions))
+        found, ms = evaluate(shortened, fit_dimensions(queries, dimensions), skips, top_k)
+        recall = statistics.mean(
+            len(set(expected.tolist()) & set(got.tolist())) / top_k for expected, got in zip(truth, found)
+        )
+        top_1 = statistics.mean(float(expected[0] == got[0]) for expected, got in zip(truth, found))
+        print(f"{dimensions:>6}  {shortened.nbytes / 1e6:8.2f}  {recall:9.3f}  {top_1:5.3f}  {ms:6.3f}")
+
+
+if __name__ == "__main__":
+    main()
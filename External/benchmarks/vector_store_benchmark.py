@@ -0,0 +1,109 @@
+"""
+Latency benchmark: open + query for the NumPy and DeepLake vector store backends.
+
+    python -m External.benchmarks.vector_store_benchmark --vectors 5000 --queries 200
+
+Each backend is filled with the same random unit vectors in a temporary
+directory, then reopened (as `fetch_relevant_chunks` and the chat apps do
+per request) and queried. Backends whose dependencies are missing are skipped;
+the NumPy backend needs only NumPy (it is timed through `add_vectors` and
+`search`, i.e. without wrapping hits into nodes).
+"""
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def bench_backend(backend, vectors, queries, top_k, repeat_open):
+    if backend == "numpy":
+        from External.numpy_store import NumpyVectorStore
+
+        def open_store(overwrite):
+            return NumpyVectorStore(directory, overwrite=overwrite)
+
+        def add(store):
+            ids = [str(index) for index in range(len(vectors))]
+            store.add_vectors(ids, [f"chunk {index}" for index in ids], vectors)
+
+        def search(store, query):
+            store.search(query, top_k)
+    else:
+        from aih_rag.schema import TextNode
+        from aih_rag.vector_stores.types import VectorStoreQuery
+
+        from External.vector import create_vector_store
+
+        def open_store(overwrite):
+            return create_vector_store(directory, overwrite=overwrite, backend=backend)
+
+        def add(store):
+            store.add(
+                [TextNode(text=f"chunk {index}", embedding=vector.tolist()) for index, vector in enumerate(vectors)]
+            )
+
+        def search(store, query):
+            store.query(VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=top_k))
+
+    directory = tempfile.mkdtemp(prefix=f"bench-{backend}-")
+    try:
+        store = open_store(overwrite=True)
+        started = time.perf_counter()
+        add(store)
+        add_seconds = time.perf_counter() - started
+
+        open_times = []
+        for _ in range(repeat_open):
+            started = time.perf_counter()
+            store = open_store(overwrite=False)
+            open_times.append(time.perf_counter() - started)
+
+        query_times = []
+        for query in queries:
+            started = time.perf_counter()
+            search(store, query)
+            query_times.append(time.perf_counter() - started)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(
+        f"{backend:<9} add {add_seconds * 1e3:9.1f} ms   "
+        f"open p50 {statistics.median(open_times) * 1e3:8.2f} ms   "
+        f"query p50 {statistics.median(query_times) * 1e3:8.3f} ms "
+        f"p95 {percentile(query_times, 0.95) * 1e3:8.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=5000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--repeat-open", type=int, default=5)
+    parser.add_argument("--backends", nargs="+", default=["numpy", "deeplake"])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(args.vectors, args.dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[rng.integers(0, args.vectors, args.queries)]
+
+    print(f"{args.vectors} vectors x {args.dimensions} dimensions, top {args.top_k}")
+    for backend in args.backends:
+        try:
+            bench_backend(backend, vectors, queries, args.top_k, args.repeat_open)
+        except ImportError as error:
+            print(f"{backend:<9} skipped ({error})")
+
+
+if __name__ == "__main__":
+    main()
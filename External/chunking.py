@@ -0,0 +1,387 @@
+import base64
+import os
+import re
+import tempfile
+from array import array
+from bisect import bisect_right
+from collections import deque
+from functools import lru_cache
+
+# Optional BPE vocabulary in tiktoken's file format ("<base64 token> <rank>" per line),
+# e.g. a local copy of cl100k_base.tiktoken. Without it token counts are estimated.
+TOKENIZER_FILE = os.getenv("TOKENIZER_FILE")
+
+
+def chunk_spans(length, chunk_size=1000, overlap=100):
+    """
+    Yield (start, end) offsets of overlapping windows over a text of `length` characters.
+    This is the slicing rule shared by every `chunk_text` in the project.
+    """
+    step = chunk_size - overlap
+    start = 0
+    while start < length:
+        yield start, min(start + chunk_size, length)
+        start += step
+
+
+class ChunkTable:
+    """
+    Chunks of one document, stored as (start, end, page) offsets into a single
+    text buffer instead of as separate strings.
+
+    Re-chunking returns a new table over the same buffer, so multi-level
+    chunking costs a few integers per chunk. Strings are only created when a
+    chunk is read (indexing or iterating), i.e. at the API boundary.
+    """
+
+    def __init__(self, text="", page_starts=None):
+        self.text = text
+        self.page_starts = page_starts if page_starts is not None else array("q", [0])
+        self.starts = array("q")
+        self.ends = array("q")
+        self.pages = array("q")
+        # Filled in by token-aware chunking; None for character windows.
+        self.token_counts = None
+
+    @classmethod
+    def from_pages(cls, pages, separator=" "):
+        """Build an empty table over the pages joined by `separator`, remembering where each page starts."""
+        page_starts = array("q")
+        offset = 0
+        for index, page in enumerate(pages):
+            if index:
+                offset += len(separator)
+            page_starts.append(offset)
+            offset += len(page)
+        return cls(separator.join(pages), page_starts or array("q", [0]))
+
+    def page_at(self, offset):
+        """Index of the page containing `offset`."""
+        return max(0, bisect_right(self.page_starts, offset) - 1)
+
+    def append(self, start, end, tokens=None):
+        self.starts.append(start)
+        self.ends.append(end)
+        self.pages.append(self.page_at(start))
+        if tokens is not None:
+            if self.token_counts is None:
+                self.token_counts = array("q")
+            self.token_counts.append(tokens)
+
+    def _view(self):
+        return ChunkTable(self.text, self.page_starts)
+
+    def chunk(self, chunk_size=1000, overlap=100):
+        """Overlapping windows over the whole buffer."""
+        table = self._view()
+        for start, end in chunk_spans(len(self.text), chunk_size, overlap):
+            table.append(start, end)
+        return table
+
+    def rechunk(self, chunk_size=1000, overlap=100):
+        """Overlapping windows inside each chunk of this table, as a view over the same buffer."""
+        table = self._view()
+        for parent_start, parent_end in zip(self.starts, self.ends):
+            for start, end in chunk_spans(parent_end - parent_start, chunk_size, overlap):
+                table.append(parent_start + start, parent_start + end)
+        return table
+
+    def rechunk_tokens(self, chunker):
+        """Token-budgeted chunks inside each chunk of this table (see `TokenChunker`)."""
+        return chunker.chunk_table(self)
+
+    def span(self, index):
+        return self.starts[index], self.ends[index], self.pages[index]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.text[self.starts[index]:self.ends[index]]
+
+    def __iter__(self):
+        for start, end in zip(self.starts, self.ends):
+            yield self.text[start:end]
+
+
+class StreamingChunker:
+    """
+    Chunk a stream of pages (or text blocks) while it is being read.
+
+    `feed` returns the chunks completed by each new page and `finish` the
+    remaining ones, so chunk N can be processed before the rest of the document
+    has been read. Only the unfinished tail (at most one chunk) is kept in
+    memory; the pages read so far are spooled to a temporary file, and
+    `load_table` reads them back as a `ChunkTable` once finished. Call `close`
+    (or use the chunker as a context manager) to drop the spool early.
+    """
+
+    def __init__(self, chunk_size=1000, overlap=100, separator=" "):
+        self.chunk_size = chunk_size
+        self.step = chunk_size - overlap
+        self.separator = separator
+        self._spool = tempfile.TemporaryFile("w+", encoding="utf-8", newline="")
+        self._page_starts = array("q")
+        self._length = 0
+        self._tail = ""
+        self._tail_start = 0
+        self._starts = array("q")
+        self._ends = array("q")
+        self._finished = False
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def feed(self, page):
+        if self._page_starts:
+            self._length += len(self.separator)
+            self._tail += self.separator
+            self._spool.write(self.separator)
+        self._page_starts.append(self._length)
+        self._spool.write(page)
+        self._length += len(page)
+        self._tail += page
+
+        chunks = []
+        position = 0
+        while len(self._tail) - position >= self.chunk_size:
+            chunks.append(self._emit(position, self.chunk_size))
+            position += self.step
+        self._tail = self._tail[position:]
+        self._tail_start += position
+        return chunks
+
+    def finish(self):
+        chunks = []
+        position = 0
+        while position < len(self._tail):
+            chunks.append(self._emit(position, min(self.chunk_size, len(self._tail) - position)))
+            position += self.step
+        self._tail = ""
+        self._spool.flush()
+        self._finished = True
+        return chunks
+
+    def load_table(self):
+        """The finished document as a `ChunkTable` holding the chunks emitted so far."""
+        if not self._finished:
+            raise RuntimeError("StreamingChunker.load_table called before finish")
+        self._spool.seek(0)
+        table = ChunkTable(self._spool.read(), self._page_starts or array("q", [0]))
+        table.starts.extend(self._starts)
+        table.ends.extend(self._ends)
+        table.pages.extend(table.page_at(start) for start in self._starts)
+        return table
+
+    def close(self):
+        self._spool.close()
+
+    def _emit(self, position, size):
+        start = self._tail_start + position
+        self._starts.append(start)
+        self._ends.append(start + size)
+        return self._tail[position:position + size]
+
+
+# Sentence-like spans: up to terminal punctuation followed by whitespace, or up to a blank line.
+_SEGMENT = re.compile(r"""\S.*?(?:[.!?]+["')\]]*(?=\s|$)|(?=\n[^\S\n]*\n)|$)""", re.S)
+_BLANK_LINE = re.compile(r"\n[^\S\n]*\n")
+_WORD = re.compile(r"\S+")
+_HEURISTIC_PIECE = re.compile(r"\w+|[^\w\s]")
+# Approximation of the cl100k pre-tokenizer using only the `re` module.
+_BPE_PIECE = re.compile(
+    r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\w]?[^\W\d_]+|\d{1,3}| ?(?:[^\s\w]|_)+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+
+
+class HeuristicTokenCounter:
+    """Offline token estimate: one token per punctuation mark and per ~4 characters of a word."""
+
+    def __init__(self, chars_per_token=4):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text):
+        step = self.chars_per_token
+        return sum(
+            (len(piece) + step - 1) // step for piece in _HEURISTIC_PIECE.findall(text)
+        )
+
+
+class BPETokenCounter:
+    """
+    Exact-enough token counts from a byte-pair-encoding vocabulary, in pure Python.
+    Counts of repeated pre-tokens (words) are cached.
+    """
+
+    def __init__(self, ranks, cache_size=1 << 16):
+        self.ranks = ranks
+        self._piece_count = lru_cache(maxsize=cache_size)(self._bpe_count)
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a tiktoken-format vocabulary file."""
+        ranks = {}
+        with open(path, "rb") as handle:
+            for line in handle:
+                if line.strip():
+                    token, rank = line.split()
+                    ranks[base64.b64decode(token)] = int(rank)
+        return cls(ranks)
+
+    def _bpe_count(self, piece):
+        if piece in self.ranks:
+            return 1
+        parts = [piece[i:i + 1] for i in range(len(piece))]
+        while len(parts) > 1:
+            best, best_rank = None, None
+            for i in range(len(parts) - 1):
+                rank = self.ranks.get(parts[i] + parts[i + 1])
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best, best_rank = i, rank
+            if best is None:
+                break
+            parts[best:best + 2] = [parts[best] + parts[best + 1]]
+        return len(parts)
+
+    def count(self, text):
+        return sum(self._piece_count(piece.encode("utf-8")) for piece in _BPE_PIECE.findall(text))
+
+
+_token_counter = None
+
+
+def get_token_counter():
+    """The process-wide counter: BPE when `TOKENIZER_FILE` points to a vocabulary, else the heuristic."""
+    global _token_counter
+    if _token_counter is None:
+        if TOKENIZER_FILE and os.path.exists(TOKENIZER_FILE):
+            _token_counter = BPETokenCounter.from_file(TOKENIZER_FILE)
+        else:
+            _token_counter = HeuristicTokenCounter()
+    return _token_counter
+
+
+class TokenChunker:
+    """
+    Pack text into chunks of at most `max_tokens` tokens.
+
+    Text is cut into sentence-like segments (split further into words only when a
+    sentence alone exceeds the budget), and whole segments are packed greedily.
+    A chunk is closed early at a paragraph break once it is at least half full,
+    and the next chunk repeats up to `overlap_tokens` tokens of trailing segments.
+    Every chunk records its token count: the sum of its segments' counts. With
+    the heuristic counter that is exact; with BPE it can differ by a token or
+    two from counting the chunk text as a whole.
+    """
+
+    def __init__(self, max_tokens=256, overlap_tokens=32, counter=None):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_fill_tokens = max_tokens // 2
+        self.counter = counter or get_token_counter()
+
+    def _segments(self, text, pos=0, endpos=None):
+        """Yield (start, end, tokens, starts_paragraph) for the segments of text[pos:endpos]."""
+        endpos = len(text) if endpos is None else endpos
+        prev_end = pos
+        for match in _SEGMENT.finditer(text, pos, endpos):
+            start, end = match.span()
+            paragraph = prev_end == pos or _BLANK_LINE.search(text, prev_end, start) is not None
+            tokens = self.counter.count(match.group())
+            if tokens <= self.max_tokens:
+                yield start, end, tokens, paragraph
+            else:
+                yield from self._split_long(text, start, end, paragraph)
+            prev_end = end
+
+    def _split_long(self, text, start, end, paragraph):
+        for match in _WORD.finditer(text, start, end):
+            word_start, word_end = match.span()
+            tokens = self.counter.count(match.group())
+            while tokens > self.max_tokens:
+                # Cut an over-long word at a character length that fits the budget.
+                size = max(1, (word_end - word_start) * self.max_tokens // tokens)
+                piece_tokens = self.counter.count(text[word_start:word_start + size])
+                while piece_tokens > self.max_tokens and size > 1:
+                    size //= 2
+                    piece_tokens = self.counter.count(text[word_start:word_start + size])
+                yield word_start, word_start + size, piece_tokens, paragraph
+                paragraph = False
+                word_start += size
+                tokens = self.counter.count(text[word_start:word_end])
+            if word_start < word_end:
+                yield word_start, word_end, tokens, paragraph
+                paragraph = False
+
+    def _pack(self, segments):
+        """Greedily pack segments; yield (start, end, tokens) per chunk."""
+        window = deque()
+        total = 0
+        fresh = False  # Window holds segments not emitted yet.
+        for segment in segments:
+            start, end, tokens, paragraph = segment
+            if window and (
+                total + tokens > self.max_tokens
+                or (paragraph and fresh and total >= self.min_fill_tokens)
+            ):
+                if fresh:
+                    yield window[0][0], window[-1][1], total
+                    fresh = False
+                while window and (total > self.overlap_tokens or total + tokens > self.max_tokens):
+                    total -= window.popleft()[2]
+            window.append(segment)
+            total += tokens
+            fresh = True
+        if fresh:
+            yield window[0][0], window[-1][1], total
+
+    def chunk(self, text):
+        """Chunk one text into a `ChunkTable` with token counts."""
+        return self.chunk_pages([text])
+
+    def chunk_pages(self, pages, separator=" "):
+        """Chunk pages joined by `separator`, keeping page numbers."""
+        table = ChunkTable.from_pages(pages, separator)
+        for start, end, tokens in self._pack(self._segments(table.text)):
+            table.append(start, end, tokens)
+        return table
+
+    def chunk_table(self, table):
+        """Token-budgeted chunks inside each chunk of `table`, as a view over the same buffer."""
+        view = table._view()
+        for parent_start, parent_end in zip(table.starts, table.ends):
+            segments = self._segments(table.text, parent_start, parent_end)
+            for start, end, tokens in self._pack(segments):
+                view.append(start, end, tokens)
+        return view
+
+    def iter_blocks(self, blocks):
+        """
+        Chunk a stream of text blocks (each ending at a paragraph or page break).
+        Yields (chunk text, token count) while keeping only the current window of text.
+        """
+        state = {"text": "", "start": 0}
+
+        def segments():
+            offset = 0
+            for block in blocks:
+                state["text"] += block
+                for start, end, tokens, paragraph in self._segments(block):
+                    yield offset + start, offset + end, tokens, paragraph
+                offset += len(block)
+
+        for start, end, tokens in self._pack(segments()):
+            text, base = state["text"], state["start"]
+            yield text[start - base:end - base], tokens
+            # Later chunks never start before this one.
+            state["text"], state["start"] = text[start - base:], start
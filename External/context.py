@@ -0,0 +1,154 @@
+import os
+import re
+
+from External.chunking import get_token_counter
+
+# Prompt tokens the retrieved reference text may take per chat turn.
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", 2000))
+# Passages sharing at least this share of their word 3-grams with a better one are dropped.
+CONTEXT_DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", 0.8))
+# Shortest text repeated at the end of one hit and the start of another for them to be merged.
+MIN_MERGE_OVERLAP_CHARS = 40
+# Longest chunk overlap searched for (chunkers here overlap by 100 characters or 25 tokens).
+MAX_MERGE_OVERLAP_CHARS = 1000
+# Do not cut a passage to fit the budget if fewer tokens than this would be left of it.
+MIN_PARTIAL_TOKENS = 64
+
+_WORD = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _shingles(text):
+    words = _WORD.findall(text.lower())
+    return {tuple(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def _overlap(head, tail):
+    """Length of the longest end of `head` that starts `tail` (0 if under the minimum)."""
+    if len(tail) < MIN_MERGE_OVERLAP_CHARS:
+        return 0
+    probe = tail[:MIN_MERGE_OVERLAP_CHARS]
+    window_start = max(0, len(head) - MAX_MERGE_OVERLAP_CHARS)
+    position = head.find(probe, window_start)
+    while position != -1:
+        length = len(head) - position
+        if tail.startswith(head[position:]) and length < len(tail):
+            return length
+        position = head.find(probe, position + 1)
+    return 0
+
+
+class ContextPacker:
+    """
+    Turn retrieved hits into the reference text of a prompt.
+
+    1. Hits from the same source whose text overlaps end-to-start (the
+       overlap left by chunking) are merged into one passage, so the repeated
+       text is sent once; the passage keeps the best score of its parts.
+    2. Passages contained in, or near-duplicates of, a better-scored passage
+       are dropped (word 3-gram containment of `duplicate_similarity`).
+    3. Passages are added best first until `max_tokens`; one that does not
+       fit is skipped for smaller ones, or cut at a sentence end when enough
+       of it still fits.
+
+    `pack` returns the text and a report of the tokens saved at each step.
+    """
+
+    def __init__(
+        self,
+        max_tokens=CONTEXT_MAX_TOKENS,
+        duplicate_similarity=CONTEXT_DUPLICATE_SIMILARITY,
+        separator="\n\n",
+        counter=None,
+    ):
+        self.max_tokens = max_tokens
+        self.duplicate_similarity = duplicate_similarity
+        self.separator = separator
+        self.counter = counter or get_token_counter()
+
+    def merge(self, passages):
+        """Merge end-to-start overlapping passages of the same source."""
+        passages = [list(passage) for passage in passages]
+        merged = True
+        while merged:
+            merged = False
+            for first in passages:
+                for second in passages:
+                    if first is second or first[2] != second[2]:
+                        continue
+                    length = _overlap(first[0], second[0])
+                    if length:
+                        first[0] += second[0][length:]
+                        first[1] = max(first[1], second[1])
+                        passages.remove(second)
+                        merged = True
+                        break
+                if merged:
+                    break
+        return [tuple(passage) for passage in passages]
+
+    def dedupe(self, passages):
+        """Drop passages mostly contained in a better-scored one."""
+        kept = []
+        for passage in sorted(passages, key=lambda passage: passage[1], reverse=True):
+            shingles = _shingles(passage[0])
+            duplicate = any(
+                len(shingles & other) >= self.duplicate_similarity * min(len(shingles), len(other))
+                for _, other in kept
+            )
+            if not duplicate:
+                kept.append((passage, shingles))
+        return [passage for passage, _ in kept]
+
+    def _cut(self, text, budget):
+        """Longest run of whole sentences from the start of `text` within `budget` tokens."""
+        sentences = _SENTENCE_END.split(text)
+        taken, used = [], 0
+        for sentence in sentences:
+            tokens = self.counter.count(sentence)
+            if used + tokens > budget:
+                break
+            taken.append(sentence)
+            used += tokens
+        return " ".join(taken), used
+
+    def pack(self, texts, scores=None, sources=None):
+        """
+        Build the reference text from retrieved chunks.
+
+        Args:
+            texts (list): Chunk texts.
+            scores (list): Their similarity scores (default: rank order).
+            sources (list): Source of each chunk (file or dataset); only
+                chunks of the same source are merged.
+
+        Returns:
+            tuple: (reference text, report dict of token counts)
+        """
+        texts = list(texts)
+        scores = list(scores) if scores is not None else [-rank for rank in range(len(texts))]
+        sources = list(sources) if sources is not None else [None] * len(texts)
+        report = {"hits": len(texts), "tokens_in": sum(self.counter.count(text) for text in texts)}
+
+        passages = self.merge(zip(texts, scores, sources))
+        report["merged"] = len(texts) - len(passages)
+        passages = self.dedupe(passages)
+        report["passages"] = len(passages)
+        report["tokens_deduped"] = sum(self.counter.count(text) for text, _, _ in passages)
+
+        packed, used = [], 0
+        separator_tokens = self.counter.count(self.separator)
+        for text, _, _ in passages:
+            budget = self.max_tokens - used - (separator_tokens if packed else 0)
+            tokens = self.counter.count(text)
+            if tokens <= budget:
+                packed.append(text)
+                used += tokens + (separator_tokens if len(packed) > 1 else 0)
+            elif budget >= MIN_PARTIAL_TOKENS:
+                part, part_tokens = self._cut(text, budget)
+                if part_tokens >= MIN_PARTIAL_TOKENS:
+                    packed.append(part)
+                    used += part_tokens + (separator_tokens if len(packed) > 1 else 0)
+        report["tokens_out"] = used
+        report["packed"] = len(packed)
+        return self.separator.join(packed), report
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter
+
+# One cache for every app in the repository, so Doc_summarize and Chatsupport share hits.
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(_REPO_ROOT, "embedding_cache", "embeddings.sqlite3")
+)
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# After eviction the cache is trimmed to this fraction of `max_bytes`.
+EMBEDDING_CACHE_EVICT_TO = 0.9
+# SQLite limits the number of bound parameters per statement.
+_LOOKUP_BATCH = 500
+
+
+def model_identity(model):
+    """(model name, dimensions) of an embedding model, used as part of the cache key."""
+    name = getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+    dimensions = getattr(model, "dimensions", None) or 0
+    return str(name), int(dimensions)
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache in SQLite, keyed by (model, dimensions, SHA-256 of the text).
+
+    Vectors are stored as float32 blobs. Least recently used rows are evicted
+    once the stored vectors exceed `max_bytes`. `stats` counts hits and misses.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+            )
+        # Running estimate of the stored bytes; recomputed exactly before evicting.
+        self._size = self.size_bytes()
+
+    @staticmethod
+    def key(model: str, dimensions: int, text: str) -> bytes:
+        digest = hashlib.sha256(f"{model}\0{dimensions}\0".encode("utf-8"))
+        digest.update(text.encode("utf-8"))
+        return digest.digest()
+
+    def get_many(self, model: str, dimensions: int, texts) -> list:
+        """Cached vectors for `texts` (None for misses), in order."""
+        keys = [self.key(model, dimensions, text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                with self._connection:
+                    self._connection.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                        [(time.time(), key) for key in found],
+                    )
+        vectors = []
+        for key in keys:
+            blob = found.get(key)
+            if blob is None:
+                vectors.append(None)
+            else:
+                vector = array("f")
+                vector.frombytes(blob)
+                vectors.append(vector.tolist())
+        hits = sum(vector is not None for vector in vectors)
+        self.stats["hits"] += hits
+        self.stats["misses"] += len(vectors) - hits
+        return vectors
+
+    def get(self, model: str, dimensions: int, text: str):
+        return self.get_many(model, dimensions, [text])[0]
+
+    def set_many(self, model: str, dimensions: int, texts, vectors):
+        now = time.time()
+        rows = [
+            (self.key(model, dimensions, text), array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+        self._size += sum(len(row[1]) for row in rows)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def set(self, model: str, dimensions: int, text: str, vector):
+        self.set_many(model, dimensions, [text], [vector])
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            (size,) = self._connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()
+        return size
+
+    def evict(self):
+        """Delete least recently used rows until the cache is below `max_bytes`."""
+        size = self._size = self.size_bytes()
+        if size <= self.max_bytes:
+            return
+        excess = size - int(self.max_bytes * EMBEDDING_CACHE_EVICT_TO)
+        with self._lock, self._connection:
+            rows = self._connection.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used"
+            )
+            stale = []
+            for key, length in rows:
+                if excess <= 0:
+                    break
+                stale.append((key,))
+                excess -= length
+            self._connection.executemany("DELETE FROM embeddings WHERE key = ?", stale)
+        self._size = self.size_bytes()
+        self.stats["evicted"] += len(stale)
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Return the process-wide embedding cache, opening it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
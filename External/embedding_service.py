@@ -0,0 +1,166 @@
+import asyncio
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from External.chunking import get_token_counter
+from External.embedding_cache import get_embedding_cache, model_identity
+
+# Request shaping. The embeddings API accepts up to 2048 inputs and 300k tokens
+# per request; smaller batches keep each request fast and spread the load.
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", 32000))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 512))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 8))
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_API_VERSION = "2024-02-01"
+
+
+def embedding_dimensions():
+    """
+    Output size requested from the embedding model, from EMBEDDING_DIMENSIONS.
+    Unset means the model's full size (1536 for text-embedding-3-small).
+    Read at call time so values loaded from `.env` are seen.
+    """
+    value = os.getenv("EMBEDDING_DIMENSIONS")
+    return int(value) if value else None
+
+
+def create_embedding_model(dimensions=None):
+    """
+    Build the Azure OpenAI embedding model used across the repository.
+
+    text-embedding-3 models can return shortened embeddings: `dimensions`
+    (default: `embedding_dimensions()`) is sent with every request, and the
+    cache key and store widths follow from it.
+    """
+    from aih_rag.embeddings.azure_openai import AzureOpenAIEmbedding
+
+    return AzureOpenAIEmbedding(
+        model=EMBEDDING_MODEL,
+        azure_endpoint=os.getenv("End_point"),
+        api_key=os.getenv("API_Key"),
+        api_version=EMBEDDING_API_VERSION,
+        azure_deployment=EMBEDDING_MODEL,
+        dimensions=dimensions or embedding_dimensions(),
+    )
+
+
+class EmbeddingService:
+    """
+    Embed many texts with few requests.
+
+    Texts are packed in order into batches of at most `max_batch_tokens` tokens
+    and `max_batch_size` inputs, one API request per batch, and up to
+    `max_concurrency` batches are in flight at once. Vectors come back in input
+    order. Token counts already known from chunking (`ChunkTable.token_counts`)
+    can be passed in to skip counting.
+
+    Texts found in the embedding cache are not sent again, and new vectors are
+    added to it.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_batch_tokens=EMBEDDING_BATCH_MAX_TOKENS,
+        max_batch_size=EMBEDDING_BATCH_MAX_SIZE,
+        max_concurrency=EMBEDDING_CONCURRENCY,
+        counter=None,
+        cache=None,
+        use_cache=True,
+    ):
+        self.model = model
+        self.cache = (cache or get_embedding_cache()) if use_cache else None
+        self.model_name, self.dimensions = model_identity(model)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.counter = counter or get_token_counter()
+        self.stats = Counter()
+
+    def plan_batches(self, texts, token_counts=None):
+        """
+        Split texts into consecutive batches.
+
+        Returns:
+            list: (start, end) index ranges into `texts`.
+        """
+        if token_counts is None:
+            token_counts = [self.counter.count(text) for text in texts]
+        batches = []
+        start = 0
+        batch_tokens = 0
+        for index, tokens in enumerate(token_counts):
+            if index > start and (
+                batch_tokens + tokens > self.max_batch_tokens
+                or index - start >= self.max_batch_size
+            ):
+                batches.append((start, index))
+                start, batch_tokens = index, 0
+            batch_tokens += tokens
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        self.stats["texts"] += len(texts)
+        self.stats["tokens"] += sum(token_counts)
+        self.stats["requests"] += len(batches)
+        return batches
+
+    def _lookup(self, texts):
+        """Cached vectors (None where missing) and the indices still to embed."""
+        if self.cache is None:
+            return [None] * len(texts), list(range(len(texts)))
+        vectors = self.cache.get_many(self.model_name, self.dimensions, texts)
+        missing = [index for index, vector in enumerate(vectors) if vector is None]
+        return vectors, missing
+
+    def _store(self, vectors, missing, texts, embedded):
+        for index, vector in zip(missing, embedded):
+            vectors[index] = vector
+        if self.cache is not None and missing:
+            self.cache.set_many(self.model_name, self.dimensions, [texts[i] for i in missing], embedded)
+        return vectors
+
+    async def aembed(self, texts, token_counts=None):
+        """Embed texts from async code; returns one vector per text, in order."""
+        texts = list(texts)
+        vectors, missing = self._lookup(texts)
+        pending = [texts[i] for i in missing]
+        pending_tokens = None if token_counts is None else [token_counts[i] for i in missing]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def embed_batch(start, end):
+            async with semaphore:
+                # One request per batch; the public batch helper would re-split it.
+                return await self.model._aget_text_embeddings(pending[start:end])
+
+        results = await asyncio.gather(
+            *(embed_batch(start, end) for start, end in self.plan_batches(pending, pending_tokens))
+        )
+        return self._store(vectors, missing, texts, [vector for batch in results for vector in batch])
+
+    def embed(self, texts, token_counts=None):
+        """Embed texts from synchronous code, running batches on a thread pool."""
+        texts = list(texts)
+        vectors, missing = self._lookup(texts)
+        pending = [texts[i] for i in missing]
+        pending_tokens = None if token_counts is None else [token_counts[i] for i in missing]
+        batches = self.plan_batches(pending, pending_tokens)
+        embedded = []
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as pool:
+                results = pool.map(
+                    lambda batch: self.model._get_text_embeddings(pending[batch[0]:batch[1]]), batches
+                )
+                embedded = [vector for batch in results for vector in batch]
+        return self._store(vectors, missing, texts, embedded)
+
+    def embed_query(self, query):
+        """Embed one search query, through the cache."""
+        name = f"{self.model_name}/query"
+        vector = self.cache.get(name, self.dimensions, query) if self.cache is not None else None
+        if vector is None:
+            vector = self.model.get_query_embedding(query)
+            if self.cache is not None:
+                self.cache.set(name, self.dimensions, query, vector)
+        return vector
@@ -11,6 +11,7 @@ import base64
 from openai import AzureOpenAI
 from aih_automaton.ai_models.model_base import AIModel
 from rich import print
+from External.image_preprocess import VISION_PREPROCESSOR
 
 load_dotenv()
 
@@ -67,11 +68,45 @@ def read_pdfs_text(pdf_names: List, search_directory=None):
 
 
 
-def create_text_extraction_pipeline(image_path):
+# Used for cropped low-confidence OCR regions: their text replaces the OCR
+# text in place, so it must be a transcription, not a summary.
+REGION_TRANSCRIPTION_INSTRUCTIONS = """You transcribe text from image crops.
+
+Each attached image is one region of a scanned document, in order.
+For each image output a line `=== <n> ===` (n counts from 1), then the text in it exactly as written.
+Do not summarise, explain, translate or correct anything. Leave the section empty when an image has no text.
+"""
+
+
+def _vision_pipeline(file_paths, instructions, prompt_persona):
+    text_extraction_agent = Agent(
+        role='Text extraction agent',
+        prompt_persona=prompt_persona
+    )
+    text_extraction_task = Task(
+        model=AzureOpenAIVisionModel(azure_api_key=azure_api_key,
+                                     engine='gpt-4-turbo-vision',
+                                     azure_api_version=azure_api_version,
+                                     azure_endpoint=azure_endpoint),
+        file_paths=file_paths,
+        output_type=OutputType.EXTRACT,
+        agent=text_extraction_agent,
+        instructions=instructions
+    )
+    return LinearSyncPipeline(
+        tasks=[text_extraction_task],
+        completion_message='\n Text Extracted Successfully\n'
+    )
+
+
+def create_text_extraction_pipeline(image_path, preprocess=True):
     # print('\n Extracting text from image \n')
 
     try: 
         if image_path.endswith('.png') or image_path.endswith('.jpeg') or image_path.endswith('.jpg') or image_path.endswith('.webp') or image_path.endswith('.gif'):
+            if preprocess:
+                # Downscaled copy: smaller base64 payload and fewer image tokens.
+                image_path, _ = VISION_PREPROCESSOR.preprocess(image_path)
             # input("--->")
             system_persona = """You are a expert in understanding Screenshots. You will be Extracting Text from images,
 
@@ -83,24 +118,7 @@ def create_text_extraction_pipeline(image_path):
 
 
             prompt_persona = 'Extract the Text from attached files i.e.'
-            text_extraction_agent = Agent(
-                role='Text extraction agent',
-                prompt_persona=prompt_persona
-                )
-            text_extraction_task = Task(
-                model=AzureOpenAIVisionModel(azure_api_key=azure_api_key,
-                                            engine='gpt-4-turbo-vision',
-                                            azure_api_version=azure_api_version,
-                                            azure_endpoint=azure_endpoint),  
-                file_paths=[image_path],
-                output_type=OutputType.EXTRACT,
-                agent=text_extraction_agent,
-                instructions=system_persona
-            )
-            pipeline = LinearSyncPipeline(
-            tasks = [text_extraction_task],
-            completion_message='\n Text Extracted Successfully\n'
-            )
+            pipeline = _vision_pipeline([image_path], system_persona, prompt_persona)
         else:
             raise "Image not given in proper format: We only support [.png, .jpeg, .jpg, .webp, .gif]"
     except Exception as e:
@@ -109,3 +127,8 @@ def create_text_extraction_pipeline(image_path):
     return pipeline
 
 
+def create_region_transcription_pipeline(image_paths):
+    """One vision request transcribing several region crops (see REGION_TRANSCRIPTION_INSTRUCTIONS)."""
+    return _vision_pipeline(
+        list(image_paths), REGION_TRANSCRIPTION_INSTRUCTIONS, 'Transcribe the text of each attached image i.e.'
+    )
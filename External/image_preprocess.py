@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+from collections import Counter
+import numpy as np
+from PIL import Image, ImageOps
+
+# Pre-processed copies are cached here, keyed by content hash and settings,
+# so upload and sample directories are left as they are. One cache at the
+# repository root, whichever directory an app is started from.
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PREPROCESS_CACHE_DIR = os.getenv(
+    "PREPROCESS_CACHE_DIR", os.path.join(_REPO_ROOT, "preprocess_cache")
+)
+PREPROCESS_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# JPEG quality for colour output (photos compress far better than as PNG).
+JPEG_QUALITY = 85
+
+# Running totals across all images pre-processed in this process.
+PREPROCESS_STATS = Counter()
+
+
+def record_preprocess_stats(stats: dict) -> None:
+    """Add one image's `preprocess` stats to PREPROCESS_STATS."""
+    PREPROCESS_STATS.update({key: stats[key] for key in ("bytes_saved", "pixels_saved")})
+    PREPROCESS_STATS["images"] += 1
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ImagePreprocessor:
+    """
+    Shrink and clean up images before they are sent to OCR or the vision model.
+
+    Steps (each optional): resize to a target DPI or maximum long edge, convert
+    to grayscale, deskew and binarize. The result is cached in `cache_dir` as
+    `<content hash>-<settings hash>.png` (`.jpg` for colour output) and reused
+    for any file with the same bytes. Least recently used entries are evicted
+    once the cache grows beyond `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        max_long_edge: int = 2000,
+        target_dpi: int = None,
+        grayscale: bool = True,
+        deskew: bool = False,
+        binarize: bool = False,
+        max_skew_angle: float = 5.0,
+        skew_angle_step: float = 0.5,
+        cache_dir: str = PREPROCESS_CACHE_DIR,
+        max_bytes: int = PREPROCESS_CACHE_MAX_BYTES,
+    ):
+        self.max_long_edge = max_long_edge
+        self.target_dpi = target_dpi
+        self.grayscale = grayscale
+        self.deskew = deskew
+        self.binarize = binarize
+        self.max_skew_angle = max_skew_angle
+        self.skew_angle_step = skew_angle_step
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @property
+    def settings_key(self) -> str:
+        settings = {key: value for key, value in vars(self).items() if key not in ("cache_dir", "max_bytes")}
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:12]
+
+    @property
+    def output_format(self) -> str:
+        """PNG for grayscale or binary output (text scans), JPEG for colour."""
+        return "PNG" if self.grayscale or self.binarize else "JPEG"
+
+    def cached_path(self, image_path: str) -> str:
+        extension = ".png" if self.output_format == "PNG" else ".jpg"
+        return os.path.join(self.cache_dir, f"{_file_hash(image_path)}-{self.settings_key}{extension}")
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def _scale(self, image: Image.Image) -> float:
+        scale = 1.0
+        dpi = image.info.get("dpi")
+        if self.target_dpi and dpi and dpi[0]:
+            scale = min(scale, self.target_dpi / float(dpi[0]))
+        if self.max_long_edge:
+            scale = min(scale, self.max_long_edge / float(max(image.size)))
+        return scale
+
+    def _skew_angle(self, image: Image.Image) -> float:
+        """Find the rotation that maximises the variance of row ink sums (projection profile)."""
+        sample = ImageOps.grayscale(image)
+        sample.thumbnail((800, 800))
+        ink = Image.fromarray((np.asarray(sample) < 128).astype(np.uint8) * 255)
+        best_angle, best_score = 0.0, -1.0
+        for angle in np.arange(-self.max_skew_angle, self.max_skew_angle + 1e-9, self.skew_angle_step):
+            rows = np.asarray(ink.rotate(float(angle), expand=True), dtype=np.float32).sum(axis=1)
+            score = float(np.var(rows))
+            if score > best_score:
+                best_angle, best_score = float(angle), score
+        return best_angle
+
+    @staticmethod
+    def _otsu_threshold(pixels: np.ndarray) -> int:
+        histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+        weights = np.cumsum(histogram)
+        means = np.cumsum(histogram * np.arange(256))
+        total_weight, total_mean = weights[-1], means[-1]
+        background = weights
+        foreground = total_weight - weights
+        with np.errstate(divide="ignore", invalid="ignore"):
+            between = (total_mean * background - means * total_weight) ** 2 / (background * foreground)
+        return int(np.nanargmax(between))
+
+    def process_image(self, image: Image.Image) -> Image.Image:
+        """Apply the configured steps to an in-memory image."""
+        image = ImageOps.exif_transpose(image)
+        scale = self._scale(image)
+        if scale < 1.0:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.LANCZOS)
+        if self.grayscale or self.binarize:
+            image = ImageOps.grayscale(image)
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        if self.deskew:
+            angle = self._skew_angle(image)
+            if angle:
+                fill = 255 if image.mode == "L" else (255, 255, 255)
+                image = image.rotate(angle, expand=True, resample=Image.BICUBIC, fillcolor=fill)
+        if self.binarize:
+            pixels = np.asarray(image)
+            image = Image.fromarray(((pixels > self._otsu_threshold(pixels)) * 255).astype(np.uint8))
+        return image
+
+    def preprocess(self, image_path: str, record: bool = True):
+        """
+        Pre-process an image file, reusing the cached result when it is up to date.
+        With `record=False` the stats are returned but not added to
+        PREPROCESS_STATS: OCR workers send them back for the caller to record.
+
+        Returns:
+            tuple: (path of the pre-processed image, dict of bytes and pixels saved)
+        """
+        output_path = self.cached_path(image_path)
+        if os.path.exists(output_path):
+            os.utime(output_path)  # Mark the entry as recently used.
+        else:
+            with Image.open(image_path) as image:
+                processed = self.process_image(image)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = f"{output_path}.{os.getpid()}.tmp"
+            if self.output_format == "PNG":
+                processed.save(temp_path, format="PNG", optimize=True)
+            else:
+                processed.convert("RGB").save(temp_path, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+            os.replace(temp_path, output_path)
+            self.evict()
+
+        with Image.open(image_path) as original, Image.open(output_path) as processed:
+            original_pixels = original.width * original.height
+            output_pixels = processed.width * processed.height
+        original_bytes = os.path.getsize(image_path)
+        output_bytes = os.path.getsize(output_path)
+        stats = {
+            "original_bytes": original_bytes,
+            "output_bytes": output_bytes,
+            "bytes_saved": original_bytes - output_bytes,
+            "original_pixels": original_pixels,
+            "output_pixels": output_pixels,
+            "pixels_saved": original_pixels - output_pixels,
+        }
+        if record:
+            record_preprocess_stats(stats)
+        return output_path, stats
+
+
+# Tesseract works best on large grayscale text; it binarizes internally.
+OCR_PREPROCESSOR = ImagePreprocessor(max_long_edge=3000, target_dpi=300, grayscale=True, deskew=True)
+# The vision model downsamples large images anyway, so send it a smaller color image.
+VISION_PREPROCESSOR = ImagePreprocessor(max_long_edge=1536, grayscale=False)
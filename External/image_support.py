@@ -1,10 +1,152 @@
+import os
+import re
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from External.image import create_region_transcription_pipeline, create_text_extraction_pipeline
+from External.extract_text import FileTextExtractor
+from External.image_preprocess import OCR_PREPROCESSOR
 
-from External.image import create_text_extraction_pipeline
+# OCR blocks with a mean word confidence below this are escalated to the vision model.
+OCR_CONFIDENCE_THRESHOLD = float(os.getenv("OCR_CONFIDENCE_THRESHOLD", 60))
+# Above this share of low-confidence blocks, the whole image is sent in one vision call.
+WHOLE_IMAGE_ESCALATION_RATIO = 0.5
+# Above this many low-confidence blocks, the whole image is sent instead of the crops.
+MAX_VISION_REGIONS = int(os.getenv("MAX_VISION_REGIONS", 8))
+# Images whose escalation to the vision model runs at once in a batch.
+VISION_CONCURRENCY = int(os.getenv("VISION_CONCURRENCY", 4))
+# Padding in pixels around a low-confidence block when it is cropped for the vision model.
+REGION_PADDING = 10
 
-def extract_image_text(image_path):
-    image_pipeline = create_text_extraction_pipeline(image_path)
+# Number of images handled by each tier: "ocr", "ocr+vision" (regions) and "vision".
+TIER_COUNTS = Counter()
+_tier_lock = threading.Lock()
+_REGION_HEADER = re.compile(r"^=== *(\d+) *===[ \t]*$", re.MULTILINE)
+
+ocr_extractor = FileTextExtractor(use_cache=False)
+
+
+def extract_image_text_vision(image_path, preprocess=True):
+    image_pipeline = create_text_extraction_pipeline(image_path, preprocess=preprocess)
     image_output = image_pipeline.run()
     image_context = image_output[0]['task_output']
     image_context = image_context.choices[0].message.content
 
     return image_context
+
+
+def _split_regions(reply, count):
+    """Texts of the `=== n ===` sections of a region transcription; None for missing ones."""
+    texts = [None] * count
+    headers = list(_REGION_HEADER.finditer(reply))
+    for header, following in zip(headers, headers[1:] + [None]):
+        index = int(header.group(1)) - 1
+        if 0 <= index < count:
+            texts[index] = reply[header.end():following.start() if following else len(reply)].strip()
+    return texts
+
+
+def _extract_regions_text_vision(image, boxes):
+    """
+    Crop regions of the image and transcribe all of them in one vision request.
+
+    Returns:
+        list: text per box, None where the reply had no section for it.
+    """
+    region_paths = []
+    try:
+        for left, top, right, bottom in boxes:
+            region = image.crop((
+                max(0, left - REGION_PADDING),
+                max(0, top - REGION_PADDING),
+                min(image.width, right + REGION_PADDING),
+                min(image.height, bottom + REGION_PADDING),
+            ))
+            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as region_file:
+                region_paths.append(region_file.name)
+            region.save(region_paths[-1])
+        output = create_region_transcription_pipeline(region_paths).run()
+        reply = output[0]['task_output'].choices[0].message.content
+        return _split_regions(reply, len(boxes))
+    finally:
+        for region_path in region_paths:
+            os.remove(region_path)
+
+
+def _resolve_tiers(image_path, prepared_path, blocks, confidence_threshold):
+    """
+    Escalate the low-confidence parts of an OCR result to the vision model.
+    Block boxes refer to `prepared_path`, the pre-processed image that was OCR'd.
+    """
+    low_confidence = [block for block in blocks if block["confidence"] < confidence_threshold]
+    mean_confidence = (
+        sum(block["confidence"] for block in blocks) / len(blocks) if blocks else 0.0
+    )
+
+    if (
+        not blocks
+        or len(low_confidence) > WHOLE_IMAGE_ESCALATION_RATIO * len(blocks)
+        or len(low_confidence) > MAX_VISION_REGIONS
+    ):
+        tier = "vision"
+        text = extract_image_text_vision(image_path)
+    else:
+        tier = "ocr+vision" if low_confidence else "ocr"
+        if low_confidence:
+            with Image.open(prepared_path) as image:
+                image = image.convert("RGB")
+            transcriptions = _extract_regions_text_vision(image, [block["box"] for block in low_confidence])
+            for block, transcription in zip(low_confidence, transcriptions):
+                # A region the reply skipped keeps its OCR text.
+                if transcription is not None:
+                    block["text"] = transcription
+        text = "\n\n".join(block["text"] for block in blocks)
+
+    with _tier_lock:
+        TIER_COUNTS[tier] += 1
+    return {
+        "text": text,
+        "tier": tier,
+        "confidence": mean_confidence,
+        "escalated_regions": len(blocks) if tier == "vision" else len(low_confidence),
+    }
+
+
+def extract_image_text_tiered(image_path, confidence_threshold=OCR_CONFIDENCE_THRESHOLD):
+    """
+    Extract text from an image with local OCR first and the vision model only
+    where OCR confidence is below `confidence_threshold`.
+
+    Returns:
+        dict: text, the tier that produced it ("ocr", "ocr+vision" or "vision"),
+        the mean OCR confidence and the number of escalated regions.
+    """
+    [(prepared_path, blocks)] = ocr_extractor.ocr_prepared_blocks_batch([image_path], OCR_PREPROCESSOR)
+    return _resolve_tiers(image_path, prepared_path, blocks, confidence_threshold)
+
+
+def extract_images_text_tiered(image_paths, confidence_threshold=OCR_CONFIDENCE_THRESHOLD):
+    """
+    Batch version of `extract_image_text_tiered`. Pre-processing and the OCR
+    pass for all images run in parallel on the OCR worker pool; the vision
+    escalations then run up to `VISION_CONCURRENCY` at a time.
+    """
+    prepared = ocr_extractor.ocr_prepared_blocks_batch(image_paths, OCR_PREPROCESSOR)
+    jobs = [(image_path, prepared_path, blocks) for image_path, (prepared_path, blocks) in zip(image_paths, prepared)]
+    if len(jobs) <= 1:
+        return [_resolve_tiers(*job, confidence_threshold) for job in jobs]
+    with ThreadPoolExecutor(max_workers=min(VISION_CONCURRENCY, len(jobs))) as executor:
+        return list(executor.map(lambda job: _resolve_tiers(*job, confidence_threshold), jobs))
+
+
+def escalation_rate():
+    """Share of images processed so far that needed the vision model."""
+    with _tier_lock:
+        total = sum(TIER_COUNTS.values())
+        return (total - TIER_COUNTS["ocr"]) / total if total else 0.0
+
+
+def extract_image_text(image_path):
+    return extract_image_text_tiered(image_path)["text"]
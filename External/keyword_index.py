@@ -0,0 +1,398 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# BM25 term-frequency saturation and document-length normalisation.
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+# Queries of at most this many terms containing an identifier (a digit, a
+# hyphenated or dotted code, or a quoted phrase) are treated as lookups.
+KEYWORD_QUERY_MAX_TERMS = int(os.getenv("KEYWORD_QUERY_MAX_TERMS", 6))
+# Never compact the change log before it holds this many chunks.
+KEYWORD_LOG_MIN_COMPACT = 1000
+
+# Words, keeping codes such as "INV-2024-0042" or "v1.2" whole.
+_TOKEN = re.compile(r"\w+(?:[-./:]\w+)*")
+_WORD = re.compile(r"\w+")
+_IDENTIFIER = re.compile(r"\d|\w[-./:]\w")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what when "
+    "where which who why will with how do does did can i you we they he she me my our your".split()
+)
+
+
+def tokenize(text) -> list:
+    """Lower-cased terms of `text`: words, plus whole codes alongside their parts."""
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        parts = _WORD.findall(token)
+        if len(parts) > 1:
+            terms.append(token)
+        terms.extend(part for part in parts if part not in _STOPWORDS)
+    return terms
+
+
+def is_keyword_query(query) -> bool:
+    """Whether `query` looks like an exact lookup (an invoice number, a clause title in quotes)."""
+    if '"' in query:
+        return True
+    words = [word for word in _TOKEN.findall(query.lower()) if word not in _STOPWORDS]
+    return 0 < len(words) <= KEYWORD_QUERY_MAX_TERMS and any(_IDENTIFIER.search(word) for word in words)
+
+
+def keyword_index_paths(dataset_path):
+    """Snapshot and change-log paths; kept beside the dataset, like the ingest manifest."""
+    base = os.path.normpath(dataset_path)
+    return base + ".keywords.npz", base + ".keywords.log"
+
+
+def keyword_index_version(dataset_path):
+    """Change marker for a keyword index: snapshot mtime, log mtime and size."""
+    version = []
+    for path in keyword_index_paths(dataset_path):
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+
+def _pack_strings(strings):
+    """One UTF-8 buffer plus offsets for a list of strings, so snapshots need no pickling."""
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(buffer, offsets):
+    return [buffer[start:end].decode("utf-8") for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+class KeywordIndex:
+    """
+    BM25 inverted index over the chunks of one vector store.
+
+    It lives beside the dataset as a snapshot (`.keywords.npz`: node ids,
+    texts, per-chunk lengths and the postings in CSR form, i.e. for every term
+    a slice of row ids and term frequencies) plus an append-only change log, so
+    an ingest that adds or deletes a few chunks appends only those. Loading a
+    snapshot reads its arrays as they are: only chunks in the log are
+    tokenized, and their postings are built on the first search. The log is
+    folded into a new snapshot once it holds as many chunks as the index.
+    Nothing is read until the index is first used.
+
+    Writers call `add` / `remove` alongside the store and then `save`;
+    readers should share an instance through `get_keyword_registry()`.
+    """
+
+    def __init__(self, dataset_path, k1=BM25_K1, b=BM25_B):
+        self.snapshot_path, self.log_path = keyword_index_paths(dataset_path)
+        self.k1 = k1
+        self.b = b
+        self._pending = []
+        self._logged = 0
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._rows)
+
+    def exists(self) -> bool:
+        return any(os.path.exists(path) for path in (self.snapshot_path, self.log_path))
+
+    def _reset(self):
+        # Snapshot rows (read-only arrays; deletions only clear `_alive`).
+        self._base_ids = []
+        self._text_buffer, self._text_offsets = b"", np.zeros(1, dtype=np.int64)
+        self._term_buffer, self._term_offsets = b"", np.zeros(1, dtype=np.int64)
+        self._vocabulary = None
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._posting_rows = np.empty(0, dtype=np.int32)
+        self._posting_frequencies = np.empty(0, dtype=np.float32)
+        self._base_lengths = np.empty(0, dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        # Rows added since the snapshot, numbered after its rows.
+        self._ids, self._texts, self._terms = [], [], []
+        self._rows = {}
+        self._postings = None
+        self._logged = 0
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._reset()
+            if os.path.exists(self.snapshot_path):
+                self._load_snapshot()
+            if os.path.exists(self.log_path):
+                with open(self.log_path, "r", encoding="utf-8") as file:
+                    for line in file:
+                        try:
+                            change = json.loads(line)
+                        except ValueError:
+                            # A write cut short by a crash; what follows it was never saved.
+                            break
+                        if "add" in change:
+                            self._add(*zip(*change["add"]) if change["add"] else ([], []))
+                            self._logged += len(change["add"])
+                        else:
+                            self._remove(change["remove"])
+                            self._logged += len(change["remove"])
+            self._loaded = True
+
+    def _load_snapshot(self):
+        with np.load(self.snapshot_path) as data:
+            self._base_ids = _unpack_strings(data["id_buffer"].tobytes(), data["id_offsets"])
+            self._text_buffer, self._text_offsets = data["text_buffer"].tobytes(), data["text_offsets"]
+            self._term_buffer, self._term_offsets = data["term_buffer"].tobytes(), data["term_offsets"]
+            self._indptr = data["indptr"]
+            self._posting_rows = data["posting_rows"]
+            self._posting_frequencies = data["posting_frequencies"]
+            self._base_lengths = data["lengths"]
+        self._alive = np.ones(len(self._base_ids), dtype=bool)
+        self._rows = {node_id: row for row, node_id in enumerate(self._base_ids)}
+
+    def _terms_index(self):
+        """Term -> CSR slot of the snapshot, decoded on first use."""
+        if self._vocabulary is None:
+            terms = _unpack_strings(self._term_buffer, self._term_offsets)
+            self._vocabulary = {term: slot for slot, term in enumerate(terms)}
+        return self._vocabulary
+
+    def _text(self, row):
+        base = len(self._base_ids)
+        if row >= base:
+            return self._texts[row - base]
+        return self._text_buffer[self._text_offsets[row]:self._text_offsets[row + 1]].decode("utf-8")
+
+    def _node_id(self, row):
+        base = len(self._base_ids)
+        return self._ids[row - base] if row >= base else self._base_ids[row]
+
+    def _add(self, node_ids, texts):
+        base = len(self._base_ids)
+        for node_id, text in zip(node_ids, texts):
+            row = self._rows.get(node_id)
+            if row is not None and row < base:
+                # A snapshot row is replaced by a new row.
+                self._alive[row] = False
+                row = None
+            if row is None:
+                self._rows[node_id] = base + len(self._ids)
+                self._ids.append(node_id)
+                self._texts.append(text)
+                self._terms.append(Counter(tokenize(text)))
+            else:
+                self._texts[row - base] = text
+                self._terms[row - base] = Counter(tokenize(text))
+        self._postings = None
+
+    def _remove(self, node_ids):
+        base = len(self._base_ids)
+        for node_id in node_ids:
+            row = self._rows.pop(node_id, None)
+            if row is None:
+                continue
+            if row < base:
+                self._alive[row] = False
+                continue
+            # Move the last added row into the gap.
+            index, last = row - base, len(self._ids) - 1
+            if index != last:
+                self._ids[index], self._texts[index], self._terms[index] = (
+                    self._ids[last], self._texts[last], self._terms[last]
+                )
+                self._rows[self._ids[index]] = row
+            self._ids.pop()
+            self._texts.pop()
+            self._terms.pop()
+        self._postings = None
+
+    def add(self, node_ids, texts):
+        """Index chunks (replacing those with the same node id)."""
+        pairs = [[node_id, text] for node_id, text in zip(node_ids, texts)]
+        if pairs:
+            with self._lock:
+                self._ensure_loaded()
+                self._add(*zip(*pairs))
+                self._pending.append({"add": pairs})
+
+    def remove(self, node_ids):
+        node_ids = list(node_ids)
+        if not node_ids:
+            return
+        with self._lock:
+            self._ensure_loaded()
+            node_ids = [node_id for node_id in node_ids if node_id in self._rows]
+            if node_ids:
+                self._remove(node_ids)
+                self._pending.append({"remove": node_ids})
+
+    def clear(self):
+        """Empty the index (for a store opened with overwrite)."""
+        with self._lock:
+            self._reset()
+            self._loaded = True
+            self._pending = []
+            self.compact()
+
+    def save(self):
+        """Append pending changes to the log, compacting it once it is as large as the index."""
+        with self._lock:
+            if not self._pending:
+                return
+            with open(self.log_path, "a", encoding="utf-8") as file:
+                for change in self._pending:
+                    file.write(json.dumps(change, ensure_ascii=False) + "\n")
+                    self._logged += len(change.get("add", change.get("remove", [])))
+            self._pending = []
+            if self._logged >= max(KEYWORD_LOG_MIN_COMPACT, len(self._rows)):
+                self.compact()
+
+    def _snapshot_arrays(self):
+        """The live rows (snapshot rows not deleted, then added rows) as snapshot arrays."""
+        terms = _unpack_strings(self._term_buffer, self._term_offsets)
+        slots = dict(self._terms_index())
+        alive = self._alive
+        kept_rows = np.flatnonzero(alive)
+
+        # Snapshot postings of live rows, renumbered; then the added rows' postings.
+        posting_terms = np.repeat(np.arange(len(terms), dtype=np.int64), np.diff(self._indptr))
+        keep = alive[self._posting_rows]
+        renumbered = np.cumsum(alive) - 1
+        added_terms, added_rows, added_frequencies = [], [], []
+        for index, counter in enumerate(self._terms):
+            for term, frequency in counter.items():
+                slot = slots.get(term)
+                if slot is None:
+                    slot = slots[term] = len(terms)
+                    terms.append(term)
+                added_terms.append(slot)
+                added_rows.append(len(kept_rows) + index)
+                added_frequencies.append(frequency)
+        posting_terms = np.concatenate([posting_terms[keep], np.asarray(added_terms, dtype=np.int64)])
+        rows = np.concatenate([renumbered[self._posting_rows[keep]], np.asarray(added_rows, dtype=np.int64)])
+        frequencies = np.concatenate(
+            [self._posting_frequencies[keep], np.asarray(added_frequencies, dtype=np.float32)]
+        )
+
+        # Drop terms left without postings, then group postings by term.
+        used = np.unique(posting_terms)
+        slot_of = np.full(len(terms), -1, dtype=np.int64)
+        slot_of[used] = np.arange(len(used))
+        posting_terms = slot_of[posting_terms]
+        order = np.lexsort((rows, posting_terms))
+        indptr = np.zeros(len(used) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_terms, minlength=len(used)), out=indptr[1:])
+
+        texts = [self._text_buffer[self._text_offsets[row]:self._text_offsets[row + 1]] for row in kept_rows.tolist()]
+        texts += [text.encode("utf-8") for text in self._texts]
+        text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in texts], out=text_offsets[1:])
+        id_buffer, id_offsets = _pack_strings([self._base_ids[row] for row in kept_rows.tolist()] + self._ids)
+        term_buffer, term_offsets = _pack_strings([terms[slot] for slot in used.tolist()])
+        lengths = np.concatenate(
+            [self._base_lengths[alive], np.asarray([sum(counter.values()) for counter in self._terms], dtype=np.float32)]
+        )
+        return {
+            "id_buffer": id_buffer,
+            "id_offsets": id_offsets,
+            "text_buffer": np.frombuffer(b"".join(texts), dtype=np.uint8),
+            "text_offsets": text_offsets,
+            "term_buffer": term_buffer,
+            "term_offsets": term_offsets,
+            "indptr": indptr,
+            "posting_rows": rows[order].astype(np.int32),
+            "posting_frequencies": frequencies[order].astype(np.float32),
+            "lengths": lengths.astype(np.float32),
+        }
+
+    def compact(self):
+        """Write a fresh snapshot and drop the log."""
+        with self._lock:
+            self._ensure_loaded()
+            directory = os.path.dirname(self.snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temporary = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as file:
+                np.savez(file, **self._snapshot_arrays())
+            os.replace(temporary, self.snapshot_path)
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            self._pending = []
+            self._loaded = False
+            self._ensure_loaded()
+
+    def _build(self):
+        """Postings of the rows added since the snapshot, and lengths and liveness of all rows."""
+        base = len(self._base_ids)
+        rows, frequencies = defaultdict(list), defaultdict(list)
+        for index, terms in enumerate(self._terms):
+            for term, frequency in terms.items():
+                rows[term].append(base + index)
+                frequencies[term].append(frequency)
+        self._postings = {
+            term: (np.asarray(rows[term], dtype=np.int64), np.asarray(frequencies[term], dtype=np.float32))
+            for term in rows
+        }
+        added_lengths = np.asarray([sum(terms.values()) for terms in self._terms], dtype=np.float32)
+        self._lengths = np.concatenate([self._base_lengths, added_lengths])
+        self._live = np.concatenate([self._alive, np.ones(len(self._terms), dtype=bool)])
+
+    def search(self, query, top_k=10):
+        """
+        Best chunks for `query` by BM25.
+
+        Returns:
+            list: (node id, text, score) tuples, best first; chunks sharing no
+            term with the query are left out.
+        """
+        terms = set(tokenize(query))
+        if not terms or top_k <= 0:
+            return []
+        with self._lock:
+            self._ensure_loaded()
+            if not self._rows:
+                return []
+            if self._postings is None:
+                self._build()
+            slots = self._terms_index()
+            postings, lengths, live = self._postings, self._lengths, self._live
+            indptr, posting_rows, posting_frequencies = self._indptr, self._posting_rows, self._posting_frequencies
+
+            total = len(self._rows)
+            norms = self.k1 * (1 - self.b + self.b * lengths / max(float(lengths[live].mean()), 1.0))
+            scores = np.zeros(len(lengths), dtype=np.float32)
+            for term in terms:
+                parts = []
+                slot = slots.get(term)
+                if slot is not None:
+                    rows = posting_rows[indptr[slot]:indptr[slot + 1]]
+                    frequencies = posting_frequencies[indptr[slot]:indptr[slot + 1]]
+                    alive = live[rows]
+                    parts.append((rows[alive], frequencies[alive]))
+                if term in postings:
+                    parts.append(postings[term])
+                if not parts:
+                    continue
+                rows = np.concatenate([part[0] for part in parts])
+                frequencies = np.concatenate([part[1] for part in parts])
+                if not len(rows):
+                    continue
+                idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+                scores[rows] += idf * frequencies * (self.k1 + 1) / (frequencies + norms[rows])
+
+            matched = np.flatnonzero(scores > 0)
+            if len(matched) > top_k:
+                matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+            matched = matched[np.argsort(-scores[matched], kind="stable")]
+            return [(self._node_id(row), self._text(row), float(scores[row])) for row in matched.tolist()]
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import uuid
+from collections import Counter
+
+# Read files in blocks of this size when hashing them.
+_HASH_BLOCK = 1024 * 1024
+
+
+def file_hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(_HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(text) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def manifest_path(dataset_path) -> str:
+    # Kept beside the dataset, not in it: DeepLake owns its directory.
+    return os.path.normpath(dataset_path) + ".manifest.json"
+
+
+def update_manifest_config(dataset_path, **changes) -> bool:
+    """
+    Change entries of the config a dataset's manifest was saved under, for
+    tools that convert the stored vectors in place (`External.quantize_store`),
+    so the next ingest does not rebuild the dataset. Returns False if the
+    dataset has no manifest (or one without a config).
+    """
+    path = manifest_path(dataset_path)
+    if not os.path.exists(path):
+        return False
+    with open(path, "r", encoding="utf-8") as file:
+        saved = json.load(file)
+    if saved.get("config") is None:
+        return False
+    saved["config"].update(changes)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(saved, file)
+    os.replace(temp_path, path)
+    return True
+
+
+class IngestManifest:
+    """
+    Record of what a vector store holds: for every source file, its SHA-256
+    and the (chunk hash, node id) of each chunk stored from it.
+
+    Re-ingesting a workspace then costs only what changed:
+        - `pending` skips files whose hash is unchanged, before they are read;
+        - `diff_chunks` (or `chunk_diff`, batch by batch) keeps the nodes of
+          chunks a changed file still has and lists only the new chunks for
+          embedding;
+        - `remove_missing` returns the nodes of files no longer in the workspace.
+
+    The caller deletes and adds nodes in the store, then calls `record` and
+    `save`, so a failed file leaves the manifest as it was. `stats` counts
+    files and chunks skipped, embedded and deleted.
+
+    `config` is a JSON-able description of how chunks are cut and embedded
+    (chunk sizes, embedding model and dimensions). A manifest saved under a
+    different config describes nodes that cannot be reused: it is loaded
+    empty, `config_changed` is set, and `exists()` is False, so callers
+    rebuild the dataset.
+    """
+
+    def __init__(self, dataset_path, config=None):
+        self.path = manifest_path(dataset_path)
+        self.config = config
+        self.files = {}
+        self.config_changed = False
+        self.stats = Counter()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as file:
+                saved = json.load(file)
+            if config is not None and saved["config"] != config:
+                self.config_changed = True
+                self.stats["config_changed"] += 1
+            else:
+                self.files = saved["files"]
+
+    @staticmethod
+    def source(path) -> str:
+        return os.path.abspath(path)
+
+    def exists(self) -> bool:
+        """Whether a manifest for the current config is on disk."""
+        return os.path.exists(self.path) and not self.config_changed
+
+    def pending(self, file_paths):
+        """
+        New or changed files, as (path, file hash) pairs, each file once.
+        """
+        seen = set()
+        pending = []
+        for path in file_paths:
+            source = self.source(path)
+            if source in seen:
+                continue
+            seen.add(source)
+            digest = file_hash(path)
+            if self.files.get(source, {}).get("hash") == digest:
+                self.stats["files_unchanged"] += 1
+            else:
+                pending.append((path, digest))
+        return pending
+
+    def remove_missing(self, file_paths):
+        """Forget the files not in `file_paths`; returns their node ids."""
+        keep = {self.source(path) for path in file_paths}
+        stale = []
+        for source in [source for source in self.files if source not in keep]:
+            stale.extend(node_id for _, node_id in self.files.pop(source)["chunks"])
+            self.stats["files_removed"] += 1
+        self.stats["chunks_deleted"] += len(stale)
+        return stale
+
+    def diff_chunks(self, path, chunks):
+        """
+        Compare a new or changed file's chunks with what is stored for it.
+
+        Returns:
+            tuple: (manifest entries for `record`, indices of the chunks to
+            embed, node ids for those chunks, stale node ids to delete)
+        """
+        diff = self.chunk_diff(path)
+        new_indices, new_ids = diff.add(chunks)
+        stale = diff.finish()
+        return diff.entries, new_indices, new_ids, stale
+
+    def chunk_diff(self, path):
+        """`diff_chunks` for a file whose chunks arrive in batches (see `ChunkDiff`)."""
+        return ChunkDiff(self, path)
+
+    def record(self, path, digest, entries):
+        self.files[self.source(path)] = {"hash": digest, "chunks": entries}
+        self.stats["files_ingested"] += 1
+
+    def save(self):
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({"config": self.config, "files": self.files}, file)
+        os.replace(temp_path, self.path)
+        self.config_changed = False
+
+
+class ChunkDiff:
+    """
+    `IngestManifest.diff_chunks` one batch of chunks at a time, so a large
+    file never has to be chunked whole. Call `add` for each batch in order,
+    then `finish` once for the stale node ids; `entries` is then complete.
+    """
+
+    def __init__(self, manifest, path):
+        self.manifest = manifest
+        self.stored = {}
+        for hash_, node_id in manifest.files.get(manifest.source(path), {}).get("chunks", []):
+            self.stored.setdefault(hash_, []).append(node_id)
+        self.entries = []
+
+    def add(self, chunks):
+        """
+        Returns:
+            tuple: (indices in `chunks` of the chunks to embed, node ids for them)
+        """
+        new_indices, new_ids = [], []
+        for index, chunk in enumerate(chunks):
+            hash_ = chunk_hash(chunk)
+            if self.stored.get(hash_):
+                node_id = self.stored[hash_].pop()
+            else:
+                node_id = str(uuid.uuid4())
+                new_indices.append(index)
+                new_ids.append(node_id)
+            self.entries.append([hash_, node_id])
+        self.manifest.stats["chunks_kept"] += len(chunks) - len(new_indices)
+        self.manifest.stats["chunks_embedded"] += len(new_indices)
+        return new_indices, new_ids
+
+    def finish(self):
+        """Node ids stored for the file whose chunks did not come back."""
+        stale = [node_id for node_ids in self.stored.values() for node_id in node_ids]
+        self.manifest.stats["chunks_deleted"] += len(stale)
+        return stale
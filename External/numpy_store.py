@@ -0,0 +1,487 @@
+import asyncio
+import io
+import json
+import os
+import threading
+import numpy as np
+from External.ann import ANN_MIN_VECTORS, ANN_NPROBE, INDEX_FILE, IVFFlatIndex
+
+EMBEDDINGS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+NODES_FILE = "nodes.jsonl"
+# Committed row count and nodes.jsonl length; written last by every change.
+STATE_FILE = "store.json"
+# Files of a delete, written aside and moved into place once the state commits them.
+_SWAP_SUFFIX = ".swap"
+
+# Storage format of new stores: "float32", "float16" (2x smaller) or "int8" (4x smaller).
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "float32")
+QUANTIZATION_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+# Rows scored per block, to bound the float32 copy of a quantized matrix.
+_SCORE_BLOCK = 16384
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def fit_dimensions(vectors, dimensions):
+    """
+    Shorten normalised vectors to a store's width: keep the first `dimensions`
+    components and re-normalise. text-embedding-3 models are trained so that a
+    prefix of an embedding is itself a valid shorter embedding.
+    """
+    width = np.shape(vectors)[-1]
+    if dimensions is None or width == dimensions:
+        return vectors
+    if width < dimensions:
+        raise ValueError(
+            f"{width}-dimensional embeddings do not fit a {dimensions}-dimensional store; "
+            "shorten the store with `python -m External.quantize_store --dimensions`"
+        )
+    return normalize(np.asarray(vectors)[..., :dimensions])
+
+
+def quantize(vectors, quantization):
+    """
+    Convert unit-length float32 vectors to the storage format.
+
+    int8 rows are scaled to use the full -127..127 range, and the stored scale
+    is chosen so that each dequantized row has unit length again, which makes
+    scores on the int8 vectors cosine similarities without a float32 pass.
+
+    Returns:
+        tuple: (stored array, per-row float32 scales or None)
+    """
+    if quantization == "int8":
+        peaks = np.abs(vectors).max(axis=1) / 127.0
+        peaks[peaks == 0] = 1.0
+        stored = np.round(vectors / peaks[:, None]).astype(np.int8)
+        norms = np.linalg.norm(stored.astype(np.float32), axis=1)
+        scales = np.where(norms > 0, 1.0 / np.maximum(norms, 1e-12), 1.0)
+        return stored, scales.astype(np.float32)
+    return np.asarray(vectors, dtype=QUANTIZATION_DTYPES[quantization]), None
+
+
+def dequantize(stored, scales=None):
+    vectors = np.asarray(stored, dtype=np.float32)
+    if scales is not None:
+        vectors = vectors * np.asarray(scales, dtype=np.float32)[:, None]
+    return vectors
+
+
+def _save_array(path, array):
+    """Write an .npy file aside and swap it in."""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        np.save(file, array)
+    os.replace(temp_path, path)
+
+
+def _append_array(path, array, rows):
+    """
+    Write `array` after the first `rows` rows of the .npy file at `path`.
+
+    The rows are appended in place and the header's shape rewritten (NumPy
+    pads .npy headers so the first axis can grow); rows past `rows` left by an
+    interrupted write are overwritten. The file is rewritten whole only when
+    the new header would not fit.
+    """
+    array = np.ascontiguousarray(array)
+    if not rows or not os.path.exists(path):
+        _save_array(path, array)
+        return
+    with open(path, "r+b") as file:
+        version = np.lib.format.read_magic(file)
+        read_header = (
+            np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        )
+        shape, _, dtype = read_header(file)
+        offset = file.tell()
+        if dtype != array.dtype or tuple(shape[1:]) != array.shape[1:] or shape[0] < rows:
+            raise ValueError(f"{path} does not match the rows appended to it")
+        header = io.BytesIO()
+        write_header = (
+            np.lib.format.write_array_header_1_0 if version == (1, 0) else np.lib.format.write_array_header_2_0
+        )
+        write_header(
+            header,
+            {
+                "descr": np.lib.format.dtype_to_descr(dtype),
+                "fortran_order": False,
+                "shape": (rows + len(array),) + array.shape[1:],
+            },
+        )
+        fits = header.tell() == offset
+        if fits:
+            file.seek(offset + rows * array[:1].nbytes)
+            file.write(array.tobytes())
+            file.truncate()
+            file.seek(0)
+            file.write(header.getvalue())
+    if not fits:
+        _save_array(path, np.concatenate([np.load(path)[:rows], array]))
+
+
+def _write_state(dataset_path, rows, nodes_bytes, swap=None):
+    """Commit a store's row count and nodes.jsonl length (and the files of a pending delete)."""
+    state = {"rows": rows, "nodes_bytes": nodes_bytes}
+    if swap:
+        state["swap"] = swap
+    path = os.path.join(dataset_path, STATE_FILE)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(state, file)
+    os.replace(temp_path, path)
+
+
+class NumpyVectorStore:
+    """
+    Small in-process vector store: the embeddings are one contiguous matrix
+    saved as `embeddings.npy` (opened memory-mapped), and the node ids, texts
+    and metadata are kept line by line in `nodes.jsonl` beside it.
+
+    Vectors are L2-normalised on insert, so a query is one matrix-vector
+    product (cosine similarity) followed by `argpartition` for the top k.
+    Implements the `add` / `async_add` / `query` surface of `DeepLakeVectorStore`.
+
+    `quantization` ("float16" or "int8", with per-row scales in `scales.npy`)
+    stores vectors in 2 or 4 times less space. Queries rank on the quantized
+    vectors themselves (no float32 copy is kept); int8 scales restore each
+    row's unit norm, so the loss is the rounding of the components only, which
+    `External.quantize_store --check` measures as recall@10. An existing store
+    keeps the format it was created with.
+
+    The width of the stored vectors is the store's embedding size, set by the
+    first insert. Longer embeddings (inserted or queried) are cut to that width
+    and re-normalised, so a store shortened with `External.quantize_store
+    --dimensions` keeps working with a full-size model; shorter ones are refused.
+
+    With `ann=True` the store builds an IVF-flat index (`ivf_index.npz`) once
+    it holds `ANN_MIN_VECTORS` vectors and answers queries from it; `nprobe`
+    trades recall for latency. An existing index is always used when present.
+    Training (and retraining after the store has grown) runs on a background
+    thread, so `add` only assigns the new rows to lists; until an index is
+    ready, queries fall back to exact search.
+
+    Writes are crash-safe: `add` appends to the files in place and `delete_nodes`
+    writes new ones aside (`*.swap`). Either way `store.json`, written last,
+    commits the row count and the length of `nodes.jsonl`, so a reader never
+    sees half a change, and `_load` refuses files shorter than what was
+    committed instead of guessing.
+
+    Queries take the rows, vectors and index together under the writers' lock
+    and score without it, so they can run while another thread writes.
+    """
+
+    stores_text = True
+
+    def __init__(
+        self,
+        dataset_path,
+        overwrite=False,
+        ann=False,
+        nprobe=ANN_NPROBE,
+        quantization=VECTOR_QUANTIZATION,
+        **kwargs,
+    ):
+        if quantization not in QUANTIZATION_DTYPES:
+            raise ValueError(f"Unknown vector quantization: {quantization}")
+        self.dataset_path = dataset_path
+        self.embeddings_path = os.path.join(dataset_path, EMBEDDINGS_FILE)
+        self.scales_path = os.path.join(dataset_path, SCALES_FILE)
+        self.nodes_path = os.path.join(dataset_path, NODES_FILE)
+        self.index_path = os.path.join(dataset_path, INDEX_FILE)
+        self.state_path = os.path.join(dataset_path, STATE_FILE)
+        self.ann = ann
+        self.nprobe = nprobe
+        self.quantization = quantization
+        self._lock = threading.Lock()
+        self._training = None
+        # Bumped by deletes, so an index trained on older rows is thrown away.
+        self._generation = 0
+        os.makedirs(dataset_path, exist_ok=True)
+        if overwrite:
+            for path in (self.embeddings_path, self.scales_path, self.nodes_path, self.index_path, self.state_path):
+                for stale in (path, path + _SWAP_SUFFIX):
+                    if os.path.exists(stale):
+                        os.remove(stale)
+        self._load()
+
+    def _current(self, path):
+        """`path`, or its swap file while a committed delete has not been moved into place."""
+        swap_path = path + _SWAP_SUFFIX
+        if os.path.basename(path) in self._swapped and os.path.exists(swap_path):
+            return swap_path
+        return path
+
+    def _load(self):
+        state = {"rows": 0, "nodes_bytes": 0}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as file:
+                state = json.load(file)
+        self._swapped = state.get("swap", [])
+
+        records = []
+        nodes_path = self._current(self.nodes_path)
+        if os.path.exists(nodes_path):
+            with open(nodes_path, "rb") as file:
+                data = file.read(state["nodes_bytes"])
+            records = [json.loads(line) for line in data.splitlines() if line.strip()]
+        matrix = scales = None
+        embeddings_path = self._current(self.embeddings_path)
+        if os.path.exists(embeddings_path):
+            matrix = np.load(embeddings_path, mmap_mode="r")
+            self.quantization = np.dtype(matrix.dtype).name
+            if self.quantization == "int8":
+                scales = np.load(self._current(self.scales_path))
+
+        counts = {"nodes": len(records), "vectors": 0 if matrix is None else len(matrix)}
+        if scales is not None:
+            counts["scales"] = len(scales)
+        count = state["rows"]
+        if min(counts.values()) < count:
+            raise ValueError(f"Vector store {self.dataset_path} is damaged: {counts} rows, {count} committed")
+        self._nodes_bytes = state["nodes_bytes"]
+        self.records = records[:count]
+        self.matrix = None if matrix is None else matrix[:count]
+        self.scales = None if scales is None else scales[:count]
+
+        self.index = IVFFlatIndex.load(self.index_path) if os.path.exists(self.index_path) else None
+        if self.index is not None and len(self.index) != count:
+            # The index is derived data: search exactly until the next write retrains it.
+            self.index = None
+
+    def _finish_swap(self):
+        """Move the files of a committed delete into place (writers only)."""
+        if not self._swapped:
+            return
+        for name in self._swapped:
+            path = os.path.join(self.dataset_path, name)
+            if os.path.exists(path + _SWAP_SUFFIX):
+                os.replace(path + _SWAP_SUFFIX, path)
+        _write_state(self.dataset_path, len(self.records), self._nodes_bytes)
+        self._swapped = []
+
+    def vectors(self, rows=slice(None)):
+        """Stored vectors as float32 (dequantized, not re-normalised)."""
+        return dequantize(self.matrix[rows], None if self.scales is None else self.scales[rows])
+
+    def _update_index(self, new_rows_start):
+        """
+        Bring the ANN index up to date after rows from `new_rows_start` were
+        appended (called under the lock). New rows are assigned to the current
+        lists; training is started in the background when the index is missing
+        or has outgrown its centroids.
+        """
+        if self.matrix is None:
+            return
+        if self.index is not None:
+            self.index.add(self.vectors(slice(new_rows_start, None)))
+            self.index.save(self.index_path)
+            if not self.index.needs_retrain():
+                return
+        elif not (self.ann or os.path.exists(self.index_path)) or len(self.matrix) < ANN_MIN_VECTORS:
+            return
+        if self._training is None:
+            # Not a daemon: an index still training when the process exits is finished and saved.
+            self._training = threading.Thread(target=self._train_index, name="ivf-train")
+            self._training.start()
+
+    def _train_index(self):
+        """Train an index on a snapshot of the rows, then assign the rows added meanwhile."""
+        with self._lock:
+            trained_rows, generation = len(self.records), self._generation
+            vectors = self.vectors(slice(0, trained_rows))
+        index = IVFFlatIndex.train(vectors)
+        with self._lock:
+            self._training = None
+            if generation != self._generation:
+                # Rows were deleted meanwhile; the next write starts over.
+                return
+            index.add(self.vectors(slice(trained_rows, None)))
+            index.save(self.index_path)
+            self.index = index
+
+    def wait_for_index(self):
+        """Block until a background index training (if any) has finished."""
+        training = self._training
+        if training is not None:
+            training.join()
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def dimensions(self):
+        """Width of the stored vectors, or None while the store is empty."""
+        return None if self.matrix is None or not len(self.matrix) else self.matrix.shape[1]
+
+    def nbytes(self):
+        """Bytes used by the stored vectors (and scales)."""
+        size = 0 if self.matrix is None else self.matrix.nbytes
+        return size + (0 if self.scales is None else self.scales.nbytes)
+
+    def add(self, nodes, **kwargs):
+        """Append nodes (with embeddings); returns their ids."""
+        if not nodes:
+            return []
+        return self.add_vectors(
+            [node.node_id for node in nodes],
+            [node.get_content() for node in nodes],
+            [node.get_embedding() for node in nodes],
+            [node.metadata for node in nodes],
+        )
+
+    def add_vectors(self, ids, texts, embeddings, metadata=None):
+        """
+        Append rows without building nodes; `add` for callers that hold plain
+        lists. Only the new rows are written.
+
+        Returns:
+            list: the ids.
+        """
+        if not len(ids):
+            return []
+        metadata = metadata or [{}] * len(ids)
+        with self._lock:
+            stored, scales = quantize(fit_dimensions(normalize(embeddings), self.dimensions), self.quantization)
+            new_rows_start = len(self.records)
+            self.matrix = None  # Release the memory map before the files change.
+            self._finish_swap()
+            if scales is not None:
+                _append_array(self.scales_path, scales, new_rows_start)
+                scales = scales if self.scales is None else np.concatenate([self.scales, scales])
+            _append_array(self.embeddings_path, stored, new_rows_start)
+
+            records = [
+                {"id": node_id, "text": text, "metadata": meta}
+                for node_id, text, meta in zip(ids, texts, metadata)
+            ]
+            data = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+            with open(self.nodes_path, "ab") as file:
+                file.truncate(self._nodes_bytes)  # Drop lines of an interrupted add.
+                file.write(data)
+            self._nodes_bytes += len(data)
+            self.records.extend(records)
+            _write_state(self.dataset_path, len(self.records), self._nodes_bytes)
+            self.matrix = np.load(self.embeddings_path, mmap_mode="r")[:len(self.records)]
+            self.scales = scales
+            self._update_index(new_rows_start)
+        return [record["id"] for record in records]
+
+    async def async_add(self, nodes, **kwargs):
+        return await asyncio.to_thread(self.add, nodes, **kwargs)
+
+    def delete_nodes(self, node_ids, **kwargs):
+        """Remove nodes by id; unknown ids are ignored."""
+        doomed = set(node_ids)
+        with self._lock:
+            keep = np.array([record["id"] not in doomed for record in self.records], dtype=bool)
+            if keep.all():
+                return
+            stored = np.asarray(self.matrix)[keep]
+            scales = None if self.scales is None else self.scales[keep]
+            self.matrix = None  # Release the memory map before replacing the file.
+            self._finish_swap()
+
+            # Write the new files aside, commit them in the state, then move them in.
+            swap = [EMBEDDINGS_FILE, NODES_FILE]
+            _save_array(self.embeddings_path + _SWAP_SUFFIX, stored)
+            if scales is not None:
+                _save_array(self.scales_path + _SWAP_SUFFIX, scales)
+                swap.append(SCALES_FILE)
+            self.records = [record for record, kept in zip(self.records, keep) if kept]
+            data = "".join(json.dumps(record) + "\n" for record in self.records).encode("utf-8")
+            with open(self.nodes_path + _SWAP_SUFFIX, "wb") as file:
+                file.write(data)
+            self._nodes_bytes = len(data)
+            _write_state(self.dataset_path, len(self.records), self._nodes_bytes, swap)
+            self._swapped = swap
+            self._finish_swap()
+            self.matrix = np.load(self.embeddings_path, mmap_mode="r")
+            self.scales = scales
+            self._generation += 1
+            if self.index is not None:
+                self.index.remove(keep)
+                self.index.save(self.index_path)
+
+    def _scores(self, matrix, scales, query, rows=None):
+        """Similarity of `query` to the given rows (all rows if None), from the stored format."""
+        if self.quantization == "float32":
+            return (matrix if rows is None else matrix[rows]) @ query
+        total = len(matrix) if rows is None else len(rows)
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, _SCORE_BLOCK):
+            block = slice(start, min(start + _SCORE_BLOCK, total))
+            selected = block if rows is None else rows[block]
+            scores[block] = dequantize(matrix[selected], None if scales is None else scales[selected]) @ query
+        return scores
+
+    @staticmethod
+    def _top(rows, scores, top_k):
+        top_k = min(top_k, len(scores))
+        if top_k < len(scores):
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return (best if rows is None else rows[best]), scores[best]
+
+    def _search(self, query_embedding, top_k, exact=False):
+        """
+        `search`, also returning the records, vectors and scales its rows refer to.
+
+        Writers replace these (and renumber the index's rows) under the lock, so
+        they are read together under it; scoring then runs on that snapshot
+        without holding the lock.
+
+        Returns:
+            tuple: (records, matrix, scales, row indices, similarities)
+        """
+        with self._lock:
+            records, matrix, scales, index = self.records, self.matrix, self.scales, self.index
+            if matrix is None or not len(matrix) or top_k <= 0:
+                return records, matrix, scales, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            query = fit_dimensions(normalize(query_embedding), matrix.shape[1])
+            # The index's lists change in place on writes, so its candidates are taken here too.
+            rows = index.candidates(query, self.nprobe) if index is not None and not exact else None
+        rows, scores = self._top(rows, self._scores(matrix, scales, query, rows), top_k)
+        return records, matrix, scales, rows, scores
+
+    def search(self, query_embedding, top_k=3, exact=False):
+        """
+        Top-k rows by cosine similarity, from the ANN index when there is one
+        (unless `exact`).
+
+        Returns:
+            tuple: (row indices, similarities), best first.
+        """
+        _, _, _, rows, scores = self._search(query_embedding, top_k, exact)
+        return rows, scores
+
+    def query(self, query, **kwargs):
+        """`VectorStoreQuery` -> `VectorStoreQueryResult`, as for `DeepLakeVectorStore`."""
+        from aih_rag.schema import TextNode
+        from aih_rag.vector_stores.types import VectorStoreQueryResult
+
+        records, matrix, scales, rows, scores = self._search(query.query_embedding, query.similarity_top_k)
+        # Stored vectors go back with the hits so callers can compare them (MMR).
+        vectors = dequantize(matrix[rows], None if scales is None else scales[rows]) if len(rows) else []
+        nodes = [
+            TextNode(
+                id_=records[row]["id"],
+                text=records[row]["text"],
+                metadata=records[row]["metadata"] or {},
+                embedding=vector.tolist(),
+            )
+            for row, vector in zip(rows, vectors)
+        ]
+        return VectorStoreQueryResult(
+            nodes=nodes,
+            similarities=[float(score) for score in scores],
+            ids=[node.node_id for node in nodes],
+        )
@@ -0,0 +1,187 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import pytesseract
+from PIL import Image
+from External.image_preprocess import record_preprocess_stats
+
+try:
+    # tesserocr keeps a Tesseract engine (and its language model) loaded in memory.
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Throughput settings
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", 4))  # Images handed to a worker per round trip.
+OCR_LANGUAGE = os.getenv("OCR_LANGUAGE", "eng")
+
+# Resident engine and language of the current worker process, set by `_init_worker`.
+_engine = None
+_language = OCR_LANGUAGE
+# Size of the pool `get_ocr_pool` creates; 0 once `use_inline_ocr` has run.
+_pool_workers = OCR_WORKERS
+
+
+def _init_worker(language):
+    global _engine, _language
+    _language = language
+    if tesserocr is not None:
+        _engine = tesserocr.PyTessBaseAPI(lang=language)
+
+
+def _open_image(image):
+    """Accept a file path or a PIL image."""
+    if isinstance(image, Image.Image):
+        return image
+    opened = Image.open(image)
+    opened.load()
+    return opened
+
+
+def _engine_image_to_data(image):
+    """Build the same word table as `pytesseract.image_to_data` from the resident engine."""
+    level = tesserocr.RIL.WORD
+    data = {key: [] for key in (
+        "page_num", "block_num", "par_num", "line_num", "word_num",
+        "left", "top", "width", "height", "conf", "text",
+    )}
+    _engine.SetImage(image)
+    _engine.Recognize()
+    iterator = _engine.GetIterator()
+    if iterator is None:
+        return data
+
+    block_num = par_num = line_num = word_num = 0
+    while True:
+        if iterator.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+            block_num, par_num = block_num + 1, 0
+        if iterator.IsAtBeginningOf(tesserocr.RIL.PARA):
+            par_num, line_num = par_num + 1, 0
+        if iterator.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+            line_num, word_num = line_num + 1, 0
+        word_num += 1
+        text = iterator.GetUTF8Text(level)
+        box = iterator.BoundingBox(level)
+        if text is not None and box is not None:
+            left, top, right, bottom = box
+            for key, value in (
+                ("page_num", 1), ("block_num", block_num), ("par_num", par_num),
+                ("line_num", line_num), ("word_num", word_num), ("left", left),
+                ("top", top), ("width", right - left), ("height", bottom - top),
+                ("conf", iterator.Confidence(level)), ("text", text),
+            ):
+                data[key].append(value)
+        if not iterator.Next(level):
+            break
+    return data
+
+
+def _image_to_string(image, preprocessor=None):
+    image = _open_image(image)
+    if preprocessor is not None:
+        image = preprocessor.process_image(image)
+    if _engine is not None:
+        _engine.SetImage(image)
+        return _engine.GetUTF8Text()
+    return pytesseract.image_to_string(image, lang=_language)
+
+
+def _image_to_data(image):
+    image = _open_image(image)
+    if _engine is not None:
+        return _engine_image_to_data(image)
+    return pytesseract.image_to_data(image, lang=_language, output_type=pytesseract.Output.DICT)
+
+
+def _preprocess_to_data(image_path, preprocessor):
+    prepared_path, stats = preprocessor.preprocess(image_path, record=False)
+    return prepared_path, _image_to_data(prepared_path), stats
+
+
+class OCRWorkerPool:
+    """
+    Long-lived OCR worker processes. With tesserocr installed every worker keeps
+    one Tesseract engine resident, so the language model is loaded once per
+    worker instead of once per image. Without it, workers fall back to pytesseract.
+
+    Images can be given as file paths or PIL images. With `max_workers=0` the
+    "pool" is one thread of the calling process (with its own resident engine),
+    for processes that are already pool workers themselves.
+    """
+
+    def __init__(self, max_workers=OCR_WORKERS, batch_size=OCR_BATCH_SIZE, language=OCR_LANGUAGE):
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        if max_workers:
+            self.executor = ProcessPoolExecutor(
+                max_workers=max_workers, initializer=_init_worker, initargs=(language,)
+            )
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1, initializer=_init_worker, initargs=(language,))
+
+    def image_to_string(self, image, preprocessor=None) -> str:
+        """OCR one image. The optional `preprocessor` (an `ImagePreprocessor`) runs inside the worker."""
+        return self.executor.submit(_image_to_string, image, preprocessor).result()
+
+    def submit_image_to_string(self, image, preprocessor=None):
+        """
+        Queue one image for OCR and return a Future. The optional `preprocessor`
+        (an `ImagePreprocessor`) runs inside the worker process.
+        """
+        return self.executor.submit(_image_to_string, image, preprocessor)
+
+    def image_to_data(self, image) -> dict:
+        return self.executor.submit(_image_to_data, image).result()
+
+    def image_to_string_batch(self, images) -> list:
+        """OCR a batch of images in parallel; results keep the input order."""
+        return list(self.executor.map(_image_to_string, images, chunksize=self.batch_size))
+
+    def image_to_data_batch(self, images) -> list:
+        """Word tables for a batch of images; results keep the input order."""
+        return list(self.executor.map(_image_to_data, images, chunksize=self.batch_size))
+
+    def preprocess_to_data_batch(self, image_paths, preprocessor) -> list:
+        """
+        Pre-process image files with `preprocessor` (an `ImagePreprocessor`) and
+        OCR them, both inside the workers. Each image's pre-processing stats come
+        back with it and are added to this process's PREPROCESS_STATS.
+
+        Returns:
+            list: (path of the pre-processed copy, word table) per image, in input order.
+        """
+        results = []
+        for prepared_path, data, stats in self.executor.map(
+            _preprocess_to_data, image_paths, [preprocessor] * len(image_paths), chunksize=self.batch_size
+        ):
+            record_preprocess_stats(stats)
+            results.append((prepared_path, data))
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def use_inline_ocr():
+    """
+    Process-pool initializer for workers that may OCR (e.g. ingest extraction):
+    their `get_ocr_pool()` runs OCR in-process instead of starting a nested
+    pool of `OCR_WORKERS` processes in every worker. A pool inherited from the
+    parent process (by fork) is dropped: its processes belong to the parent.
+    """
+    global _pool, _pool_workers
+    _pool, _pool_workers = None, 0
+
+
+def get_ocr_pool() -> OCRWorkerPool:
+    """Return the process-wide OCR pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OCRWorkerPool(max_workers=_pool_workers)
+        return _pool
@@ -0,0 +1,211 @@
+import asyncio
+import inspect
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Items waiting between two stages; a full queue pauses the stage before it.
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 4))
+
+_DONE = object()
+
+# Process pools by (workers, initializer), shared by every run so a request
+# does not start (and import into) fresh processes.
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+
+def get_process_pool(workers, initializer=None) -> ProcessPoolExecutor:
+    """Return the shared process pool of this size and initializer, creating it on first use."""
+    with _process_pools_lock:
+        pool = _process_pools.get((workers, initializer))
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=initializer)
+            _process_pools[(workers, initializer)] = pool
+        return pool
+
+
+def _discard_process_pool(pool):
+    """Forget a pool whose worker died (its processes are gone), so the next run starts a new one."""
+    with _process_pools_lock:
+        for key, shared in list(_process_pools.items()):
+            if shared is pool:
+                del _process_pools[key]
+
+
+class Stage:
+    """
+    One step of a `StagedPipeline`.
+
+    `function(item)` is called by `workers` concurrent workers:
+        - `mode="async"`: a coroutine function (or plain function) awaited on the event loop,
+          for IO-bound work;
+        - `mode="thread"`: run on a thread pool;
+        - `mode="process"`: run on a process pool, for CPU-bound work. The
+          function and its items must be picklable (a module-level function).
+          The pool is shared across runs (see `get_process_pool`), and
+          `initializer` runs once in each of its processes. A run with a
+          single item uses a thread instead, as starting processes would cost
+          more than they save.
+
+    With `batch_size > 1` the function receives a list of up to that many
+    items: whatever is queued when a worker becomes free, so batches grow
+    only when the stage falls behind. Returning None drops the item; an
+    exception drops it too and is passed to the pipeline's `on_error`.
+
+    In "thread" and "async" mode the function may instead return a generator
+    to split an item into several: each value is passed on as it is yielded,
+    and the generator is not resumed while the next queue is full, so a large
+    item is never held in memory whole. If it raises, the values it already
+    yielded stay passed on.
+    """
+
+    def __init__(self, name, function, workers=1, mode="async", batch_size=1, initializer=None):
+        if mode not in ("async", "thread", "process"):
+            raise ValueError(f"Unknown stage mode: {mode}")
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.mode = mode
+        self.batch_size = batch_size
+        self.initializer = initializer
+        self.stats = Counter()
+        self.started = self.finished = None
+
+    def report(self) -> dict:
+        """Items, errors, busy and wall time, and throughput of the stage."""
+        wall = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "items_in": self.stats["items_in"],
+            "items_out": self.stats["items_out"],
+            "errors": self.stats["errors"],
+            "busy_s": round(self.stats["busy"], 3),
+            "wall_s": round(wall, 3),
+            "items_per_s": round(self.stats["items_in"] / wall, 2) if wall > 0 else 0.0,
+        }
+
+
+class StagedPipeline:
+    """
+    Run items through stages that overlap in time.
+
+    Consecutive stages are joined by queues of `queue_size` items, so a slow
+    stage holds back the ones before it (backpressure) and at most a few items
+    are in memory per stage. The pipeline then takes about as long as its
+    slowest stage instead of the sum of all stages.
+
+    `run(items)` returns the outputs of the last stage (in completion order);
+    `report()` gives each stage's throughput.
+    """
+
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE, on_error=None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_error = on_error
+
+    async def _call(self, stage, executor, argument):
+        if stage.mode == "async":
+            result = stage.function(argument)
+            return await result if inspect.isawaitable(result) else result
+        return await asyncio.get_running_loop().run_in_executor(executor, stage.function, argument)
+
+    async def _next(self, stage, executor, outputs):
+        """The next value of a stage's generator, or _DONE."""
+        if stage.mode == "async":
+            return next(outputs, _DONE)
+        return await asyncio.get_running_loop().run_in_executor(executor, next, outputs, _DONE)
+
+    @staticmethod
+    async def _emit(stage, outbox, result):
+        if result is not None:
+            stage.stats["items_out"] += 1
+            await outbox.put(result)
+
+    async def _worker(self, stage, executor, inbox, outbox):
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                # Leave the marker for the stage's other workers.
+                await inbox.put(_DONE)
+                return
+            if stage.batch_size > 1:
+                batch = [item]
+                while len(batch) < stage.batch_size and not inbox.empty():
+                    queued = inbox.get_nowait()
+                    if queued is _DONE:
+                        await inbox.put(_DONE)
+                        break
+                    batch.append(queued)
+                argument, count = batch, len(batch)
+            else:
+                argument, count = item, 1
+
+            stage.stats["items_in"] += count
+            started = time.perf_counter()
+            try:
+                result = await self._call(stage, executor, argument)
+                if inspect.isgenerator(result):
+                    outputs, result = result, None
+                    while (output := await self._next(stage, executor, outputs)) is not _DONE:
+                        # Time blocked on a full queue is not busy time.
+                        stage.stats["busy"] += time.perf_counter() - started
+                        await self._emit(stage, outbox, output)
+                        started = time.perf_counter()
+            except Exception as error:
+                if isinstance(error, BrokenProcessPool):
+                    _discard_process_pool(executor)
+                stage.stats["errors"] += count
+                if self.on_error is not None:
+                    self.on_error(stage.name, argument, error)
+                result = None
+            stage.stats["busy"] += time.perf_counter() - started
+            await self._emit(stage, outbox, result)
+
+    async def run(self, items):
+        items = list(items)
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = asyncio.Queue()
+        outboxes = queues[1:] + [results]
+        executors = []  # Per-run thread pools, shut down at the end.
+        workers = []
+        for stage, inbox, outbox in zip(self.stages, queues, outboxes):
+            executor = None
+            if stage.mode == "process" and len(items) > 1:
+                executor = get_process_pool(stage.workers, stage.initializer)
+            elif stage.mode != "async":
+                executor = ThreadPoolExecutor(max_workers=stage.workers)
+                executors.append(executor)
+            stage.started = time.perf_counter()
+            workers.append(
+                [asyncio.create_task(self._worker(stage, executor, inbox, outbox)) for _ in range(stage.workers)]
+            )
+
+        try:
+            for item in items:
+                await queues[0].put(item)
+            await queues[0].put(_DONE)
+            # Close each stage once its workers are done, then signal the next one.
+            for stage, stage_workers, outbox in zip(self.stages, workers, outboxes):
+                await asyncio.gather(*stage_workers)
+                stage.finished = time.perf_counter()
+                if outbox is not results:
+                    await outbox.put(_DONE)
+        finally:
+            for stage_workers in workers:
+                for task in stage_workers:
+                    task.cancel()
+            for executor in executors:
+                executor.shutdown(wait=False)
+
+        outputs = []
+        while not results.empty():
+            outputs.append(results.get_nowait())
+        return outputs
+
+    def report(self) -> list:
+        return [stage.report() for stage in self.stages]
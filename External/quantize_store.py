@@ -0,0 +1,189 @@
+"""
+Convert vector stores to a smaller storage format in place: quantized vectors
+(`--format`) and/or shortened embeddings (`--dimensions`).
+
+    python -m External.quantize_store assets/user-*/deeplake/* --format int8
+    python -m External.quantize_store temp/users/*/dataset_* --format float16 --check
+    python -m External.quantize_store assets/static/dataset --dimensions 512 --check
+    python -m External.quantize_store assets/user-*/deeplake/* --format int8 --remove-deeplake
+
+NumPy stores are rewritten in the new format; their texts, metadata and ANN
+index are kept (the index is retrained when the width changes). DeepLake
+datasets are read once and written as a NumPy store in the same directory, so
+they are picked up with VECTOR_STORE_BACKEND=numpy. The DeepLake files are
+kept beside it (so the dataset still works with the DeepLake backend, and the
+disk use grows) unless `--remove-deeplake` is given: they are then deleted
+once the NumPy store has been reopened and holds every row.
+
+`--dimensions` keeps the first N components of every vector and re-normalises
+them, which for text-embedding-3 models matches asking the API for N
+dimensions. Set EMBEDDING_DIMENSIONS to the same N so new embeddings match;
+longer query embeddings are also cut to the store's width at search time. The
+`embedding_dimensions` of the dataset's ingest manifest config is set to N as
+well, so incremental ingests keep the store instead of rebuilding it; it is
+left alone when the width does not change.
+
+`--check` reports recall@k of the converted store against float32 search at
+the original width, using stored vectors as queries.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+
+import numpy as np
+
+from External.ann import INDEX_FILE, IVFFlatIndex
+from External.manifest import update_manifest_config
+from External.numpy_store import (
+    EMBEDDINGS_FILE,
+    NODES_FILE,
+    QUANTIZATION_DTYPES,
+    SCALES_FILE,
+    STATE_FILE,
+    NumpyVectorStore,
+    _save_array,
+    _write_state,
+    fit_dimensions,
+    normalize,
+    quantize,
+)
+
+
+def read_deeplake_store(dataset_path):
+    """
+    Read the ids, texts, metadata and embeddings of a DeepLake dataset.
+
+    Returns:
+        tuple: (list of node records, float32 matrix)
+    """
+    import deeplake
+
+    dataset = deeplake.load(dataset_path, read_only=True)
+    ids = dataset.id.data()["value"]
+    texts = dataset.text.data()["value"]
+    metadata = dataset.metadata.data()["value"] if "metadata" in dataset.tensors else [{}] * len(ids)
+    records = [
+        {"id": node_id, "text": text, "metadata": meta or {}}
+        for node_id, text, meta in zip(ids, texts, metadata)
+    ]
+    return records, np.asarray(dataset.embedding.numpy(), dtype=np.float32)
+
+
+def write_store(dataset_path, records, vectors, quantization, nodes_bytes=None):
+    """Write the vectors (and `records`, unless None: `nodes_bytes` of nodes.jsonl are kept) and commit them."""
+    stored, scales = quantize(normalize(vectors), quantization)
+    if scales is not None:
+        _save_array(os.path.join(dataset_path, SCALES_FILE), scales)
+    elif os.path.exists(os.path.join(dataset_path, SCALES_FILE)):
+        os.remove(os.path.join(dataset_path, SCALES_FILE))
+    _save_array(os.path.join(dataset_path, EMBEDDINGS_FILE), stored)
+    if records is not None:
+        data = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+        with open(os.path.join(dataset_path, NODES_FILE), "wb") as file:
+            file.write(data)
+        nodes_bytes = len(data)
+    _write_state(dataset_path, len(stored), nodes_bytes)
+
+
+def recall_at_k(reference, store, top_k=10, queries=100, seed=0):
+    """Mean overlap between float32 exact top-k and the store's top-k."""
+    rng = np.random.default_rng(seed)
+    reference = normalize(reference)
+    picked = rng.choice(len(reference), min(queries, len(reference)), replace=False)
+    overlaps = []
+    for row in picked:
+        scores = reference @ reference[row]
+        k = min(top_k, len(scores))
+        expected = set(np.argpartition(-scores, k - 1)[:k].tolist())
+        found = set(store.search(reference[row], k, exact=True)[0].tolist())
+        overlaps.append(len(expected & found) / k)
+    return float(np.mean(overlaps))
+
+
+def remove_deeplake_files(dataset_path, names):
+    """Delete the DeepLake entries `names` of a converted dataset directory, keeping the NumPy store."""
+    kept = {EMBEDDINGS_FILE, SCALES_FILE, NODES_FILE, STATE_FILE, INDEX_FILE}
+    for name in sorted(set(names) - kept):
+        path = os.path.join(dataset_path, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def convert(dataset_path, quantization=None, dimensions=None, check=False, remove_deeplake=False):
+    """
+    Rewrite one store. `quantization` / `dimensions` default to the store's own.
+    With `remove_deeplake`, a converted DeepLake dataset is deleted after the
+    new store has been verified.
+    """
+    deeplake_entries = None
+    if os.path.exists(os.path.join(dataset_path, EMBEDDINGS_FILE)):
+        store = NumpyVectorStore(dataset_path)
+        before = store.nbytes()
+        records, vectors = None, np.array(store.vectors())  # Copy before the file is replaced.
+        current = store.quantization
+        nodes_bytes = store._nodes_bytes
+        store.matrix = None
+        store._finish_swap()  # The files are rewritten below; a pending delete goes first.
+        del store
+    else:
+        deeplake_entries = os.listdir(dataset_path)
+        records, vectors = read_deeplake_store(dataset_path)
+        before = vectors.nbytes
+        current = "float32"
+        nodes_bytes = None
+    source = f"{'deeplake' if records is not None else 'numpy'}/{current}/{vectors.shape[1]}d"
+    quantization = quantization or current
+
+    shortened = fit_dimensions(normalize(vectors), dimensions)
+    write_store(dataset_path, records, shortened, quantization, nodes_bytes)
+    index_path = os.path.join(dataset_path, INDEX_FILE)
+    resized = shortened.shape[1] != vectors.shape[1]
+    if resized and os.path.exists(index_path):
+        IVFFlatIndex.train(shortened).save(index_path)
+    store = NumpyVectorStore(dataset_path)
+    line = (
+        f"{dataset_path}: {source} -> {quantization}/{store.dimensions}d, {len(store)} vectors, "
+        f"{before / 1e6:.2f} MB -> {store.nbytes() / 1e6:.2f} MB"
+    )
+    if resized and update_manifest_config(dataset_path, embedding_dimensions=int(shortened.shape[1])):
+        line += ", manifest updated"
+    if check and len(store):
+        line += f", recall@10 {recall_at_k(vectors, store):.3f}"
+    if deeplake_entries is not None and remove_deeplake:
+        if len(store) != len(records):
+            raise ValueError(f"converted store holds {len(store)} of {len(records)} rows; DeepLake data kept")
+        remove_deeplake_files(dataset_path, deeplake_entries)
+        line += ", DeepLake data removed"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Store directories (glob patterns allowed).")
+    parser.add_argument("--format", choices=sorted(QUANTIZATION_DTYPES), help="Default: keep the current format.")
+    parser.add_argument("--dimensions", type=int, help="Shorten the vectors to this many dimensions.")
+    parser.add_argument("--check", action="store_true", help="Report recall@10 after converting.")
+    parser.add_argument(
+        "--remove-deeplake", action="store_true", help="Delete converted DeepLake datasets once verified."
+    )
+    args = parser.parse_args()
+
+    for pattern in args.paths:
+        for dataset_path in sorted(glob.glob(pattern)) or [pattern]:
+            if not os.path.isdir(dataset_path):
+                print(f"{dataset_path}: not a directory, skipped")
+                continue
+            try:
+                convert(
+                    dataset_path, args.format, args.dimensions, check=args.check, remove_deeplake=args.remove_deeplake
+                )
+            except Exception as error:
+                print(f"{dataset_path}: failed ({error})")
+
+
+if __name__ == "__main__":
+    main()
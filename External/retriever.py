@@ -0,0 +1,186 @@
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from aih_rag.vector_stores.types import VectorStoreQuery
+
+from External.store_registry import get_keyword_registry, get_store_registry
+
+# Hits kept across all datasets per query.
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 6))
+# Cosine similarity below which a hit is dropped. Unrelated text scores
+# well under this with text-embedding-3 models.
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", 0.2))
+# Datasets queried at once.
+RETRIEVAL_CONCURRENCY = int(os.getenv("RETRIEVAL_CONCURRENCY", 8))
+# "vector", "keyword", "hybrid" (BM25 fused with vector hits), or "auto":
+# keyword-only for lookup-like queries that have keyword hits, else vector
+# (other queries do not touch the keyword indexes).
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "auto")
+RETRIEVAL_MODES = ("vector", "keyword", "hybrid", "auto")
+# BM25 hits fused into the vector hits per query.
+KEYWORD_TOP_K = int(os.getenv("KEYWORD_TOP_K", 3))
+# Reciprocal-rank-fusion constant: a hit scores 1 / (RRF_K + rank) per list.
+RRF_K = int(os.getenv("RRF_K", 60))
+
+# `embedding` is the stored vector when the backend returns it (NumPy), else None.
+ScoredChunk = namedtuple("ScoredChunk", ["text", "score", "dataset_path", "node_id", "embedding"], defaults=(None,))
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Merge ranked lists of `ScoredChunk`s by reciprocal rank.
+
+    A chunk scores the sum of 1 / (k + rank) over the lists it appears in, so
+    chunks found by both dense and keyword search rise to the top whatever
+    the scale of each list's scores. The first list's copy of a chunk is kept
+    (with its embedding), with `score` set to the fused score.
+
+    Returns:
+        list: `ScoredChunk`s, best fused score first.
+    """
+    fused, chunks = {}, {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, start=1):
+            key = (chunk.dataset_path, chunk.node_id)
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+            chunks.setdefault(key, chunk)
+    order = sorted(fused, key=fused.get, reverse=True)
+    return [chunks[key]._replace(score=fused[key]) for key in order]
+
+
+class FederatedRetriever:
+    """
+    Query several vector stores at once and merge their hits by score.
+
+    Each dataset is opened and queried on its own thread for the global
+    `top_k`, so the merge is exact: the result is the best `top_k` hits over
+    all datasets, not `top_k` per dataset. Hits scoring below `min_score` are
+    dropped. Missing datasets are skipped without being opened; the others
+    come from the process-wide `StoreRegistry` unless `open_store` is given.
+
+    `retrieve` also returns a per-dataset report (open and total latency,
+    hits returned, hits above `min_score`, hits kept in the global top-k,
+    error) so slow or useless datasets show up in the logs.
+
+    `retrieve_keywords` does the same with each dataset's BM25
+    `KeywordIndex` (from the keyword registry unless `open_keywords` is
+    given); it needs no query embedding.
+    """
+
+    def __init__(
+        self,
+        top_k=RETRIEVAL_TOP_K,
+        min_score=RETRIEVAL_MIN_SCORE,
+        max_concurrency=RETRIEVAL_CONCURRENCY,
+        open_store=None,
+        open_keywords=None,
+    ):
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_concurrency = max_concurrency
+        self.open_store = open_store or get_store_registry().get
+        self.open_keywords = open_keywords or get_keyword_registry().get
+
+    def _query_one(self, dataset_path, query_embedding, top_k):
+        started = time.perf_counter()
+        report = {"dataset_path": dataset_path, "hits": 0, "error": None}
+        hits = []
+        try:
+            store = self.open_store(dataset_path)
+            opened = time.perf_counter()
+            result = store.query(VectorStoreQuery(query_embedding=query_embedding, similarity_top_k=top_k))
+            similarities = result.similarities or [0.0] * len(result.nodes)
+            hits = [
+                ScoredChunk(node.get_content(), float(score), dataset_path, node.node_id, node.embedding)
+                for node, score in zip(result.nodes, similarities)
+            ]
+            report["open_ms"] = (opened - started) * 1e3
+            report["hits"] = len(hits)
+        except Exception as error:
+            report["error"] = str(error)
+        report["latency_ms"] = (time.perf_counter() - started) * 1e3
+        return hits, report
+
+    def _search_one(self, dataset_path, query, top_k):
+        started = time.perf_counter()
+        report = {"dataset_path": dataset_path, "hits": 0, "error": None}
+        hits = []
+        try:
+            index = self.open_keywords(dataset_path)
+            opened = time.perf_counter()
+            hits = [
+                ScoredChunk(text, score, dataset_path, node_id)
+                for node_id, text, score in index.search(query, top_k)
+            ]
+            report["open_ms"] = (opened - started) * 1e3
+            report["hits"] = len(hits)
+        except Exception as error:
+            report["error"] = str(error)
+        report["latency_ms"] = (time.perf_counter() - started) * 1e3
+        return hits, report
+
+    def _existing(self, dataset_paths):
+        """Paths that exist (each once), and reports for the missing ones."""
+        missing = [
+            {"dataset_path": path, "hits": 0, "above_min_score": 0, "kept": 0, "latency_ms": 0.0, "error": "missing"}
+            for path in dataset_paths
+            if not os.path.exists(path)
+        ]
+        return [path for path in dict.fromkeys(dataset_paths) if os.path.exists(path)], missing
+
+    def retrieve(self, query_embedding, dataset_paths, top_k=None, min_score=None):
+        """
+        Best hits for `query_embedding` across `dataset_paths`.
+
+        Returns:
+            tuple: (list of ScoredChunk, best first; list of per-dataset reports)
+        """
+        top_k = self.top_k if top_k is None else top_k
+        min_score = self.min_score if min_score is None else min_score
+        paths, reports = self._existing(dataset_paths)
+        if not paths or top_k <= 0:
+            return [], reports
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(paths))) as pool:
+            results = list(pool.map(lambda path: self._query_one(path, query_embedding, top_k), paths))
+
+        hits = []
+        for dataset_hits, report in results:
+            kept = [hit for hit in dataset_hits if hit.score >= min_score]
+            report["above_min_score"] = len(kept)
+            hits.extend(kept)
+            reports.append(report)
+        hits.sort(key=lambda hit: hit.score, reverse=True)
+        hits = hits[:top_k]
+        for report in reports:
+            report["kept"] = sum(hit.dataset_path == report["dataset_path"] for hit in hits)
+        return hits, reports
+
+    def retrieve_keywords(self, query, dataset_paths, top_k=KEYWORD_TOP_K):
+        """
+        Best BM25 hits for `query` across `dataset_paths`, without embedding it.
+
+        BM25 scores of different datasets are merged as they are, so a small
+        dataset's rare terms may outrank a large one's.
+
+        Returns:
+            tuple: (list of ScoredChunk, best first; list of per-dataset reports)
+        """
+        paths, reports = self._existing(dataset_paths)
+        if not paths or top_k <= 0:
+            return [], reports
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(paths))) as pool:
+            results = list(pool.map(lambda path: self._search_one(path, query, top_k), paths))
+
+        hits = []
+        for dataset_hits, report in results:
+            hits.extend(dataset_hits)
+            reports.append(report)
+        hits.sort(key=lambda hit: hit.score, reverse=True)
+        hits = hits[:top_k]
+        for report in reports:
+            report["kept"] = sum(hit.dataset_path == report["dataset_path"] for hit in hits)
+        return hits, reports
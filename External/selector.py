@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+
+from External.chunking import get_token_counter
+
+# Candidates fetched per query before selection.
+SELECTOR_CANDIDATES = int(os.getenv("SELECTOR_CANDIDATES", 20))
+# Chunks kept per query: at least `SELECTOR_MIN_K` when any clears the threshold, at most `SELECTOR_MAX_K`.
+SELECTOR_MIN_K = int(os.getenv("SELECTOR_MIN_K", 1))
+SELECTOR_MAX_K = int(os.getenv("SELECTOR_MAX_K", 8))
+# Cosine similarity below which a candidate is never sent.
+SELECTOR_MIN_SCORE = float(os.getenv("SELECTOR_MIN_SCORE", 0.2))
+# Candidates are cut at the first drop of more than `SELECTOR_MAX_GAP` between
+# consecutive scores, or once they score `SELECTOR_MAX_DROP` below the best.
+SELECTOR_MAX_GAP = float(os.getenv("SELECTOR_MAX_GAP", 0.05))
+SELECTOR_MAX_DROP = float(os.getenv("SELECTOR_MAX_DROP", 0.15))
+# MMR trade-off: 1.0 ranks by relevance only, lower values favour diversity.
+SELECTOR_MMR_LAMBDA = float(os.getenv("SELECTOR_MMR_LAMBDA", 0.7))
+# Candidates this similar to an already selected chunk are skipped as redundant.
+SELECTOR_REDUNDANT_SIMILARITY = float(os.getenv("SELECTOR_REDUNDANT_SIMILARITY", 0.95))
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class RetrievalSelector:
+    """
+    Choose how many retrieved chunks to send, and which.
+
+    Over-fetch `candidates` hits, then:
+        1. cut by score: drop hits under `min_score`, and stop at the first gap
+           of more than `max_gap` between consecutive scores or once scores
+           fall `max_drop` below the best, so a query with one clear answer
+           keeps one or two chunks and a broad one keeps more;
+        2. order the survivors with maximal marginal relevance (vectorized:
+           one candidate-by-candidate similarity matrix, one pass per pick),
+           skipping near-copies of chunks already picked, up to `max_k`.
+
+    Candidate embeddings are used when the store returns them; otherwise
+    `embed(texts)` supplies them (the embedding cache makes this cheap for
+    stored chunks). `select` reports the tokens saved against sending a
+    fixed `baseline_k` hits.
+    """
+
+    def __init__(
+        self,
+        candidates=SELECTOR_CANDIDATES,
+        min_k=SELECTOR_MIN_K,
+        max_k=SELECTOR_MAX_K,
+        min_score=SELECTOR_MIN_SCORE,
+        max_gap=SELECTOR_MAX_GAP,
+        max_drop=SELECTOR_MAX_DROP,
+        mmr_lambda=SELECTOR_MMR_LAMBDA,
+        redundant_similarity=SELECTOR_REDUNDANT_SIMILARITY,
+        baseline_k=None,
+        embed=None,
+        counter=None,
+    ):
+        self.candidates = candidates
+        self.min_k = min_k
+        self.max_k = max_k
+        self.min_score = min_score
+        self.max_gap = max_gap
+        self.max_drop = max_drop
+        self.mmr_lambda = mmr_lambda
+        self.redundant_similarity = redundant_similarity
+        self.baseline_k = baseline_k or max_k
+        self.embed = embed
+        self.counter = counter or get_token_counter()
+
+    def cutoff(self, scores):
+        """Number of leading candidates (sorted best first) to keep."""
+        keep = 0
+        for index, score in enumerate(scores):
+            if score < self.min_score:
+                break
+            if index >= self.min_k and (
+                scores[index - 1] - score > self.max_gap or scores[0] - score > self.max_drop
+            ):
+                break
+            keep = index + 1
+        return keep
+
+    def mmr(self, relevance, embeddings, top_k):
+        """Indices picked greedily by maximal marginal relevance, best first."""
+        relevance = np.asarray(relevance, dtype=np.float32)
+        vectors = _normalize(embeddings)
+        similarity = vectors @ vectors.T
+        picked = [int(np.argmax(relevance))]
+        # Highest similarity of each candidate to anything picked so far.
+        closest = similarity[picked[0]].copy()
+        available = np.ones(len(vectors), dtype=bool)
+        available[picked[0]] = False
+        available &= closest < self.redundant_similarity
+        while len(picked) < top_k and available.any():
+            marginal = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * closest
+            marginal[~available] = -np.inf
+            choice = int(np.argmax(marginal))
+            picked.append(choice)
+            closest = np.maximum(closest, similarity[choice])
+            available[choice] = False
+            available &= closest < self.redundant_similarity
+        return picked
+
+    def select(self, texts, scores, embeddings=None):
+        """
+        Pick the chunks to send from over-fetched candidates.
+
+        Args:
+            texts (list): Candidate texts.
+            scores (list): Their similarities to the query.
+            embeddings (list): Candidate vectors, or None (entries may be None)
+                to get them from `embed`.
+
+        Returns:
+            tuple: (indices into the candidates, in the order to send them;
+            report dict with candidate, selected and token counts)
+        """
+        texts = list(texts)
+        order = sorted(range(len(texts)), key=lambda index: scores[index], reverse=True)
+        keep = order[:self.cutoff([scores[index] for index in order])]
+
+        selected = keep
+        if len(keep) > 1:
+            vectors = None if embeddings is None else [embeddings[index] for index in keep]
+            if vectors is None or any(vector is None for vector in vectors):
+                vectors = self.embed([texts[index] for index in keep]) if self.embed else None
+            if vectors is not None:
+                relevance = [scores[index] for index in keep]
+                selected = [keep[index] for index in self.mmr(relevance, vectors, self.max_k)]
+        selected = selected[:self.max_k]
+
+        baseline = order[:self.baseline_k]
+        tokens = {index: self.counter.count(texts[index]) for index in set(baseline) | set(selected)}
+        report = {
+            "candidates": len(texts),
+            "above_cutoff": len(keep),
+            "selected": len(selected),
+            "tokens_selected": sum(tokens[index] for index in selected),
+            "tokens_baseline": sum(tokens[index] for index in baseline),
+        }
+        report["tokens_saved"] = report["tokens_baseline"] - report["tokens_selected"]
+        return selected, report
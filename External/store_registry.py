@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from External.keyword_index import KeywordIndex, keyword_index_version
+from External.manifest import manifest_path
+from External.vector import create_vector_store
+
+# Stores kept open at once; the least recently used one is closed beyond this.
+STORE_REGISTRY_MAX_OPEN = int(os.getenv("STORE_REGISTRY_MAX_OPEN", 32))
+# Seconds a store may stay unused before it is closed.
+STORE_REGISTRY_TTL = float(os.getenv("STORE_REGISTRY_TTL", 1800))
+
+
+def store_version(dataset_path):
+    """
+    Cheap change marker for a dataset: modification times of its directory
+    (changes when the NumPy backend swaps in new files or a dataset is
+    recreated) and of its ingest manifest (changes on every ingest).
+    """
+    version = []
+    for path in (dataset_path, manifest_path(dataset_path)):
+        try:
+            version.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+
+def _close(store):
+    close = getattr(store, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception:
+            pass
+
+
+class StoreRegistry:
+    """
+    Process-wide pool of open vector stores for querying.
+
+    `get` returns the store already open for a dataset path, opening it on
+    first use (without overwrite). Entries are keyed by path and
+    `store_version`, so a dataset rewritten since it was opened (by an ingest
+    in this or another process) is reopened on the next `get`. Stores unused
+    for `ttl` seconds, and the least recently used beyond `max_open`, are
+    closed. Safe to share across threads: a path is opened once even when
+    several threads ask for it at the same time.
+
+    Writers should keep opening their own handle (`create_vector_store`);
+    `stats` counts hits, opens, reopens and evictions. Other per-dataset
+    structures can be pooled the same way by passing their own `open_store`
+    and `version` functions.
+    """
+
+    def __init__(
+        self,
+        max_open=STORE_REGISTRY_MAX_OPEN,
+        ttl=STORE_REGISTRY_TTL,
+        open_store=create_vector_store,
+        version=store_version,
+    ):
+        self.max_open = max_open
+        self.ttl = ttl
+        self.open_store = open_store
+        self.version = version
+        self.stats = Counter()
+        self._stores = OrderedDict()  # path -> (version, store, last used)
+        self._lock = threading.Lock()
+        self._opening = {}  # path -> lock held while that path is being opened
+
+    def get(self, dataset_path, **open_kwargs):
+        """Open store for `dataset_path`; `open_kwargs` are only used when opening."""
+        path = os.path.abspath(dataset_path)
+        version = self.version(path)
+        with self._lock:
+            store = self._lookup(path, version)
+            if store is not None:
+                return store
+            opening = self._opening.setdefault(path, threading.Lock())
+
+        with opening:
+            try:
+                with self._lock:
+                    # Another thread may have opened it while this one waited.
+                    store = self._lookup(path, version)
+                    if store is not None:
+                        return store
+                store = self.open_store(dataset_path=dataset_path, overwrite=False, **open_kwargs)
+                with self._lock:
+                    replaced = self._stores.pop(path, None)
+                    if replaced is not None:
+                        self.stats["reopened"] += 1
+                        _close(replaced[1])
+                    self._stores[path] = (version, store, time.monotonic())
+                    self.stats["opened"] += 1
+                    self._evict()
+                return store
+            finally:
+                # Threads already waiting keep their reference; later ones
+                # find the store cached, so the lock is not kept per path.
+                with self._lock:
+                    if self._opening.get(path) is opening:
+                        del self._opening[path]
+
+    def _lookup(self, path, version):
+        """Cached store for a current version (caller holds the lock)."""
+        self._evict()
+        entry = self._stores.get(path)
+        if entry is None or entry[0] != version:
+            return None
+        self._stores[path] = (entry[0], entry[1], time.monotonic())
+        self._stores.move_to_end(path)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def _evict(self):
+        """Close idle and excess stores (caller holds the lock)."""
+        now = time.monotonic()
+        for path in [path for path, (_, _, used) in self._stores.items() if now - used > self.ttl]:
+            _close(self._stores.pop(path)[1])
+            self.stats["evicted_idle"] += 1
+        while len(self._stores) > self.max_open:
+            _, (_, store, _) = self._stores.popitem(last=False)
+            _close(store)
+            self.stats["evicted_lru"] += 1
+
+    def sweep(self):
+        """Close stores idle for longer than the TTL."""
+        with self._lock:
+            self._evict()
+
+    def invalidate(self, dataset_path):
+        """Close the store for `dataset_path` so the next `get` reopens it."""
+        with self._lock:
+            entry = self._stores.pop(os.path.abspath(dataset_path), None)
+        if entry is not None:
+            _close(entry[1])
+
+    def close_all(self):
+        with self._lock:
+            stores, self._stores = list(self._stores.values()), OrderedDict()
+        for _, store, _ in stores:
+            _close(store)
+
+    def __len__(self):
+        return len(self._stores)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_store_registry() -> StoreRegistry:
+    """Return the process-wide store registry, creating it on first use."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = StoreRegistry()
+        return _registry
+
+
+def _open_keyword_index(dataset_path, overwrite=False):
+    return KeywordIndex(dataset_path)
+
+
+_keyword_registry = None
+
+
+def get_keyword_registry() -> StoreRegistry:
+    """Return the process-wide pool of loaded keyword indexes, creating it on first use."""
+    global _keyword_registry
+    with _registry_lock:
+        if _keyword_registry is None:
+            _keyword_registry = StoreRegistry(open_store=_open_keyword_index, version=keyword_index_version)
+        return _keyword_registry
@@ -1,30 +1,96 @@
 import os
 from aih_rag.schema import TextNode
-from aih_rag.vector_stores.deeplake import DeepLakeVectorStore
 from aih_rag.vector_stores.types import VectorStoreQuery, VectorStoreQueryResult
 
-class DeepLakeManager:
-    def __init__(self, dataset_path, overwrite=True, ingestion_batch_size=10, ingestion_num_workers=2, verbose=False):
-        # Initialize the DeepLake vector store
-        self.vector_store = DeepLakeVectorStore(
+from External.keyword_index import KeywordIndex
+
+# "deeplake" (default) or "numpy" for the in-process `NumpyVectorStore`.
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "deeplake")
+
+
+def create_vector_store(dataset_path, overwrite=False, backend=None, ann=False, quantization=None, **deeplake_kwargs):
+    """
+    Open the vector store at `dataset_path` with the configured backend.
+    Both backends support `add`, `async_add` and `query(VectorStoreQuery)`.
+    `ann=True` lets the NumPy backend build an approximate index once the
+    store is large (see `External.ann`); DeepLake manages its own indexing.
+    `quantization` ("float16" / "int8") sets the NumPy storage format of new
+    stores, defaulting to the VECTOR_QUANTIZATION environment variable.
+    """
+    backend = (backend or VECTOR_STORE_BACKEND).lower()
+    if backend == "numpy":
+        from External.numpy_store import VECTOR_QUANTIZATION, NumpyVectorStore
+
+        return NumpyVectorStore(
             dataset_path=dataset_path,
             overwrite=overwrite,
+            ann=ann,
+            quantization=quantization or VECTOR_QUANTIZATION,
+        )
+    if backend == "deeplake":
+        from aih_rag.vector_stores.deeplake import DeepLakeVectorStore
+
+        return DeepLakeVectorStore(dataset_path=dataset_path, overwrite=overwrite, **deeplake_kwargs)
+    raise ValueError(f"Unknown vector store backend: {backend}")
+
+
+def delete_nodes(vector_store, node_ids):
+    """Delete nodes by id from a store of either backend."""
+    node_ids = list(node_ids)
+    if not node_ids:
+        return
+    if hasattr(vector_store, "vectorstore"):
+        # DeepLakeVectorStore keeps node ids in the `id` tensor of its deeplake VectorStore.
+        vector_store.vectorstore.delete(ids=node_ids)
+    else:
+        vector_store.delete_nodes(node_ids)
+
+
+class DeepLakeManager:
+    def __init__(self, dataset_path, overwrite=True, ingestion_batch_size=10, ingestion_num_workers=2, verbose=False, ann=False):
+        # Initialize the vector store (DeepLake unless VECTOR_STORE_BACKEND says otherwise)
+        self.vector_store = create_vector_store(
+            dataset_path,
+            overwrite=overwrite,
+            ann=ann,
             ingestion_batch_size=ingestion_batch_size,
             ingestion_num_workers=ingestion_num_workers,
             verbose=verbose
         )
+        # BM25 index of the same chunks, kept beside the dataset
+        self.keywords = KeywordIndex(dataset_path)
+        if overwrite:
+            self.keywords.clear()
 
     def add_nodes(self, nodes):
         # Add nodes to DeepLake vector store
         added_node_ids = self.vector_store.add(nodes)
         # print(f"Added nodes with IDs: {added_node_ids}")
+        self.keywords.add([node.node_id for node in nodes], [node.text for node in nodes])
+        self.keywords.save()
         return added_node_ids
 
-    def query_store(self, query_embedding, top_k=3):
-        # Query the vector store with the provided embedding
-        query = VectorStoreQuery(query_embedding=query_embedding, similarity_top_k=top_k)
+    def delete_nodes(self, node_ids):
+        # Remove nodes (e.g. of a changed or removed file) by id
+        node_ids = list(node_ids)
+        delete_nodes(self.vector_store, node_ids)
+        self.keywords.remove(node_ids)
+        self.keywords.save()
+
+    def query_store(self, query_embedding, top_k=3, selector=None):
+        # Query the vector store with the provided embedding. With a
+        # `RetrievalSelector`, over-fetch and keep up to `top_k` of its picks.
+        fetch_k = max(top_k, selector.candidates) if selector else top_k
+        query = VectorStoreQuery(query_embedding=query_embedding, similarity_top_k=fetch_k)
         results = self.vector_store.query(query=query)
-        queried_texts = [node.text for node in results.nodes]
+        nodes = results.nodes
+        if selector and nodes:
+            similarities = results.similarities or [0.0] * len(nodes)
+            selected, _ = selector.select(
+                [node.text for node in nodes], similarities, [node.embedding for node in nodes]
+            )
+            nodes = [nodes[index] for index in selected][:top_k]
+        queried_texts = [node.text for node in nodes]
         # print(f"Queried Texts: {queried_texts}")
         return queried_texts
 
@@ -37,21 +103,23 @@ def initialize_store():
 
 import uuid
 
-def add_custom_nodes(manager, text_list, embedding_list):
+def add_custom_nodes(manager, text_list, embedding_list, node_ids=None):
     """
     Adds nodes to the vector store with UUIDs as node IDs, based on user-provided text and embedding.
     
     :param manager: Instance of the DeepLakeManager.
     :param text_list: List of texts to be added.
     :param embedding_list: Corresponding list of embeddings for the texts.
+    :param node_ids: Optional node IDs (e.g. from an `IngestManifest`); new UUIDs otherwise.
     """
     if len(text_list) != len(embedding_list):
         raise ValueError("The number of texts and embeddings must be the same.")
 
     nodes = []
-    for text, embedding in zip(text_list, embedding_list):
-        node_id = str(uuid.uuid4())  # Generate a unique ID for each node
-        node = TextNode(node_id=node_id, text=text, embedding=embedding)
+    for index, (text, embedding) in enumerate(zip(text_list, embedding_list)):
+        # Generate a unique ID for each node unless one is given
+        node_id = node_ids[index] if node_ids else str(uuid.uuid4())
+        node = TextNode(id_=node_id, text=text, embedding=embedding)
         nodes.append(node)
 
     manager.add_nodes(nodes)
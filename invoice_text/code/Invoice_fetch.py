@@ -16,7 +16,7 @@ def fetch_invoice_text(file_path):
     Returns:
         str: Extracted text from the file.
     """
-    if file_path.endswith(('.pdf', '.docx', '.txt', '.html', '.htm', '.rtf', '.tiff', '.csv', '.xls', '.xlsx', '.xlsb')):
+    if file_path.endswith(('.pdf', '.docx', '.txt', '.html', '.htm', '.rtf', '.tiff', '.tif', '.csv', '.xls', '.xlsx', '.xlsb')):
         return extract_text.extract_text_from_file(file_path)
     elif file_path.endswith('.jpg') or file_path.endswith('.png') or file_path.endswith('.jpeg'):
         reviver_text = extract_image_text(file_path)
@@ -2,7 +2,7 @@ import streamlit as st
 import os
 import random
 from External.extract_text import FileTextExtractor
-from External.image_support import extract_image_text
+from External.image_support import extract_image_text, extract_images_text_tiered, escalation_rate
 from concurrent.futures import ThreadPoolExecutor
 
 # Initialize the text extractor
@@ -10,31 +10,43 @@ extract_text = FileTextExtractor()
 
 # Define allowed file types
 ALLOWED_FILE_TYPES = [
-    "pdf", "txt", "docx", "html", "htm", "rtf", "jpg", "png", "jpeg", "tiff", "csv", "xls", "xlsx", "xlsb"
+    "pdf", "txt", "docx", "html", "htm", "rtf", "jpg", "png", "jpeg", "tiff", "tif", "csv", "xls", "xlsx", "xlsb"
 ]
 
 # Function to extract text from a single file
 def fetch_invoice_text(file_path):
-    if file_path.endswith(('.pdf', '.docx', '.txt', '.html', '.htm', '.rtf', '.tiff', '.csv', '.xls', '.xlsx', '.xlsb')):
+    if file_path.endswith(('.pdf', '.docx', '.txt', '.html', '.htm', '.rtf', '.tiff', '.tif', '.csv', '.xls', '.xlsx', '.xlsb')):
         return extract_text.extract_text_from_file(file_path)
     elif file_path.endswith(('.jpg', '.jpeg', '.png')):
         return extract_image_text(file_path)
     else:
         return f"Unsupported file format: {file_path}"
 
-# Wrapper function to process a single file for use with ThreadPoolExecutor
-def process_single_file(file_path):
-    text = fetch_invoice_text(file_path)
+def build_result(file_path, text, tier):
     if text:
-        return {'file': file_path, 'text': text}
+        return {'file': file_path, 'text': text, 'tier': tier}
     else:
-        return {'file': file_path, 'text': 'Error: Unsupported file format or empty content.'}
+        return {'file': file_path, 'text': 'Error: Unsupported file format or empty content.', 'tier': tier}
+
+# Wrapper function to process a single file for use with ThreadPoolExecutor
+def process_single_file(file_path):
+    return build_result(file_path, fetch_invoice_text(file_path), 'parser')
 
-# Process multiple files in parallel
+# Process multiple files in parallel; images are OCR'd as one batch on the OCR worker pool
+# while the other files are parsed, and their vision escalations run concurrently
 def process_multiple_files(file_paths):
+    image_paths = [path for path in file_paths if path.endswith(('.jpg', '.jpeg', '.png'))]
+    other_paths = [path for path in file_paths if path not in image_paths]
+
+    results = {}
     with ThreadPoolExecutor() as executor:
-        results = list(executor.map(process_single_file, file_paths))
-    return results
+        others = executor.map(process_single_file, other_paths)
+        if image_paths:
+            for path, result in zip(image_paths, extract_images_text_tiered(image_paths)):
+                results[path] = build_result(path, result['text'], result['tier'])
+        for path, result in zip(other_paths, others):
+            results[path] = result
+    return [results[path] for path in file_paths]
 
 # Save uploaded files to a directory
 def save_uploaded_files(uploaded_files, destination_dir):
@@ -77,6 +89,7 @@ def main():
 
             # Display extracted text and file viewers
             st.success("Files processed successfully!")
+            st.caption(f"Images escalated to the vision model: {escalation_rate():.0%}")
             for entry in extracted_texts:
                 file_name = os.path.basename(entry['file'])
 
@@ -85,7 +98,7 @@ def main():
 
                 with col1:
                     st.write(f"**File:** {file_name}")
-                    if file_name.endswith(('.jpg', '.jpeg', '.png', '.tiff')):
+                    if file_name.endswith(('.jpg', '.jpeg', '.png', '.tiff', '.tif')):
                         # Display image
                         st.image(entry['file'], caption=file_name, use_column_width=True)
                         if st.button(f"Enlarge {file_name}"):
@@ -111,6 +124,7 @@ def main():
                 with col2:
                     # Display extracted text
                     st.text_area("Extracted Text", entry["text"], height=400, key=file_name)
+                    st.caption(f"Extracted by: {entry['tier']}")
 
                 st.markdown("---")  # Separator for better UI
         else:
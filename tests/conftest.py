@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Shared modules (`External.*`) are imported from the repository root.
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if _REPO_ROOT not in sys.path:
+    sys.path.insert(0, _REPO_ROOT)
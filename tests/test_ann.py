@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pytest
+
+from External import numpy_store
+from External.ann import INDEX_FILE, IVFFlatIndex
+from External.numpy_store import NumpyVectorStore, normalize
+
+
+def clustered(count, width=16, clusters=8, seed=0):
+    """Unit vectors around `clusters` random centres."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, width))
+    labels = rng.integers(clusters, size=count)
+    return normalize(centres[labels] + 0.1 * rng.normal(size=(count, width)))
+
+
+def test_every_row_is_a_candidate_for_itself():
+    data = clustered(400)
+    index = IVFFlatIndex.train(data, n_lists=8)
+
+    assert len(index) == 400
+    assert all(row in index.candidates(data[row], nprobe=1) for row in range(0, 400, 7))
+    rows, scores = index.search(data, data[10], top_k=3, nprobe=2)
+    assert rows[0] == 10
+    assert scores[0] == pytest.approx(1.0, abs=1e-5)
+    assert list(scores) == sorted(scores, reverse=True)
+
+
+def test_probing_every_list_is_exact():
+    data = clustered(300)
+    index = IVFFlatIndex.train(data, n_lists=6)
+    query = data[5] + data[200]
+
+    rows, _ = index.search(data, normalize(query), top_k=5, nprobe=6)
+
+    assert list(rows) == list(np.argsort(-(data @ normalize(query)))[:5])
+
+
+def test_add_remove_and_reload(tmp_path):
+    data = clustered(300)
+    index = IVFFlatIndex.train(data[:200], n_lists=6)
+    index.add(data[200:])
+    keep = np.ones(300, dtype=bool)
+    keep[:50] = False
+    index.remove(keep)
+    path = str(tmp_path / INDEX_FILE)
+    index.save(path)
+
+    loaded = IVFFlatIndex.load(path)
+
+    assert len(loaded) == 250 and loaded.trained_size == 200
+    assert np.array_equal(loaded.assignments, index.assign(data[50:]))
+    assert not loaded.needs_retrain()
+
+
+def test_store_builds_the_index_once_large_enough(tmp_path, monkeypatch):
+    monkeypatch.setattr(numpy_store, "ANN_MIN_VECTORS", 100)
+    dataset = str(tmp_path / "store")
+    data = clustered(300)
+    ids = [f"n{index}" for index in range(300)]
+    store = NumpyVectorStore(dataset, ann=True)
+
+    store.add_vectors(ids[:50], ids[:50], data[:50])
+    store.wait_for_index()
+    assert store.index is None
+
+    store.add_vectors(ids[50:], ids[50:], data[50:])
+    store.wait_for_index()
+    assert len(store.index) == 300
+    assert os.path.exists(os.path.join(dataset, INDEX_FILE))
+
+    store.delete_nodes(["n0", "n1"])
+    reopened = NumpyVectorStore(dataset)
+    assert len(reopened.index) == len(reopened) == 298
+    rows, scores = reopened.search(data[120], top_k=1)
+    assert reopened.records[rows[0]]["id"] == "n120"
+    assert scores[0] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_a_stale_index_is_ignored(tmp_path):
+    dataset = str(tmp_path / "store")
+    data = clustered(60)
+    store = NumpyVectorStore(dataset)
+    store.add_vectors([f"n{index}" for index in range(60)], ["text"] * 60, data)
+    IVFFlatIndex.train(data[:40], n_lists=4).save(os.path.join(dataset, INDEX_FILE))
+
+    reopened = NumpyVectorStore(dataset)
+
+    assert reopened.index is None
+    assert reopened.records[reopened.search(data[50], top_k=1)[0][0]]["id"] == "n50"
@@ -0,0 +1,104 @@
+import base64
+
+import pytest
+
+from External.chunking import (
+    BPETokenCounter,
+    ChunkTable,
+    HeuristicTokenCounter,
+    StreamingChunker,
+    TokenChunker,
+    chunk_spans,
+)
+
+
+def windows(text, chunk_size, overlap):
+    return [text[start:end] for start, end in chunk_spans(len(text), chunk_size, overlap)]
+
+
+def test_chunks_are_offsets_into_one_buffer():
+    table = ChunkTable.from_pages(["first page", "second page", "third"]).chunk(chunk_size=8, overlap=2)
+
+    assert list(table) == windows("first page second page third", 8, 2)
+    assert table[1] == table.text[table.starts[1]:table.ends[1]]
+    assert [table.span(index)[2] for index in range(len(table))] == [0, 0, 1, 1, 2]
+    assert table[-2:] == list(table)[-2:]
+
+
+def test_rechunking_returns_a_view_over_the_same_text():
+    table = ChunkTable.from_pages(["abcdefghij" * 3]).chunk(chunk_size=10, overlap=0)
+    smaller = table.rechunk(chunk_size=4, overlap=1)
+
+    assert smaller.text is table.text
+    assert list(smaller) == [piece for chunk in table for piece in windows(chunk, 4, 1)]
+
+
+@pytest.mark.parametrize("pages", [["a" * 25], ["one two ", "three four five", "", "six seven eight nine ten"]])
+def test_streamed_chunks_match_chunking_the_whole_text(pages):
+    text = " ".join(pages)
+    with StreamingChunker(chunk_size=7, overlap=3) as chunker:
+        streamed = [chunk for page in pages for chunk in chunker.feed(page)]
+        streamed += chunker.finish()
+        table = chunker.load_table()
+
+    assert streamed == windows(text, 7, 3)
+    assert len(chunker) == len(streamed)
+    assert table.text == text and list(table) == streamed
+    assert table.pages[-1] == table.page_at(len(text) - 1)
+
+
+def test_the_table_is_only_available_once_the_stream_is_finished():
+    with StreamingChunker(chunk_size=5, overlap=1) as chunker:
+        chunker.feed("some text")
+        with pytest.raises(RuntimeError):
+            chunker.load_table()
+
+
+def test_token_chunks_stay_within_budget_and_end_at_sentences():
+    counter = HeuristicTokenCounter()
+    sentences = [f"Sentence number {index} has a few words in it." for index in range(40)]
+    chunker = TokenChunker(max_tokens=40, overlap_tokens=15, counter=counter)
+    table = chunker.chunk(" ".join(sentences))
+
+    assert len(table) > 1
+    assert all(counter.count(chunk) <= 40 for chunk in table)
+    assert all(chunk.endswith(".") for chunk in table)
+    assert list(table.token_counts) == [counter.count(chunk) for chunk in table]
+    # Consecutive chunks share whole trailing sentences.
+    assert all(table.starts[index + 1] < table.ends[index] for index in range(len(table) - 1))
+
+
+def test_paragraph_breaks_close_half_full_chunks():
+    counter = HeuristicTokenCounter()
+    first = "Alpha beta gamma delta epsilon zeta eta theta. " * 5
+    text = first + "\n\nA new paragraph starts here."
+    table = TokenChunker(max_tokens=100, overlap_tokens=0, counter=counter).chunk(text)
+
+    assert list(table) == [first.strip(), "A new paragraph starts here."]
+
+
+def test_words_longer_than_the_budget_are_split():
+    counter = HeuristicTokenCounter()
+    table = TokenChunker(max_tokens=8, overlap_tokens=0, counter=counter).chunk("x" * 100)
+
+    assert "".join(table) == "x" * 100
+    assert all(tokens <= 8 for tokens in table.token_counts)
+
+
+def test_streamed_blocks_give_the_same_chunks_as_the_whole_text():
+    counter = HeuristicTokenCounter()
+    blocks = [f"Block {index} opens. It has two sentences.\n\n" for index in range(30)]
+    chunker = TokenChunker(max_tokens=30, overlap_tokens=8, counter=counter)
+
+    assert [chunk for chunk, _ in chunker.iter_blocks(blocks)] == list(chunker.chunk("".join(blocks)))
+
+
+def test_bpe_counter_merges_by_rank(tmp_path):
+    vocabulary = [b"h", b"e", b"l", b"o", b" ", b"he", b"ll", b"hell", b"hello"]
+    path = tmp_path / "tiny.tiktoken"
+    path.write_bytes(b"".join(base64.b64encode(token) + b" %d\n" % rank for rank, token in enumerate(vocabulary)))
+    counter = BPETokenCounter.from_file(str(path))
+
+    assert counter.count("hello") == 1
+    assert counter.count("hell") == 1
+    assert counter.count("olleh") == 4
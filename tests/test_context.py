@@ -0,0 +1,41 @@
+from External.chunking import HeuristicTokenCounter
+from External.context import ContextPacker
+
+SHARED = "the overlap between two neighbouring chunks is repeated here."
+
+
+def packer(**kwargs):
+    return ContextPacker(counter=HeuristicTokenCounter(), **kwargs)
+
+
+def test_overlapping_chunks_of_one_source_are_merged():
+    first = "Intro sentence. " + SHARED
+    second = SHARED + " And the text continues after it."
+    text, report = packer().pack([first, second], [0.8, 0.9], ["a.pdf", "a.pdf"])
+
+    assert text == "Intro sentence. " + SHARED + " And the text continues after it."
+    assert report["merged"] == 1
+
+
+def test_chunks_of_different_sources_are_not_merged():
+    first = "Intro sentence. " + SHARED
+    second = SHARED + " And the text continues after it."
+    _, report = packer().pack([first, second], [0.8, 0.9], ["a.pdf", "b.pdf"])
+    assert report["merged"] == 0
+
+
+def test_near_duplicates_are_dropped_for_the_better_scored_passage():
+    text = "payment terms are thirty days from the invoice date for every order"
+    packed, report = packer().pack([text + " placed", text], [0.5, 0.9], ["a.pdf", "b.pdf"])
+    assert packed == text
+    assert report["passages"] == 1
+
+
+def test_budget_is_respected_by_cutting_at_sentence_ends():
+    long_text = " ".join(f"Sentence number {index} carries some words." for index in range(200))
+    counter = HeuristicTokenCounter()
+    packed, report = packer(max_tokens=150).pack([long_text])
+
+    assert report["tokens_out"] <= 150
+    assert counter.count(packed) <= 150
+    assert packed.endswith(".") and long_text.startswith(packed)
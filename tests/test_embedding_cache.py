@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from External.embedding_cache import EmbeddingCache, model_identity
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+
+
+def test_vectors_round_trip_as_float32(cache):
+    cache.set_many("model", 3, ["a", "b"], [[0.5, -1.0, 2.0], [1.0, 0.0, 0.25]])
+
+    assert cache.get_many("model", 3, ["b", "missing", "a"]) == [
+        [1.0, 0.0, 0.25],
+        None,
+        [0.5, -1.0, 2.0],
+    ]
+    assert cache.stats["hits"] == 2
+    assert cache.stats["misses"] == 1
+    assert cache.hit_rate() == pytest.approx(2 / 3)
+
+
+def test_model_and_dimensions_are_part_of_the_key(cache):
+    cache.set("model", 3, "text", [1.0, 2.0, 3.0])
+
+    assert cache.get("other-model", 3, "text") is None
+    assert cache.get("model", 2, "text") is None
+    assert cache.get("model", 3, "text") == [1.0, 2.0, 3.0]
+
+
+def test_cache_persists_across_connections(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    EmbeddingCache(path).set("model", 2, "text", [1.0, 2.0])
+
+    assert EmbeddingCache(path).get("model", 2, "text") == [1.0, 2.0]
+
+
+def test_least_recently_used_rows_are_evicted(tmp_path):
+    # Each vector is 4 float32 values, 16 bytes; room for three of them.
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"), max_bytes=48)
+    for text in ["a", "b", "c"]:
+        cache.set("model", 4, text, [1.0] * 4)
+    cache.get("model", 4, "a")
+
+    cache.set("model", 4, "d", [2.0] * 4)
+
+    assert cache.get_many("model", 4, ["a", "b", "c", "d"])[1] is None
+    assert cache.get("model", 4, "a") is not None
+    assert cache.get("model", 4, "d") == [2.0] * 4
+    assert cache.size_bytes() <= 48
+
+
+def test_lookups_larger_than_one_statement(cache):
+    texts = [f"text {index}" for index in range(1200)]
+    cache.set_many("model", 1, texts, [[float(index)] for index in range(1200)])
+
+    vectors = cache.get_many("model", 1, texts)
+
+    assert vectors == [[float(index)] for index in range(1200)]
+
+
+def test_concurrent_writers_share_one_connection(cache):
+    def write(worker):
+        for index in range(50):
+            cache.set("model", 1, f"{worker}-{index}", [float(index)])
+
+    threads = [threading.Thread(target=write, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.get("model", 1, "3-49") == [49.0]
+    assert cache.size_bytes() == 4 * 50 * 4
+
+
+def test_model_identity_reads_name_and_dimensions():
+    class Model:
+        model_name = "text-embedding-3-small"
+        dimensions = 256
+
+    assert model_identity(Model()) == ("text-embedding-3-small", 256)
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+
+from External.embedding_cache import EmbeddingCache
+from External.embedding_service import EmbeddingService
+
+
+class FakeEmbeddingModel:
+    """Embeds a text as [len(text), index of its first character]; records every request."""
+
+    model_name = "fake-embedding"
+    dimensions = 2
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _vectors(self, texts):
+        return [[float(len(text)), float(ord(text[0]))] for text in texts]
+
+    def _get_text_embeddings(self, texts):
+        with self._lock:
+            self.requests.append(list(texts))
+        return self._vectors(texts)
+
+    async def _aget_text_embeddings(self, texts):
+        self.requests.append(list(texts))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        return self._vectors(texts)
+
+    def get_query_embedding(self, query):
+        with self._lock:
+            self.requests.append([query])
+        return self._vectors([query])[0]
+
+
+def make_service(model, **kwargs):
+    return EmbeddingService(model, use_cache=False, **kwargs)
+
+
+def test_batches_respect_token_and_size_limits():
+    service = make_service(FakeEmbeddingModel(), max_batch_tokens=10, max_batch_size=3)
+
+    batches = service.plan_batches(["t"] * 7, token_counts=[4, 4, 4, 1, 1, 1, 12])
+
+    assert batches == [(0, 2), (2, 5), (5, 6), (6, 7)]
+    assert service.stats["requests"] == 4
+    assert service.stats["tokens"] == 27
+
+
+def test_embed_returns_vectors_in_input_order():
+    model = FakeEmbeddingModel()
+    service = make_service(model, max_batch_tokens=100, max_batch_size=2, max_concurrency=3)
+    texts = [chr(ord("a") + index) * (index + 1) for index in range(7)]
+
+    vectors = service.embed(texts, token_counts=[1] * len(texts))
+
+    assert vectors == [[float(len(text)), float(ord(text[0]))] for text in texts]
+    assert sorted(len(request) for request in model.requests) == [1, 2, 2, 2]
+
+
+def test_aembed_bounds_concurrent_requests():
+    model = FakeEmbeddingModel(delay=0.01)
+    service = make_service(model, max_batch_tokens=100, max_batch_size=1, max_concurrency=2)
+    texts = [f"text {index}" for index in range(6)]
+
+    vectors = asyncio.run(service.aembed(texts, token_counts=[1] * len(texts)))
+
+    assert vectors == [[6.0, float(ord("t"))]] * 6
+    assert len(model.requests) == 6
+    assert model.max_in_flight == 2
+
+
+def test_empty_input_sends_nothing():
+    model = FakeEmbeddingModel()
+    service = make_service(model)
+
+    assert service.embed([]) == []
+    assert asyncio.run(service.aembed([])) == []
+    assert model.requests == []
+
+
+def test_cached_texts_are_not_sent_again(tmp_path):
+    model = FakeEmbeddingModel()
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    service = EmbeddingService(model, max_batch_size=10, cache=cache)
+
+    first = service.embed(["alpha", "beta"])
+    model.requests.clear()
+    second = service.embed(["beta", "gamma", "alpha"])
+
+    assert model.requests == [["gamma"]]
+    assert second == [first[1], [5.0, float(ord("g"))], first[0]]
+    assert cache.stats["hits"] == 2
+
+
+def test_query_embeddings_are_cached_apart_from_documents(tmp_path):
+    model = FakeEmbeddingModel()
+    service = EmbeddingService(model, cache=EmbeddingCache(str(tmp_path / "embeddings.sqlite3")))
+
+    service.embed(["question"])
+    service.embed_query("question")
+    service.embed_query("question")
+
+    assert model.requests == [["question"], ["question"]]
@@ -0,0 +1,306 @@
+import asyncio
+import inspect
+import os
+import shutil
+from collections import Counter
+from concurrent.futures import Future
+
+import pytest
+from PIL import Image
+from openpyxl import Workbook
+
+# The extractor imports every format's reader up front.
+for _module in ("docx2txt", "bs4", "striprtf", "pdfplumber", "pyxlsb", "pytesseract"):
+    pytest.importorskip(_module)
+
+from External import extract_text, ocr_pool  # noqa: E402
+from External.extract_text import ExtractionCache, FileTextExtractor  # noqa: E402
+from External.ocr_pool import use_inline_ocr  # noqa: E402
+from External.pipeline import Stage, StagedPipeline  # noqa: E402
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def count_calls(monkeypatch, extension, processors=FileTextExtractor.FILE_PROCESSORS):
+    """Wrap the processor of `extension` so the test sees every real extraction."""
+    calls = []
+    processor = processors[extension]
+
+    def counted(self, path):
+        calls.append(path)
+        return processor(self, path)
+
+    def counted_blocks(self, path):
+        # Streaming processors count when read, not when the generator is made.
+        calls.append(path)
+        yield from processor(self, path)
+
+    monkeypatch.setitem(processors, extension, counted_blocks if inspect.isgeneratorfunction(processor) else counted)
+    return calls
+
+
+def test_cached_text_is_reused_until_the_file_changes(tmp_path, monkeypatch):
+    calls = count_calls(monkeypatch, ".txt")
+    extractor = FileTextExtractor(cache=ExtractionCache(str(tmp_path / "cache")))
+    path = write(tmp_path / "a.txt", "first version")
+
+    assert extractor.extract_text_from_file(path) == "first version"
+    assert extractor.extract_text_from_file(path) == "first version"
+    copy = shutil.copy(path, tmp_path / "copy.txt")
+    assert extractor.extract_text_from_file(copy) == "first version"
+    assert len(calls) == 1
+
+    write(tmp_path / "a.txt", "second version")
+    assert extractor.extract_text_from_file(path) == "second version"
+    assert len(calls) == 2
+
+
+def test_changed_extraction_settings_miss_the_cache(tmp_path, monkeypatch):
+    calls = count_calls(monkeypatch, ".csv")
+    extractor = FileTextExtractor(cache=ExtractionCache(str(tmp_path / "cache")))
+    path = write(tmp_path / "rows.csv", "id,name\n1,one\n")
+
+    tsv = extractor.extract_text_from_file(path)
+    monkeypatch.setattr(extract_text, "TABULAR_FORMAT", "markdown")
+    markdown = extractor.extract_text_from_file(path)
+    monkeypatch.setattr(extract_text, "OCR_LANGUAGE", "deu")
+    extractor.extract_text_from_file(path)
+
+    assert "|" in markdown and "|" not in tsv
+    assert len(calls) == 3
+
+
+def test_extraction_without_cache_always_reads_the_file(tmp_path, monkeypatch):
+    calls = count_calls(monkeypatch, ".txt")
+    extractor = FileTextExtractor(use_cache=False)
+    path = write(tmp_path / "a.txt", "text")
+
+    extractor.extract_text_from_file(path)
+    extractor.extract_text_from_file(path)
+    assert len(calls) == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ExtractionCache(str(tmp_path), max_bytes=10)
+    cache.set("old", "x" * 6)
+    os.utime(tmp_path / "old.txt", (1, 1))
+    cache.set("new", "y" * 6)
+
+    assert cache.get("old") is None
+    assert cache.get("new") == "y" * 6
+
+
+def test_unsupported_files_are_refused(tmp_path):
+    with pytest.raises(extract_text.UnsupportedFileTypeError):
+        FileTextExtractor(use_cache=False).extract_text_from_file(write(tmp_path / "a.xyz", "?"))
+
+
+class FakePage:
+    """The parts of a pdfplumber page the classifier reads."""
+
+    width, height = 100, 100
+
+    def __init__(self, text, image_box=None):
+        self.text = text
+        x0, top, x1, bottom = image_box or (0, 0, 0, 0)
+        self.images = [{"x0": x0, "top": top, "x1": x1, "bottom": bottom}] if image_box else []
+
+    def extract_text(self):
+        return self.text
+
+
+class FakePDF:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def test_only_image_only_pages_are_ocred(monkeypatch):
+    text_page = FakePage("A page with a perfectly good text layer.", image_box=(0, 0, 100, 100))
+    scanned_page = FakePage("", image_box=(0, 0, 100, 80))
+    blank_page = FakePage("", image_box=(0, 0, 5, 5))
+    monkeypatch.setattr(extract_text.pdfplumber, "open", lambda path: FakePDF([text_page, scanned_page, blank_page]))
+    ocred = []
+    monkeypatch.setattr(FileTextExtractor, "ocr_pdf_page", lambda self, page: ocred.append(page) or "scanned text")
+
+    text = FileTextExtractor(use_cache=False).process_pdf_file("document.pdf")
+    assert ocred == [scanned_page]
+    assert text == "A page with a perfectly good text layer.\n\nscanned text\n\n"
+    assert FileTextExtractor(use_cache=False).classify_pdf_page(scanned_page)["image_coverage"] == pytest.approx(0.8)
+
+
+class LazyFuture(Future):
+    """A future whose OCR runs when its result is first asked for."""
+
+    def __init__(self, pool, text):
+        super().__init__()
+        self.pool, self.text = pool, text
+
+    def result(self, timeout=None):
+        if not self.done():
+            self.pool.in_flight -= 1
+            self.set_result(self.text)
+        return super().result(timeout)
+
+
+class FakeOCRPool:
+    """Reads a frame's grey level as its text and tracks how many frames are queued at once."""
+
+    max_workers = 2
+
+    def __init__(self):
+        self.in_flight = self.most_in_flight = 0
+
+    def submit_image_to_string(self, image, preprocessor=None):
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        return LazyFuture(self, f" frame {image.convert('L').getpixel((0, 0))} ")
+
+
+def write_tiff(path, levels):
+    frames = [Image.new("L", (16, 16), level) for level in levels]
+    frames[0].save(path, save_all=True, append_images=frames[1:])
+    return str(path)
+
+
+def test_every_tiff_frame_is_read_in_order(tmp_path, monkeypatch):
+    pool = FakeOCRPool()
+    monkeypatch.setattr(extract_text, "get_ocr_pool", lambda: pool)
+    levels = [10, 20, 30, 40, 50, 60, 70]
+    path = write_tiff(tmp_path / "fax.tiff", levels)
+
+    text = FileTextExtractor(use_cache=False).extract_text_from_file(path)
+    assert text.split("\f") == [f"frame {level}" for level in levels]
+    assert pool.most_in_flight <= extract_text.TIFF_FRAMES_IN_FLIGHT_PER_WORKER * pool.max_workers
+
+
+def tiff_page_pids(path):
+    """Text of each TIFF frame, OCR'd by the (fake) engine of the extraction worker."""
+    return FileTextExtractor(use_cache=False).extract_text_from_file(path).split("\f"), os.getpid()
+
+
+def test_tiffs_are_ocred_inline_in_extraction_workers(tmp_path, monkeypatch):
+    # Workers are forked after this, so they inherit the fake engine.
+    monkeypatch.setattr(ocr_pool.pytesseract, "image_to_string", lambda image, lang="eng": str(os.getpid()))
+    monkeypatch.setattr(ocr_pool, "tesserocr", None)
+    paths = [write_tiff(tmp_path / f"fax{index}.tiff", [10, 20, 30, 40, 50]) for index in range(3)]
+    pipeline = StagedPipeline([Stage("extract", tiff_page_pids, workers=2, mode="process", initializer=use_inline_ocr)])
+
+    results = asyncio.run(pipeline.run(paths))
+
+    assert len(results) == 3 and pipeline.report()[0]["errors"] == 0
+    # Each worker OCRs its own frames instead of handing them to a nested pool.
+    assert all(pages == [str(pid)] * 5 for pages, pid in results)
+    assert os.getpid() not in {pid for _, pid in results}
+
+
+def write_workbook(path, sheets):
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for title, rows in sheets.items():
+        sheet = workbook.create_sheet(title)
+        for row in rows:
+            sheet.append(row)
+    workbook.save(path)
+    return str(path)
+
+
+def test_every_sheet_is_streamed_in_blocks_with_its_header(tmp_path, monkeypatch):
+    monkeypatch.setattr(extract_text, "SPREADSHEET_ROWS_PER_BLOCK", 3)
+    path = write_workbook(
+        tmp_path / "book.xlsx",
+        {
+            "Orders": [["order", "amount"]] + [[f"A{index}", index] for index in range(7)],
+            "Notes": [["note"], ["call back"]],
+        },
+    )
+    extractor = FileTextExtractor(use_cache=False)
+    blocks = list(extractor.iter_excel_blocks(path))
+
+    assert [block.splitlines()[0] for block in blocks] == ["Sheet: Orders"] * 3 + ["Sheet: Notes"]
+    assert all("order" in block.splitlines()[1] for block in blocks[:3])
+    assert all(f"A{index}" in "".join(blocks) for index in range(7))
+    assert "call back" in blocks[-1]
+    assert "".join(extractor.iter_text_blocks_from_file(path)) == extractor.extract_text_from_file(path)
+
+
+def test_csv_is_read_in_row_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(extract_text, "SPREADSHEET_ROWS_PER_BLOCK", 4)
+    path = write(tmp_path / "rows.csv", "id,name\n" + "".join(f"{index},item {index}\n" for index in range(10)))
+    blocks = list(FileTextExtractor(use_cache=False).iter_csv_blocks(path))
+
+    assert len(blocks) == 3
+    assert all(block.splitlines()[0].split() == ["id", "name"] for block in blocks)
+    assert "item 9" in blocks[-1]
+
+
+def test_streamed_text_is_cached_and_streamed_back(tmp_path, monkeypatch):
+    calls = count_calls(monkeypatch, ".csv", FileTextExtractor.STREAMING_PROCESSORS)
+    monkeypatch.setattr(extract_text, "SPREADSHEET_ROWS_PER_BLOCK", 2)
+    path = write(tmp_path / "rows.csv", "id\n1\n2\n3\n")
+    extractor = FileTextExtractor(cache=ExtractionCache(str(tmp_path / "cache")))
+
+    first = "".join(extractor.iter_text_blocks_from_file(path))
+    assert "".join(extractor.iter_text_blocks_from_file(path)) == first
+    assert extractor.extract_text_from_file(path) == first
+    assert len(calls) == 1
+
+
+def test_spreadsheets_are_left_in_the_cache_for_the_ingest_to_stream(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    monkeypatch.setattr(ExtractionCache.__init__, "__defaults__", (cache_dir, extract_text.EXTRACTION_CACHE_MAX_BYTES))
+    monkeypatch.setattr(extract_text, "SPREADSHEET_ROWS_PER_BLOCK", 2)
+    monkeypatch.setattr(extract_text, "TABULAR_STATS_SAMPLE", 1)
+    monkeypatch.setattr(extract_text, "TABULAR_STATS", Counter())
+    calls = count_calls(monkeypatch, ".csv", FileTextExtractor.STREAMING_PROCESSORS)
+    path = write(tmp_path / "rows.csv", "id,name\n" + "".join(f"{index},item {index}\n" for index in range(5)))
+
+    _, tabular, blocks, stats = extract_text.extract_file_blocks(path)
+    chunks = list(FileTextExtractor().iter_table_chunks(path))
+
+    assert (tabular, blocks) == (True, None)
+    # The worker's share of the stats goes back to the parent.
+    assert stats["sampled_blocks"] and stats == dict(extract_text.TABULAR_STATS)
+    assert len(chunks) == 3 and all(chunk.splitlines()[0].split() == ["id", "name"] for chunk in chunks)
+    assert len(calls) == 1
+
+
+def test_rows_are_rendered_compactly():
+    header, rows = ("name", "qty", "note"), [("bolt", 3.0, None), ("nut | washer", 12, "a\tb")]
+
+    assert extract_text.render_table(header, rows, "tsv") == "name\tqty\tnote\nbolt\t3\t\nnut | washer\t12\ta b"
+    assert extract_text.render_table(header, rows, "markdown").splitlines() == [
+        "| name | qty | note |",
+        "|---|---|---|",
+        "| bolt | 3 |  |",
+        "| nut \\| washer | 12 | a b |",
+    ]
+
+
+def test_sampled_blocks_measure_the_savings(monkeypatch):
+    monkeypatch.setattr(extract_text, "TABULAR_STATS_SAMPLE", 1)
+    monkeypatch.setattr(extract_text, "TABULAR_STATS", Counter())
+    header = ("description", "amount")
+    rows = [("short", 1), ("a much longer description of the item", 12345)] * 5
+    extract_text.render_table(header, rows)
+    savings = extract_text.tabular_savings()
+
+    assert extract_text.TABULAR_STATS["sampled_blocks"] == 1
+    assert savings["chars_saved"] > 0 and 0 < savings["char_reduction"] < 1
+
+
+def test_long_blocks_are_closed_at_the_character_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(extract_text, "SPREADSHEET_BLOCK_CHARS", 200)
+    path = write(tmp_path / "rows.csv", "id,text\n" + "".join(f"{index},{'word ' * 10}\n" for index in range(20)))
+    blocks = list(FileTextExtractor(use_cache=False).iter_csv_blocks(path))
+
+    assert len(blocks) > 1
+    assert all(len(block) <= 200 and block.startswith("id\ttext\n") for block in blocks)
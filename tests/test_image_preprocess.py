@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from External.image_preprocess import ImagePreprocessor
+
+
+def save_image(path, image, **kwargs):
+    image.save(path, **kwargs)
+    return str(path)
+
+
+def striped_page(angle=0.0):
+    """A white page with dark text-like lines, optionally rotated."""
+    page = Image.new("L", (600, 600), 255)
+    draw = ImageDraw.Draw(page)
+    for top in range(60, 540, 30):
+        draw.rectangle((60, top, 540, top + 8), fill=0)
+    return page.rotate(angle, expand=False, fillcolor=255) if angle else page
+
+
+def test_large_colour_scans_are_shrunk_to_grayscale_png(tmp_path):
+    noise = np.random.default_rng(0).integers(0, 256, size=(1200, 1600, 3), dtype=np.uint8)
+    path = save_image(tmp_path / "scan.bmp", Image.fromarray(noise))
+    preprocessor = ImagePreprocessor(max_long_edge=800, grayscale=True, cache_dir=str(tmp_path / "cache"))
+
+    output_path, stats = preprocessor.preprocess(path)
+    with Image.open(output_path) as output:
+        assert output.mode == "L" and output.size == (800, 600)
+    assert os.path.dirname(output_path) == str(tmp_path / "cache")
+    assert output_path.endswith(".png")
+    assert stats["pixels_saved"] == 1600 * 1200 - 800 * 600
+    assert stats["bytes_saved"] > 0
+
+
+def test_results_are_cached_by_content_and_settings(tmp_path):
+    path = save_image(tmp_path / "a.png", striped_page())
+    copy = save_image(tmp_path / "b.png", striped_page())
+    cache_dir = str(tmp_path / "cache")
+    preprocessor = ImagePreprocessor(max_long_edge=300, cache_dir=cache_dir)
+
+    first, _ = preprocessor.preprocess(path)
+    written = os.stat(first).st_mtime_ns
+    assert preprocessor.preprocess(copy)[0] == first
+    assert os.stat(first).st_mtime_ns >= written and len(os.listdir(cache_dir)) == 1
+    assert ImagePreprocessor(max_long_edge=200, cache_dir=cache_dir).preprocess(path)[0] != first
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_colour_output_is_saved_as_jpeg(tmp_path):
+    path = save_image(tmp_path / "photo.png", Image.new("RGB", (64, 48), (200, 30, 30)))
+    output_path, _ = ImagePreprocessor(grayscale=False, cache_dir=str(tmp_path / "cache")).preprocess(path)
+    with Image.open(output_path) as output:
+        assert output.format == "JPEG" and output.mode == "RGB"
+
+
+def test_deskew_finds_the_rotation_of_a_tilted_page():
+    preprocessor = ImagePreprocessor(deskew=True, max_skew_angle=5.0, skew_angle_step=0.5)
+    assert preprocessor._skew_angle(striped_page(3.0)) == -3.0
+    assert preprocessor._skew_angle(striped_page()) == 0.0
+
+
+def test_binarized_output_is_black_and_white():
+    gradient = Image.fromarray(np.tile(np.arange(256, dtype=np.uint8), (32, 1)))
+    pixels = np.asarray(ImagePreprocessor(binarize=True).process_image(gradient))
+    assert set(np.unique(pixels).tolist()) == {0, 255}
+
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    paths = [save_image(tmp_path / f"{level}.png", Image.new("L", (64, 64), level)) for level in (10, 20, 30)]
+    preprocessor = ImagePreprocessor(cache_dir=cache_dir)
+    first, _ = preprocessor.preprocess(paths[0])
+    preprocessor.max_bytes = os.path.getsize(first) * 3 // 2
+
+    for path in paths[1:]:
+        last, _ = preprocessor.preprocess(path)
+    assert os.listdir(cache_dir) == [os.path.basename(last)]
@@ -0,0 +1,65 @@
+import os
+
+from External.keyword_index import KeywordIndex, is_keyword_query, keyword_index_paths, tokenize
+
+
+def ids(hits):
+    return [node_id for node_id, _, _ in hits]
+
+
+def test_tokenize_keeps_codes_whole_and_by_part():
+    terms = tokenize("Invoice INV-2024-0042 is due")
+    assert "inv-2024-0042" in terms
+    assert {"inv", "2024", "0042", "invoice", "due"} <= set(terms)
+    assert "is" not in terms
+
+
+def test_is_keyword_query():
+    assert is_keyword_query("INV-2024-0042")
+    assert is_keyword_query('"termination for convenience"')
+    assert not is_keyword_query("how do I reset my password")
+
+
+def test_search_ranks_rarer_and_denser_matches_first(tmp_path):
+    index = KeywordIndex(str(tmp_path / "dataset"))
+    index.add(
+        ["a", "b", "c"],
+        ["invoice INV-2024-0042 paid", "invoice overdue invoice", "shipping address"],
+    )
+    assert ids(index.search("INV-2024-0042")) == ["a"]
+    assert ids(index.search("invoice")) == ["b", "a"]
+    assert index.search("nothing matches") == []
+
+
+def test_changes_survive_reopen_and_compaction(tmp_path):
+    dataset = str(tmp_path / "dataset")
+    index = KeywordIndex(dataset)
+    index.add(["a", "b"], ["alpha beta", "gamma"])
+    index.compact()
+    index.add(["c"], ["alpha delta"])
+    index.remove(["b"])
+    index.add(["a"], ["epsilon"])
+    index.save()
+
+    snapshot_path, log_path = keyword_index_paths(dataset)
+    assert os.path.exists(snapshot_path) and os.path.exists(log_path)
+    reopened = KeywordIndex(dataset)
+    assert len(reopened) == 2
+    assert ids(reopened.search("alpha")) == ["c"]
+    assert ids(reopened.search("epsilon")) == ["a"]
+    assert reopened.search("gamma") == []
+
+    reopened.compact()
+    assert not os.path.exists(log_path)
+    compacted = KeywordIndex(dataset)
+    assert sorted(ids(compacted.search("alpha epsilon"))) == ["a", "c"]
+    assert compacted.search("alpha")[0][1] == "alpha delta"
+
+
+def test_clear_empties_the_index(tmp_path):
+    dataset = str(tmp_path / "dataset")
+    index = KeywordIndex(dataset)
+    index.add(["a"], ["alpha"])
+    index.save()
+    index.clear()
+    assert len(KeywordIndex(dataset)) == 0
@@ -0,0 +1,117 @@
+import pytest
+
+from External.manifest import IngestManifest
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def ingest(manifest, path, chunks):
+    """Record `path` the way the ingest paths do; returns what diff_chunks reported."""
+    [(_, digest)] = [item for item in manifest.pending([path]) if item[0] == path]
+    entries, new_indices, node_ids, stale = manifest.diff_chunks(path, chunks)
+    manifest.record(path, digest, entries)
+    manifest.save()
+    return new_indices, node_ids, stale
+
+
+def test_unchanged_files_are_skipped(tmp_path):
+    dataset = str(tmp_path / "dataset")
+    path = write(tmp_path / "a.txt", "alpha")
+    ingest(IngestManifest(dataset), path, ["alpha"])
+
+    manifest = IngestManifest(dataset)
+    assert manifest.exists()
+    assert manifest.pending([path, path]) == []
+    assert manifest.stats["files_unchanged"] == 1
+
+
+def test_changed_file_embeds_only_new_chunks(tmp_path):
+    dataset = str(tmp_path / "dataset")
+    path = write(tmp_path / "a.txt", "v1")
+    _, first_ids, _ = ingest(IngestManifest(dataset), path, ["keep", "drop"])
+
+    write(tmp_path / "a.txt", "v2")
+    manifest = IngestManifest(dataset)
+    new_indices, node_ids, stale = ingest(manifest, path, ["keep", "new"])
+
+    assert new_indices == [1]
+    assert len(node_ids) == 1 and node_ids[0] not in first_ids
+    assert stale == [first_ids[1]]
+    assert manifest.files[IngestManifest.source(path)]["chunks"][0] == [
+        manifest.files[IngestManifest.source(path)]["chunks"][0][0],
+        first_ids[0],
+    ]
+
+
+def test_chunks_can_be_diffed_in_batches(tmp_path):
+    dataset = str(tmp_path / "dataset")
+    path = write(tmp_path / "a.txt", "v1")
+    _, first_ids, _ = ingest(IngestManifest(dataset), path, ["a", "b", "c", "d"])
+
+    diff = IngestManifest(dataset).chunk_diff(path)
+    batches = [diff.add(["a", "x"]), diff.add(["c"]), diff.add(["y", "z"])]
+
+    assert [indices for indices, _ in batches] == [[1], [], [0, 1]]
+    assert sorted(diff.finish()) == sorted([first_ids[1], first_ids[3]])
+    assert [node_id for _, node_id in diff.entries][::2] == [first_ids[0], first_ids[2], batches[2][1][1]]
+
+
+def test_remove_missing_returns_node_ids(tmp_path):
+    dataset = str(tmp_path / "dataset")
+    kept = write(tmp_path / "a.txt", "a")
+    gone = write(tmp_path / "b.txt", "b")
+    manifest = IngestManifest(dataset)
+    ingest(manifest, kept, ["a"])
+    _, gone_ids, _ = ingest(manifest, gone, ["b1", "b2"])
+
+    assert sorted(manifest.remove_missing([kept])) == sorted(gone_ids)
+    assert list(manifest.files) == [IngestManifest.source(kept)]
+
+
+def test_config_change_forgets_the_manifest(tmp_path):
+    dataset = str(tmp_path / "dataset")
+    path = write(tmp_path / "a.txt", "a")
+    ingest(IngestManifest(dataset, config={"chunk_tokens": 500}), path, ["a"])
+
+    assert IngestManifest(dataset, config={"chunk_tokens": 500}).exists()
+    changed = IngestManifest(dataset, config={"chunk_tokens": 256})
+    assert changed.config_changed and not changed.exists()
+    assert changed.pending([path]) != []
+
+    changed.save()
+    assert IngestManifest(dataset, config={"chunk_tokens": 256}).exists()
+
+
+
+def test_reingesting_a_changed_file_leaves_no_orphan_nodes(tmp_path, monkeypatch):
+    pytest.importorskip("aih_rag")
+    from External import vector
+
+    monkeypatch.setattr(vector, "VECTOR_STORE_BACKEND", "numpy")
+    dataset = str(tmp_path / "dataset")
+    path = write(tmp_path / "a.txt", "v1")
+    manager = vector.DeepLakeManager(dataset)
+
+    def sync(chunks):
+        # The write stage of an incremental ingest, with the manager's own node ids.
+        manifest = IngestManifest(dataset)
+        [(_, digest)] = manifest.pending([path])
+        entries, new_indices, node_ids, stale = manifest.diff_chunks(path, chunks)
+        manager.delete_nodes(stale)
+        texts = [chunks[index] for index in new_indices]
+        vector.add_custom_nodes(manager, texts, [[1.0, float(len(text))] for text in texts], node_ids=node_ids)
+        manifest.record(path, digest, entries)
+        manifest.save()
+        return manifest
+
+    sync(["keep", "drop"])
+    write(tmp_path / "a.txt", "v2")
+    manifest = sync(["keep", "new"])
+
+    stored = [record["id"] for record in manager.vector_store.records]
+    assert sorted(stored) == sorted(node_id for _, node_id in manifest.files[IngestManifest.source(path)]["chunks"])
+    assert sorted(record["text"] for record in manager.vector_store.records) == ["keep", "new"]
+    assert {node_id for node_id, _, _ in manager.keywords.search("keep drop new")} == set(stored)
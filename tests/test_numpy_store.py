@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from External.numpy_store import NODES_FILE, STATE_FILE, NumpyVectorStore
+
+
+def vectors(count, width=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, width)).astype(np.float32)
+
+
+def fill(store, embeddings, start=0):
+    ids = [f"n{index}" for index in range(start, start + len(embeddings))]
+    store.add_vectors(ids, [f"text {node_id}" for node_id in ids], embeddings)
+    return ids
+
+
+@pytest.mark.parametrize("quantization", ["float32", "float16", "int8"])
+def test_add_delete_and_reopen(tmp_path, quantization):
+    dataset = str(tmp_path / "store")
+    embeddings = vectors(30)
+    store = NumpyVectorStore(dataset, quantization=quantization)
+    fill(store, embeddings[:10])
+    fill(store, embeddings[10:], start=10)
+    store.delete_nodes(["n3", "n20", "unknown"])
+
+    reopened = NumpyVectorStore(dataset)
+    assert reopened.quantization == quantization
+    assert len(reopened) == len(reopened.matrix) == 28
+    assert [record["id"] for record in reopened.records][:4] == ["n0", "n1", "n2", "n4"]
+    rows, scores = reopened.search(embeddings[21], top_k=1)
+    assert reopened.records[rows[0]]["id"] == "n21"
+    assert scores[0] == pytest.approx(1.0, abs=0.02)
+
+
+def test_uncommitted_append_is_ignored_and_overwritten(tmp_path):
+    dataset = str(tmp_path / "store")
+    store = NumpyVectorStore(dataset)
+    fill(store, vectors(5))
+    with open(os.path.join(dataset, NODES_FILE), "a", encoding="utf-8") as file:
+        file.write('{"id": "half-writ')
+
+    reopened = NumpyVectorStore(dataset)
+    assert len(reopened) == 5
+    fill(reopened, vectors(1, seed=1), start=5)
+    assert [record["id"] for record in NumpyVectorStore(dataset).records][-1] == "n5"
+
+
+def test_committed_delete_is_finished_after_a_crash(tmp_path):
+    dataset = str(tmp_path / "store")
+    embeddings = vectors(4)
+    store = NumpyVectorStore(dataset)
+    fill(store, embeddings)
+
+    # State of a delete of n0 that crashed after its commit, before the swap.
+    records = store.records[1:]
+    data = "".join(json.dumps(record) + "\n" for record in records)
+    with open(os.path.join(dataset, NODES_FILE + ".swap"), "w", encoding="utf-8") as file:
+        file.write(data)
+    np.save(os.path.join(dataset, "embeddings.npy.swap"), np.asarray(store.matrix)[1:])
+    with open(os.path.join(dataset, STATE_FILE), "w", encoding="utf-8") as file:
+        json.dump({"rows": 3, "nodes_bytes": len(data), "swap": ["embeddings.npy", NODES_FILE]}, file)
+
+    reader = NumpyVectorStore(dataset)
+    assert [record["id"] for record in reader.records] == ["n1", "n2", "n3"]
+    fill(reader, vectors(1, seed=1), start=4)
+    assert not os.path.exists(os.path.join(dataset, NODES_FILE + ".swap"))
+    assert [record["id"] for record in NumpyVectorStore(dataset).records] == ["n1", "n2", "n3", "n4"]
+
+
+def test_truncated_files_are_reported(tmp_path):
+    dataset = str(tmp_path / "store")
+    fill(NumpyVectorStore(dataset), vectors(3))
+    np.save(os.path.join(dataset, "embeddings.npy"), vectors(2))
+    with pytest.raises(ValueError, match="damaged"):
+        NumpyVectorStore(dataset)
+
+
+def test_longer_embeddings_are_cut_to_the_store_width(tmp_path):
+    store = NumpyVectorStore(str(tmp_path / "store"))
+    short = vectors(10, width=4)
+    fill(store, short)
+    longer = np.hstack([short, vectors(10, width=4, seed=1)])
+
+    fill(store, longer[:1], start=10)
+    rows, scores = store.search(longer[3], top_k=1)
+
+    assert store.dimensions == 4
+    assert store.records[rows[0]]["id"] == "n3"
+    assert scores[0] == pytest.approx(1.0, abs=1e-5)
+    assert store.search(longer[0], top_k=2)[1][1] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_shorter_embeddings_are_refused(tmp_path):
+    store = NumpyVectorStore(str(tmp_path / "store"))
+    fill(store, vectors(3, width=8))
+
+    with pytest.raises(ValueError, match="quantize_store --dimensions"):
+        store.search(vectors(1, width=4)[0])
+    with pytest.raises(ValueError):
+        fill(store, vectors(1, width=4), start=3)
+
+
+@pytest.mark.parametrize("quantization", ["float32", "int8"])
+def test_queries_are_consistent_while_another_thread_writes(tmp_path, quantization):
+    pytest.importorskip("aih_rag")
+    from aih_rag.vector_stores.types import VectorStoreQuery
+
+    store = NumpyVectorStore(str(tmp_path / "store"), quantization=quantization)
+    embeddings = vectors(60)
+    fill(store, embeddings[:20])
+    stop, errors = threading.Event(), []
+
+    def churn():
+        # Rows before n5's keep moving as nodes are deleted and re-added.
+        try:
+            while not stop.is_set():
+                fill(store, embeddings[20:60], start=20)
+                store.delete_nodes([f"n{index}" for index in range(20, 60)] + ["n0"])
+                fill(store, embeddings[:1])
+        except Exception as error:
+            errors.append(error)
+
+    writer = threading.Thread(target=churn)
+    writer.start()
+    try:
+        for _ in range(300):
+            result = store.query(VectorStoreQuery(query_embedding=embeddings[5].tolist(), similarity_top_k=2))
+            assert result.ids[0] == "n5"
+            assert result.similarities[0] == pytest.approx(1.0, abs=0.02)
+            assert np.dot(result.nodes[0].embedding, embeddings[5]) > 0
+    finally:
+        stop.set()
+        writer.join()
+    assert not errors
@@ -0,0 +1,80 @@
+import os
+from collections import Counter
+
+import pytest
+from PIL import Image
+
+pytest.importorskip("pytesseract")
+
+from External import image_preprocess, ocr_pool  # noqa: E402
+from External.image_preprocess import ImagePreprocessor  # noqa: E402
+from External.ocr_pool import OCRWorkerPool, get_ocr_pool  # noqa: E402
+
+
+def fake_image_to_string(image, lang="eng"):
+    """What the worker saw: mode, size, first pixel, language and its process id."""
+    return f"{image.mode}:{image.width}x{image.height}:{image.getpixel((0, 0))}:{lang}:{os.getpid()}"
+
+
+@pytest.fixture
+def fake_tesseract(monkeypatch):
+    # Workers are forked after this, so they inherit the fake.
+    monkeypatch.setattr(ocr_pool.pytesseract, "image_to_string", fake_image_to_string)
+    monkeypatch.setattr(ocr_pool, "tesserocr", None)
+
+
+def test_batches_keep_their_order_and_run_in_worker_processes(fake_tesseract, tmp_path):
+    levels = list(range(0, 250, 25))
+    images = [Image.new("L", (4, 4), level) for level in levels]
+    path = tmp_path / "scan.png"
+    images[3].save(path)
+    pool = OCRWorkerPool(max_workers=2, batch_size=3, language="deu")
+    try:
+        results = [text.split(":") for text in pool.image_to_string_batch(images)]
+        single = pool.image_to_string(str(path)).split(":")
+    finally:
+        pool.shutdown()
+
+    assert [(int(pixel), language) for _, _, pixel, language, _ in results] == [(level, "deu") for level in levels]
+    assert str(os.getpid()) not in {pid for *_, pid in results}
+    assert single[2] == "75"
+
+
+def test_the_pool_is_created_once_per_process(monkeypatch):
+    monkeypatch.setattr(ocr_pool, "_pool", None)
+    monkeypatch.setattr(ocr_pool, "OCRWorkerPool", lambda *args, **kwargs: object())
+    assert get_ocr_pool() is get_ocr_pool()
+
+
+def test_images_are_preprocessed_inside_the_worker(fake_tesseract, tmp_path):
+    preprocessor = ImagePreprocessor(max_long_edge=10, grayscale=True, cache_dir=str(tmp_path))
+    pool = OCRWorkerPool(max_workers=1)
+    try:
+        text = pool.image_to_string(Image.new("RGB", (40, 20), (255, 0, 0)), preprocessor=preprocessor)
+        mode, size, pixel, _, pid = text.split(":")
+    finally:
+        pool.shutdown()
+
+    assert (mode, size) == ("L", "10x5")
+    assert int(pixel) == Image.new("RGB", (1, 1), (255, 0, 0)).convert("L").getpixel((0, 0))
+    assert pid != str(os.getpid())
+
+
+def test_preprocess_stats_from_workers_are_counted_in_the_parent(monkeypatch, tmp_path):
+    monkeypatch.setattr(ocr_pool.pytesseract, "image_to_data", lambda image, **kwargs: {"text": [image.mode]})
+    monkeypatch.setattr(ocr_pool, "tesserocr", None)
+    monkeypatch.setattr(image_preprocess, "PREPROCESS_STATS", Counter())
+    paths = []
+    for index in range(3):
+        paths.append(str(tmp_path / f"scan{index}.png"))
+        Image.new("RGB", (400, 200), (index, 0, 0)).save(paths[-1])
+    preprocessor = ImagePreprocessor(max_long_edge=100, grayscale=True, cache_dir=str(tmp_path / "cache"))
+    pool = OCRWorkerPool(max_workers=2, batch_size=2)
+    try:
+        results = pool.preprocess_to_data_batch(paths, preprocessor)
+    finally:
+        pool.shutdown()
+
+    assert [data for _, data in results] == [{"text": ["L"]}] * 3
+    assert image_preprocess.PREPROCESS_STATS["images"] == 3
+    assert image_preprocess.PREPROCESS_STATS["pixels_saved"] == 3 * (400 * 200 - 100 * 50)
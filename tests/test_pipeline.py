@@ -0,0 +1,81 @@
+import asyncio
+import os
+
+from External.pipeline import Stage, StagedPipeline, get_process_pool
+
+
+def square_with_pid(value):
+    return value * value, os.getpid()
+
+
+def test_stages_run_in_order_and_drop_failures():
+    errors = []
+
+    def fail_on_three(value):
+        if value == 3:
+            raise ValueError("three")
+        return value
+
+    async def add_one(value):
+        return value + 1
+
+    pipeline = StagedPipeline(
+        [
+            Stage("check", fail_on_three, workers=2, mode="thread"),
+            Stage("add", add_one, workers=2, mode="async"),
+            Stage("collect", sum, mode="thread", batch_size=4),
+        ],
+        on_error=lambda stage, item, error: errors.append((stage, item)),
+    )
+    outputs = asyncio.run(pipeline.run(range(6)))
+
+    assert sum(outputs) == sum(value + 1 for value in range(6) if value != 3)
+    assert errors == [("check", 3)]
+    report = {row["stage"]: row for row in pipeline.report()}
+    assert report["check"]["items_in"] == 6 and report["check"]["errors"] == 1
+    assert report["add"]["items_out"] == 5
+
+
+def test_process_stage_reuses_its_pool_and_skips_it_for_one_item():
+    def run(items):
+        pipeline = StagedPipeline([Stage("square", square_with_pid, workers=2, mode="process")])
+        return asyncio.run(pipeline.run(items))
+
+    [(value, pid)] = run([3])
+    assert value == 9 and pid == os.getpid()
+
+    pids = {pid for _, pid in run([1, 2, 3])}
+    pool = get_process_pool(2)
+    pids |= {pid for _, pid in run([4, 5, 6])}
+    assert os.getpid() not in pids
+    assert get_process_pool(2) is pool
+
+
+def test_generator_stages_split_items_under_backpressure():
+    produced, leads, errors = [], [], []
+
+    def split(count):
+        for index in range(count):
+            produced.append(index)
+            yield count, index
+        if count == 3:
+            raise ValueError("three")
+
+    async def consume(item):
+        # The generator may only run a queue's worth ahead of this stage.
+        leads.append(len(produced) - len(leads))
+        await asyncio.sleep(0.001)
+        return item
+
+    pipeline = StagedPipeline(
+        [Stage("split", split, mode="thread"), Stage("consume", consume)],
+        queue_size=1,
+        on_error=lambda stage, item, error: errors.append((stage, item)),
+    )
+    outputs = asyncio.run(pipeline.run([20, 3]))
+
+    assert sorted(outputs) == sorted([(20, index) for index in range(20)] + [(3, index) for index in range(3)])
+    assert max(leads) <= 3
+    assert errors == [("split", 3)]
+    report = pipeline.report()[0]
+    assert report["items_in"] == 2 and report["items_out"] == 23 and report["errors"] == 1
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pytest
+
+from External.manifest import IngestManifest
+from External.numpy_store import EMBEDDINGS_FILE, NODES_FILE, SCALES_FILE, STATE_FILE, NumpyVectorStore
+from External.quantize_store import convert, remove_deeplake_files
+
+
+def make_store(path, count=40, width=16, seed=0):
+    embeddings = np.random.default_rng(seed).normal(size=(count, width)).astype(np.float32)
+    store = NumpyVectorStore(path)
+    ids = [f"n{index}" for index in range(count)]
+    store.add_vectors(ids, [f"text {node_id}" for node_id in ids], embeddings, [{"row": index} for index in range(count)])
+    return embeddings
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+def test_convert_keeps_nodes_and_search(tmp_path, capsys, quantization):
+    dataset = str(tmp_path / "store")
+    embeddings = make_store(dataset)
+
+    convert(dataset, quantization, check=True)
+
+    store = NumpyVectorStore(dataset)
+    assert store.quantization == quantization
+    assert os.path.exists(os.path.join(dataset, SCALES_FILE)) == (quantization == "int8")
+    assert len(store) == 40 and store.records[7] == {"id": "n7", "text": "text n7", "metadata": {"row": 7}}
+    assert store.records[store.search(embeddings[7], top_k=1)[0][0]]["id"] == "n7"
+    assert "recall@10" in capsys.readouterr().out
+
+
+def test_converting_back_to_float32_drops_the_scales(tmp_path):
+    dataset = str(tmp_path / "store")
+    make_store(dataset)
+    convert(dataset, "int8")
+
+    convert(dataset, "float32")
+
+    assert NumpyVectorStore(dataset).quantization == "float32"
+    assert not os.path.exists(os.path.join(dataset, SCALES_FILE))
+
+
+def test_only_deeplake_entries_are_removed(tmp_path):
+    dataset = tmp_path / "store"
+    make_store(str(dataset))
+    (dataset / "dataset_meta.json").write_text("{}")
+    (dataset / "embedding").mkdir()
+    (dataset / "embedding" / "chunks").write_text("")
+
+    remove_deeplake_files(str(dataset), os.listdir(dataset))
+
+    assert sorted(os.listdir(dataset)) == sorted([EMBEDDINGS_FILE, NODES_FILE, STATE_FILE])
+
+
+def test_convert_shortens_the_vectors(tmp_path, capsys):
+    dataset = str(tmp_path / "store")
+    embeddings = make_store(dataset)
+
+    convert(dataset, dimensions=8, check=True)
+
+    store = NumpyVectorStore(dataset)
+    assert store.dimensions == 8 and store.quantization == "float32"
+    assert np.allclose(np.linalg.norm(store.vectors(), axis=1), 1.0, atol=1e-5)
+    # A full-width query is cut to the new width.
+    assert store.records[store.search(embeddings[3], top_k=1)[0][0]]["id"] == "n3"
+    assert "float32/8d" in capsys.readouterr().out
+
+
+def test_shortening_updates_the_manifest_config(tmp_path):
+    dataset = str(tmp_path / "store")
+    make_store(dataset)
+    config = {"chunk_tokens": 500, "embedding_model": "model", "embedding_dimensions": 0}
+    IngestManifest(dataset, config=config).save()
+
+    convert(dataset, "int8")
+    assert IngestManifest(dataset, config=config).exists()
+
+    convert(dataset, dimensions=8)
+    assert IngestManifest(dataset, config=dict(config, embedding_dimensions=8)).exists()
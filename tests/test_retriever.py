@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("aih_rag")
+
+from External.keyword_index import KeywordIndex  # noqa: E402
+from External.numpy_store import NumpyVectorStore  # noqa: E402
+from External.retriever import FederatedRetriever, ScoredChunk, reciprocal_rank_fusion  # noqa: E402
+
+
+def make_store(path, rows):
+    """A NumPy store whose node `name` holds the given embedding."""
+    store = NumpyVectorStore(str(path))
+    names = list(rows)
+    store.add_vectors(names, [f"text {name}" for name in names], np.array([rows[name] for name in names]))
+    return str(path)
+
+
+def test_hits_are_merged_across_datasets_by_score(tmp_path):
+    first = make_store(tmp_path / "first", {"a": [1.0, 0.0], "b": [0.6, 0.8]})
+    second = make_store(tmp_path / "second", {"c": [0.8, 0.6], "d": [0.0, 1.0]})
+    retriever = FederatedRetriever(top_k=3, min_score=0.2, open_store=NumpyVectorStore)
+
+    hits, reports = retriever.retrieve([1.0, 0.0], [first, second])
+
+    assert [(hit.node_id, hit.dataset_path) for hit in hits] == [("a", first), ("c", second), ("b", first)]
+    assert hits[1].text == "text c" and hits[1].score == pytest.approx(0.8)
+    report = {row["dataset_path"]: row for row in reports}
+    assert report[first]["kept"] == 2 and report[second]["kept"] == 1
+    assert report[second]["above_min_score"] == 1
+
+
+def test_missing_and_failing_datasets_are_reported(tmp_path):
+    good = make_store(tmp_path / "good", {"a": [1.0, 0.0]})
+    broken = tmp_path / "broken"
+    broken.mkdir()
+
+    def open_store(dataset_path):
+        if dataset_path == str(broken):
+            raise OSError("cannot open")
+        return NumpyVectorStore(dataset_path)
+
+    retriever = FederatedRetriever(min_score=0.0, open_store=open_store)
+    hits, reports = retriever.retrieve([1.0, 0.0], [good, str(broken), str(tmp_path / "missing")])
+
+    assert [hit.node_id for hit in hits] == ["a"]
+    errors = {row["dataset_path"]: row["error"] for row in reports}
+    assert errors == {good: None, str(broken): "cannot open", str(tmp_path / "missing"): "missing"}
+
+
+def chunk(node_id, score=0.0, embedding=None):
+    return ScoredChunk(f"text {node_id}", score, "dataset", node_id, embedding)
+
+
+def test_chunks_in_both_lists_rise_to_the_top():
+    vector = [chunk("a", 0.9, [1.0]), chunk("b", 0.8), chunk("c", 0.7)]
+    keyword = [chunk("c", 12.0), chunk("d", 9.0)]
+    fused = reciprocal_rank_fusion([vector, keyword], k=60)
+
+    assert [hit.node_id for hit in fused][:2] == ["c", "a"]
+    assert {hit.node_id: hit.score for hit in fused[2:]} == {"b": 1 / 62, "d": 1 / 62}
+    assert fused[0].score == pytest.approx(1 / 63 + 1 / 61)
+    assert fused[1].embedding == [1.0]
+
+
+def test_same_node_id_in_different_datasets_is_not_merged():
+    first = [ScoredChunk("x", 1.0, "one", "n")]
+    second = [ScoredChunk("x", 1.0, "two", "n")]
+    assert len(reciprocal_rank_fusion([first, second])) == 2
+
+
+def test_keyword_hits_need_no_embedding(tmp_path):
+    paths = []
+    for name, texts in [("first", ["invoice INV-7 paid", "shipping"]), ("second", ["INV-7 overdue INV-7"])]:
+        (tmp_path / name).mkdir()
+        index = KeywordIndex(str(tmp_path / name))
+        index.add([f"{name}-{row}" for row in range(len(texts))], texts)
+        index.save()
+        paths.append(str(tmp_path / name))
+    retriever = FederatedRetriever(open_keywords=KeywordIndex)
+
+    hits, reports = retriever.retrieve_keywords("INV-7", paths, top_k=5)
+
+    assert {hit.node_id for hit in hits} == {"first-0", "second-0"}
+    assert all(hit.embedding is None for hit in hits)
+    assert [row["error"] for row in reports] == [None, None]
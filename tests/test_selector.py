@@ -0,0 +1,35 @@
+import numpy as np
+
+from External.chunking import HeuristicTokenCounter
+from External.selector import RetrievalSelector
+
+
+def selector(**kwargs):
+    settings = dict(min_score=0.2, max_gap=0.05, max_drop=0.15, min_k=1, max_k=8, counter=HeuristicTokenCounter())
+    settings.update(kwargs)
+    return RetrievalSelector(**settings)
+
+
+def test_cutoff_stops_at_a_gap_a_drop_or_the_minimum_score():
+    assert selector().cutoff([0.9, 0.88, 0.7, 0.69]) == 2
+    assert selector().cutoff([0.9, 0.86, 0.82, 0.78, 0.74]) == 4
+    assert selector().cutoff([0.3, 0.19]) == 1
+    assert selector().cutoff([0.1]) == 0
+    assert selector(min_k=3).cutoff([0.9, 0.5, 0.45, 0.44]) == 3
+
+
+def test_mmr_prefers_diverse_chunks_and_skips_near_copies():
+    embeddings = np.array([[1.0, 0.0], [1.0, 0.001], [0.6, 0.8]])
+    picked = selector(mmr_lambda=0.5).mmr([0.9, 0.89, 0.85], embeddings, top_k=3)
+    assert picked == [0, 2]
+
+
+def test_select_reports_tokens_saved_against_the_baseline():
+    texts = ["best answer here", "near copy of best", "unrelated", "noise"]
+    scores = [0.9, 0.89, 0.5, 0.1]
+    embeddings = [[1.0, 0.0], [1.0, 0.0], [0.0, 1.0], [0.5, 0.5]]
+    selected, report = selector(baseline_k=4).select(texts, scores, embeddings)
+
+    assert selected == [0]
+    assert report["candidates"] == 4 and report["above_cutoff"] == 2
+    assert report["tokens_saved"] == report["tokens_baseline"] - report["tokens_selected"] > 0
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("aih_rag")
+
+from External.manifest import manifest_path  # noqa: E402
+from External.store_registry import StoreRegistry  # noqa: E402
+
+
+class FakeStore:
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Opener:
+    """`open_store` that records what it opened; optionally slow."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.opened = []
+        self._lock = threading.Lock()
+
+    def __call__(self, dataset_path, overwrite=False):
+        assert overwrite is False
+        time.sleep(self.delay)
+        store = FakeStore(dataset_path)
+        with self._lock:
+            self.opened.append(store)
+        return store
+
+
+def dataset(tmp_path, name="dataset"):
+    path = tmp_path / name
+    path.mkdir()
+    return str(path)
+
+
+def test_open_store_is_reused(tmp_path):
+    path = dataset(tmp_path)
+    opener = Opener()
+    registry = StoreRegistry(open_store=opener)
+
+    store = registry.get(path)
+
+    assert registry.get(os.path.join(path, ".")) is store
+    assert len(opener.opened) == 1
+    assert registry.stats["hits"] == 1 and registry.stats["opened"] == 1
+
+
+def test_rewritten_dataset_is_reopened_and_the_old_handle_closed(tmp_path):
+    path = dataset(tmp_path)
+    registry = StoreRegistry(open_store=Opener())
+    old = registry.get(path)
+
+    with open(manifest_path(path), "w", encoding="utf-8") as file:
+        file.write("{}")
+    os.utime(manifest_path(path), ns=(1, 1))
+    new = registry.get(path)
+
+    assert new is not old and old.closed
+    assert registry.get(path) is new
+    assert registry.stats["reopened"] == 1
+
+
+def test_least_recently_used_and_idle_stores_are_closed(tmp_path):
+    paths = [dataset(tmp_path, name) for name in "abc"]
+    registry = StoreRegistry(max_open=2, open_store=Opener())
+    a, b = registry.get(paths[0]), registry.get(paths[1])
+    registry.get(paths[0])
+
+    registry.get(paths[2])
+
+    assert b.closed and not a.closed
+    assert len(registry) == 2 and registry.stats["evicted_lru"] == 1
+
+    registry.ttl = 0.0
+    time.sleep(0.01)
+    registry.sweep()
+    assert a.closed and len(registry) == 0
+
+
+def test_concurrent_gets_open_a_path_once(tmp_path):
+    path = dataset(tmp_path)
+    opener = Opener(delay=0.05)
+    registry = StoreRegistry(open_store=opener)
+    stores = []
+
+    threads = [threading.Thread(target=lambda: stores.append(registry.get(path))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(opener.opened) == 1
+    assert all(store is opener.opened[0] for store in stores) and len(stores) == 8
+    assert registry._opening == {}
+
+
+def test_per_path_open_locks_are_dropped_after_opening(tmp_path):
+    registry = StoreRegistry(open_store=Opener())
+    paths = [dataset(tmp_path, f"dataset{index}") for index in range(5)]
+    for path in paths:
+        registry.get(path)
+
+    def failing_open(dataset_path, overwrite=False):
+        raise OSError("unreadable")
+
+    registry.open_store = failing_open
+    with pytest.raises(OSError):
+        registry.get(dataset(tmp_path, "broken"))
+
+    assert registry._opening == {}
+    assert len(registry) == 5